@@ -16,7 +16,8 @@ DATA_FILES=[
     ('share/applications', ['data/usb-creator.desktop']),
     ('share/icons/hicolor/scalable/apps', ['data/usb-creator.svg']),
     ('share/usb-creator', ['data/usb-creator.glade']),
-    ('share/polkit-1/actions', ['data/org.debian.pkexec.usb-creator.tmp-sh.policy']),
+    ('share/polkit-1/actions', ['data/org.debian.pkexec.usb-creator.helper.policy']),
+    ('lib/usb-creator', ['scripts/usb-creator-helper']),
     ('share/solid/actions', ['data/usb-constructor-openusb.desktop'])
 ]
 
@@ -1,14 +1,6 @@
 #!/usr/bin/env python3 -OO
 
-# Make sure the right Gtk version is loaded
-import gi
-gi.require_version('Gtk', '3.0')
 import sys
-from gi.repository import Gtk
-
-# Local imports
-from .dialogs import ErrorDialog
-from .usbcreator import USBCreator
 
 # i18n: http://docs.python.org/3/library/gettext.html
 import gettext
@@ -22,6 +14,9 @@ class ArgsWrapper(object):
         parser.add_argument("-v", "--verbose", 
                             help="increase output verbosity",
                             action="store_true")
+        parser.add_argument("--startup-profile",
+                            help="print the time of each startup phase",
+                            action="store_true")
         self.args = parser.parse_args()
 
 
@@ -46,6 +41,7 @@ def uncaught_excepthook(*args):
             pdb.pm()
     else:
         import traceback
+        from .dialogs import ErrorDialog
         details = '\n'.join(traceback.format_exception(*args)).replace('<', '').replace('>', '')
         title = _('Unexpected error')
         msg = _('USB Creator has failed with the following unexpected error. Please submit a bug report!')
@@ -53,14 +49,24 @@ def uncaught_excepthook(*args):
 
     sys.exit(1)
 
-sys.excepthook = uncaught_excepthook
-
 # main entry
 def main():
+    from .startup import StartupProfile
+    wrapper = ArgsWrapper()
+    profile = StartupProfile(wrapper.args.startup_profile)
+
+    # The GUI modules are imported here so that the backend modules
+    # (e.g. isoreader) can be imported without loading Gtk
+    import gi
+    gi.require_version('Gtk', '3.0')
+    from gi.repository import Gtk
+    from .usbcreator import USBCreator
+    sys.excepthook = uncaught_excepthook
+    profile.mark('imports')
+
     # Create an instance of our GTK application
     try:
-        wrapper = ArgsWrapper() 
-        USBCreator(wrapper.args.verbose)
+        USBCreator(wrapper.args.verbose, profile)
         Gtk.main()
     except KeyboardInterrupt:
         pass
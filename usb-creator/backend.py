@@ -0,0 +1,764 @@
+#!/usr/bin/env python3
+
+# Backend of usb-creator: adds an ISO to (or removes it from) multi-boot
+# USB devices, or writes an ISO to whole devices (-u).
+# scripts/usb-creator execs this module for all command line options, so
+# the options and exit codes are the same as those of the former bash script.
+#
+# Everything that can be done in-process is: mount points come from
+# /proc/self/mountinfo, free space from statvfs, file system types and labels
+# from the udev database, disks and partitions from sysfs (topology.py), and
+# "device in use" from /proc (like fuser -m). Root operations go to the
+# privileged helper over its socket (helper.py). Only udisksctl (mount and
+# unmount as the user) and 7z (distributions that must be unpacked) are run
+# as child processes; their number is logged with the elapsed time.
+
+import os
+import re
+import sys
+import pwd
+import time
+import getopt
+import shutil
+import threading
+import subprocess
+from contextlib import contextmanager
+from os.path import join, exists, isdir, isfile, islink, basename, realpath, abspath
+
+from .progress import ProgressEmitter
+from .topology import get_topology
+from .helper import HelperClient, HelperError, mounts
+from .isocache import IsoCache, get_iso_info
+from .distros import DistroScorer
+from .templates import get_store
+from .grubcfg import update_grub_cfg
+from .copier import CopyEngine, CopyError, copy_targets, first_error, expected_digest
+
+FILES_DIR = '/usr/share/usb-creator'
+# Distros that need unpacking to get it to boot
+UNPACK_DISTROS = ('puppy',)
+PARTITION_LABEL = 'USBCREATOR'
+# FAT cannot hold files of 4 GiB and larger (KiB)
+MAX_FAT_SIZE = 4 * 1024 * 1024
+# Seconds to wait for a partition to show up in mountinfo after mounting it
+MOUNT_TIMEOUT = 5
+UDEV_DATA = '/run/udev/data'
+# Offset of the volume identifier in the primary volume descriptor
+ISO_LABEL_OFFSET = 32808
+
+# Exit codes
+EXIT_OK = 0
+EXIT_INVALID_ARGUMENT = 1
+EXIT_DEVICE_NOT_FOUND = 2
+EXIT_NOT_DETACHABLE = 3
+EXIT_PARTITION_NOT_FOUND = 4
+EXIT_MOUNT_FAILED = 5
+EXIT_ISO_NOT_FOUND = 6
+EXIT_ISO_TOO_LARGE = 7
+EXIT_NO_SPACE = 8
+EXIT_UNKNOWN_DISTRO = 9
+EXIT_TARGET_NOT_FOUND = 10
+EXIT_HASH_MISMATCH = 11
+EXIT_COPY_FAILED = 12
+EXIT_DEVICE_IN_USE = 13
+# Backend.cancel() (jobs.py), like a shell interrupted with Ctrl-C
+EXIT_CANCELLED = 130
+
+
+class BackendError(Exception):
+    def __init__(self, message, exit_code):
+        super(BackendError, self).__init__(message)
+        self.exit_code = exit_code
+
+
+# Exceptions a backend step can raise: logged and returned as exit code.
+# Steps turn their OSErrors into a BackendError with their own exit code
+# (os_errors); an OSError that is not wrapped is an unexpected error.
+BACKEND_ERRORS = (BackendError, CopyError, HelperError, OSError)
+
+
+def error_exit_code(error):
+    """ Return the exit code of an exception in BACKEND_ERRORS. """
+    return getattr(error, 'exit_code', EXIT_INVALID_ARGUMENT)
+
+
+@contextmanager
+def os_errors(exit_code, message):
+    """ Raise an OSError of a step as BackendError with the exit code of the step. """
+    try:
+        yield
+    except OSError as e:
+        raise BackendError("%s: %s" % (message, e), exit_code) from e
+
+
+# ===============================================
+# Devices, mounts and file systems
+# ===============================================
+
+def user_dir():
+    """ Return ~/.usb-creator of the login user (also when run with sudo). """
+    try:
+        name = os.getlogin()
+        home = pwd.getpwnam(name).pw_dir
+    except (OSError, KeyError):
+        home = pwd.getpwuid(os.getuid()).pw_dir
+    return join(home, '.usb-creator')
+
+
+def udev_properties(device):
+    """ Return the udev properties (ID_FS_TYPE, ID_FS_LABEL, ...) of a block device. """
+    properties = {}
+    try:
+        rdev = os.stat(device).st_rdev
+        with open(join(UDEV_DATA, 'b%d:%d' % (os.major(rdev), os.minor(rdev)))) as f:
+            for line in f:
+                if line.startswith('E:'):
+                    key, _, value = line[2:].rstrip('\n').partition('=')
+                    properties[key] = value
+    except OSError:
+        pass
+    return properties
+
+
+def fs_type(device):
+    return udev_properties(device).get('ID_FS_TYPE', '')
+
+
+def has_label(device):
+    """ Return True if a /dev/disk/by-label link points to device. """
+    by_label = '/dev/disk/by-label'
+    device = realpath(device)
+    try:
+        return any(realpath(join(by_label, name)) == device for name in os.listdir(by_label))
+    except OSError:
+        return False
+
+
+def mount_point(device):
+    """ Return the (first) mount point of a device or an empty string. """
+    device = realpath(device)
+    for point, source in mounts():
+        if source.startswith('/dev/') and realpath(source) == device:
+            return point
+    return ''
+
+
+def free_size(path):
+    """ Return the space available to the user on the file system of path in KiB. """
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize // 1024
+
+
+def processes_using(path):
+    """ Return the pids of processes with a working directory or open file on the
+        file system of path (like fuser -m, the own process excluded).
+    """
+    dev = os.stat(path).st_dev
+    own = str(os.getpid())
+    pids = []
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit() or pid == own:
+            continue
+        links = ['cwd', 'root', 'exe']
+        try:
+            links += [join('fd', fd) for fd in os.listdir(join('/proc', pid, 'fd'))]
+        except OSError:
+            pass
+        for link in links:
+            try:
+                if os.stat(join('/proc', pid, link)).st_dev == dev:
+                    pids.append(int(pid))
+                    break
+            except OSError:
+                continue
+    return pids
+
+
+def copy_tree(source, target):
+    """ Copy a directory tree over an existing one (like cp -rf, without modes:
+        FAT does not support them).
+    """
+    for dirpath, dirnames, filenames in os.walk(source):
+        target_dir = join(target, os.path.relpath(dirpath, source))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in filenames:
+            shutil.copyfile(join(dirpath, name), join(target_dir, name))
+
+
+def remove_path(path, log):
+    """ Remove a file or directory tree and log each removed path (like rm -rfv). """
+    if isdir(path) and not islink(path):
+        for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+            for name in filenames + [d for d in dirnames if islink(join(dirpath, d))]:
+                os.remove(join(dirpath, name))
+                log("removed '%s'" % join(dirpath, name))
+            os.rmdir(dirpath)
+            log("removed directory '%s'" % dirpath)
+    else:
+        os.remove(path)
+        log("removed '%s'" % path)
+
+
+# ===============================================
+# ISO information
+# ===============================================
+
+def read_iso_label(iso_path):
+    """ Return the volume identifier of the primary volume descriptor. """
+    try:
+        with open(iso_path, 'rb') as f:
+            f.seek(ISO_LABEL_OFFSET)
+            return f.read(32).decode('ascii', 'replace').strip()
+    except OSError:
+        return ''
+
+
+def get_iso_label(iso_path):
+    """ Return the label of an ISO from the ISO cache (or read from the ISO). """
+    if not iso_path or not isfile(iso_path):
+        return ''
+    cache = IsoCache()
+    try:
+        label = get_iso_info(iso_path, cache)['label']
+    finally:
+        cache.close()
+    return label.strip() if label else read_iso_label(iso_path)
+
+
+def introspect_iso(iso_path, scorer, cache=None, cancel=None):
+    """ Return the ISO information (isocache.INFO_COLUMNS) with the distribution
+        (family, distro) found by ISO label or else by ISO path.
+        A found distribution is saved in the ISO cache: the GUI introspects the
+        selected ISO ahead and the backend finds everything in the cache.
+        The cancel event (threading.Event) stops the ISO parsing with IsoCancelled.
+    """
+    info = get_iso_info(iso_path, cache, cancel)
+    if not info['label']:
+        info['label'] = read_iso_label(iso_path)
+    if not info['distro'] or not info['family']:
+        info['family'], info['distro'], ratio = scorer.check_os(info['label'], iso_path)
+        if info['distro'] and cache is not None and cache.get(iso_path) is not None:
+            cache.set(iso_path, {'family': info['family'], 'distro': info['distro']})
+    return info
+
+
+def menu_title(iso_name):
+    """ Menu title from the ISO name: debian-live-12.1.0-amd64-kde.iso -> Debian live 12.1.0 amd64-bit kde """
+    title = iso_name.replace('x86_', '')
+    title = re.sub('[-_]', ' ', title)
+    title = title.replace('64', '64-bit').replace('32', '32-bit')
+    title = re.sub('i*686', '32-bit', title)
+    title = title[:1].upper() + title[1:]
+    # Remove extension
+    if '.' in title:
+        title = title[:title.rfind('.')]
+    return title
+
+
+def cleanup(text):
+    """ Remove leading/trailing white spaces and some special characters. """
+    text = ''.join(' '.join(line.split()) for line in text.splitlines())
+    return re.sub(r'[()\[\]|/]', '', text)
+
+
+# ===============================================
+# Backend
+# ===============================================
+
+class Device(object):
+    """ Partitions and mount points of a USB device. """
+
+    def __init__(self, path):
+        self.path = path
+        self.partition = ''
+        self.fat_partition = ''
+        self.partition_fs = ''
+        self.mount = ''
+        self.fat_mount = ''
+
+
+class Backend(object):
+
+    def __init__(self, files_dir=FILES_DIR, log=print, emitter=None, helper=None):
+        self.files_dir = files_dir
+        self.log = log
+        self.emitter = emitter if emitter is not None else ProgressEmitter()
+        self.helper = helper if helper is not None else HelperClient()
+        self.remove = False
+        self.partition = False
+        self.unpack = False
+        self.force = False
+        self.os_family = ''
+        self.os_name = ''
+        # Child processes started (udisksctl, 7z)
+        self.processes = 0
+        self._scorer = None
+        self._cancel = threading.Event()
+        # Copy engines of the running copy
+        self._engines = []
+
+    @property
+    def scorer(self):
+        if self._scorer is None:
+            self._scorer = DistroScorer(join(self.files_dir, 'distributions', 'families'))
+        return self._scorer
+
+    def force_distribution(self, name):
+        """ Use the distribution name instead of the one found in the ISO (-f). """
+        self.os_family, self.os_name, ratio = self.scorer.check_os(name)
+        self.force = True
+
+    def run_command(self, args):
+        """ Run a command, log its output and return its exit code. """
+        self.processes += 1
+        try:
+            proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except OSError as e:
+            self.log("%s: %s" % (args[0], e))
+            return 127
+        for line in proc.stdout:
+            self.log(line.decode('utf-8', 'replace').rstrip())
+        return proc.wait()
+
+    def call_helper(self, op, files=(), **args):
+        try:
+            return self.helper.call(op, args, self.log, self.emitter, files)
+        except OSError as e:
+            raise HelperError("Lost connection to the privileged helper: %s" % e)
+
+    def phase(self, name):
+        self.check_cancelled()
+        self.emitter.phase(name)
+
+    def cancel(self):
+        """ Stop the backend at the next step or stop the running copy (from any thread).
+            Operations of the privileged helper (like -u) are not interrupted.
+        """
+        self._cancel.set()
+        for engine in list(self._engines):
+            engine.cancel()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise BackendError("Cancelled", EXIT_CANCELLED)
+
+    # ===============================================
+    # Steps
+    # ===============================================
+
+    def check_iso(self, iso):
+        """ Check the ISO before a device is touched (removing: the ISO is on the device). """
+        if not self.remove and not isfile(iso):
+            raise BackendError("%s does not exist." % iso, EXIT_ISO_NOT_FOUND)
+
+    def check_devices(self, devices):
+        topology = get_topology()
+        for device in devices:
+            if not exists(device):
+                raise BackendError("%s does not exist." % device, EXIT_DEVICE_NOT_FOUND)
+            if not topology.is_removable(device):
+                raise BackendError("%s is not a detachable device." % device, EXIT_NOT_DETACHABLE)
+
+    def write_image(self, iso, devices):
+        """ Write the ISO in large blocks with bounded writeback and verify it (exit codes 10-12). """
+        with os_errors(EXIT_ISO_NOT_FOUND, "Unable to read %s" % iso):
+            iso_size = os.path.getsize(iso) // 1024
+            expected = expected_digest(iso, '')
+        topology = get_topology()
+        for device in devices:
+            device_size = topology.get(device).size // 1024
+            if iso_size > device_size:
+                raise BackendError("Not enough space on %s. Needed: %d, Available: %d"
+                                   % (device, iso_size, device_size), EXIT_NO_SPACE)
+        self.log("DD %s to %s" % (iso, ' '.join(devices)))
+        # The ISO is opened here and passed to the helper, the published hash is read here too.
+        # The helper forwards the progress events to the emitter.
+        return self.call_helper('write_image', files=[iso], source=abspath(iso),
+                                devices=[abspath(d) for d in devices], verify=True,
+                                expected=expected)
+
+    def mount_partition(self, partition):
+        """ Return the mount point of a partition, mount it if needed. """
+        with os_errors(EXIT_MOUNT_FAILED, "Unable to mount %s" % partition):
+            point = mount_point(partition)
+            if not point:
+                self.run_command(['udisksctl', 'mount', '-b', partition, '--no-user-interaction'])
+                end = time.monotonic() + MOUNT_TIMEOUT
+                while not point and time.monotonic() < end:
+                    time.sleep(0.1)
+                    point = mount_point(partition)
+        if not point:
+            raise BackendError("%s could not be mounted." % partition, EXIT_MOUNT_FAILED)
+        return point
+
+    def prepare_device(self, path):
+        """ Partition (-p), find and mount the partitions of a device and copy the grub files. """
+        device = Device(path)
+        topology = get_topology()
+
+        if self.partition:
+            self.log("Partition %s" % path)
+            self.phase('partition')
+            self.call_helper('partition', device=abspath(path))
+            topology.refresh()
+            device.fat_partition = topology.partition(path, 2)
+            device.partition = topology.partition(path, 3)
+            device.partition_fs = 'ext4'
+
+        # Log device information
+        self.log('')
+        self.call_helper('device_info', device=abspath(path))
+
+        if not device.fat_partition and not device.partition:
+            # Loop through partition to find a fat partition
+            partitions = [p.path for p in topology.partitions(path)]
+            for part in partitions:
+                part_fs = fs_type(part)
+                is_fat = False
+                if not device.fat_partition and 'fat' in part_fs:
+                    device.fat_partition = part
+                    is_fat = True
+                if (not is_fat or len(partitions) == 1) and part_fs:
+                    device.partition = part
+                    device.partition_fs = part_fs
+                    # Label the partition if it has no label (systemrescuecd needs a USB partition label to boot from ISO)
+                    if not has_label(part):
+                        self.call_helper('set_label', partition=part, fstype=part_fs, label=PARTITION_LABEL)
+
+        # Check if device has partition
+        if not device.partition or not exists(device.partition):
+            raise BackendError("%s does not exist." % device.partition, EXIT_PARTITION_NOT_FOUND)
+
+        device.mount = self.mount_partition(device.partition)
+
+        # Make sure user is owner of boot mount
+        self.call_helper('chown', path=device.mount)
+
+        # Copy grub files to partition
+        with os_errors(EXIT_MOUNT_FAILED, "Unable to write the grub files to %s" % device.mount):
+            os.makedirs(join(device.mount, 'boot', 'grub', 'themes', 'usb-creator', 'icons'), exist_ok=True)
+            copy_tree(join(self.files_dir, 'grub', 'themes'), join(device.mount, 'boot', 'grub', 'themes'))
+            if exists('/usr/lib/syslinux/memdisk'):
+                shutil.copyfile('/usr/lib/syslinux/memdisk', join(device.mount, 'boot', 'memdisk'))
+        self.log("Grub files copied to %s/boot/grub/" % device.mount)
+
+        if not self.remove:
+            # Get the mount point of the fat partition
+            if device.partition != device.fat_partition:
+                device.fat_mount = self.mount_partition(device.fat_partition)
+            else:
+                device.fat_mount = device.mount
+        return device
+
+    def remove_iso(self, iso_name, devices):
+        for device in devices:
+            # Make sure ISO path points to mount when removing ISO
+            iso = join(device.mount, iso_name)
+            if not exists(iso):
+                raise BackendError("%s does not exist." % iso, EXIT_ISO_NOT_FOUND)
+            self.phase('remove')
+            with os_errors(EXIT_MOUNT_FAILED, "Unable to remove %s" % iso):
+                remove_path(iso, self.log)
+
+    def check_space(self, iso, devices):
+        with os_errors(EXIT_ISO_NOT_FOUND, "Unable to read %s" % iso):
+            iso_size = os.path.getsize(iso) // 1024
+        for device in devices:
+            # Check if ISO is smaller than 4G if copying to fat partition
+            if 'fat' in device.partition_fs and iso_size > MAX_FAT_SIZE:
+                raise BackendError("%s too large for FAT formatted USB (max 4GB). "
+                                   "Format the USB to exFAT, NTFS, ext4, etc." % iso, EXIT_ISO_TOO_LARGE)
+            with os_errors(EXIT_NO_SPACE, "Unable to get the free space on %s" % device.partition):
+                available = free_size(device.mount)
+            self.log("Check space on %s: available: %d, needed: %d" % (device.partition, available, iso_size))
+            if iso_size > available:
+                raise BackendError("Not enough space on %s. Needed: %d, Available: %d"
+                                   % (device.partition, iso_size, available), EXIT_NO_SPACE)
+
+    def inspect_iso(self, iso):
+        """ Return the ISO information (isocache.INFO_COLUMNS) and the distribution. """
+        with os_errors(EXIT_ISO_NOT_FOUND, "Unable to read %s" % iso):
+            cache = IsoCache()
+            try:
+                info = introspect_iso(iso, self.scorer, cache)
+            finally:
+                cache.close()
+        self.log("ISO information: %s" % ' '.join("%s=%s" % (k, v) for k, v in info.items() if v))
+        self.log("ISO label: %s" % info['label'])
+        family, name = info['family'], info['distro']
+        if self.force:
+            # Do not use loopback.cfg when the distribution is forced
+            info['loopback'] = ''
+            if self.os_name and self.os_family:
+                family, name = self.os_family, self.os_name
+        if name:
+            self.log("Found distribution: %s/%s" % (family, name))
+        return info, family, name
+
+    def gather(self, iso, devices):
+        """ Check the devices and the ISO, unpack it if needed (-> unpacked is True)
+            and render its menu entry. Returns (menu entry, unpacked).
+        """
+        iso_name = basename(iso)
+        # Gather info from ISO:
+        # Size, label, path to kernel and initramfs, existence of loopback.cfg
+        self.log("Gather ISO information: %s" % iso)
+        self.phase('gather')
+        self.check_space(iso, devices)
+        info, family, name = self.inspect_iso(iso)
+
+        unpacked = False
+        if name and name in UNPACK_DISTROS:
+            # Some distros only work if they are unpacked
+            self.phase('unpack')
+            for device in devices:
+                target = join(device.mount, iso_name)
+                self.log("Unpacking %s to %s" % (iso, target))
+                with os_errors(EXIT_COPY_FAILED, "Unable to unpack %s" % iso):
+                    os.makedirs(target, exist_ok=True)
+                self.run_command(['7z', 'x', iso, '-o%s/' % target, '-aoa'])
+            # Kernel was already searched: do not use loopback.cfg
+            info['loopback'] = ''
+            unpacked = True
+        elif info['loopback']:
+            # loopback.cfg found and its kernel paths exist in the ISO
+            # https://www.aioboot.com/en/boot-linux-iso/
+            self.log("Use loopback: %s" % info['loopback'])
+
+        if not name:
+            if not info['loopback']:
+                # There is no certain way to decide which configuration to use to boot this ISO
+                raise BackendError('Unable to determine distribution name. Use the -f parameter.',
+                                   EXIT_UNKNOWN_DISTRO)
+            self.log('Unable to determine distribution name. Default to linux.')
+            name = 'linux'
+
+        title = cleanup(menu_title(iso_name))
+        name = cleanup(name) or 'iso'
+
+        # Fill in the menuentry template: loopback-template when the ISO has a loopback.cfg,
+        # else the template of the distribution or the generic(-live) template of the family
+        values = {'MENUTITLE': title, 'CLASS': name, 'ISO': iso, 'ISONAME': iso_name,
+                  'ISOLABEL': info['label'], 'LOOPBACK': info['loopback'], 'VMLINUZ': info['vmlinuz'],
+                  'INITRD': info['initrd'], 'OPTIONS': info['options']}
+        with os_errors(EXIT_UNKNOWN_DISTRO, "Unable to read the menu entry template of %s" % name):
+            entry = get_store(self.files_dir).render_menuentry(values, family, name, bool(info['loopback']))
+        return entry.rstrip('\n') + '\n', unpacked
+
+    def copy_iso(self, iso, devices):
+        """ Copy the ISO: the source is hashed while copying, the target is verified afterwards.
+            More than one device: the ISO is read once and written to all devices in parallel.
+            Returns the exit code of the first failing device (10-12) or EXIT_OK.
+        """
+        targets = [join(device.mount, basename(iso)) for device in devices]
+        self.log("Copy %s to %s" % (iso, ' '.join(targets)))
+        self._engines = [CopyEngine(iso, target) for target in targets]
+        try:
+            self.check_cancelled()
+            with os_errors(EXIT_COPY_FAILED, "Unable to copy %s" % iso):
+                results = copy_targets(self._engines, self.log, self.emitter)
+        except CopyError:
+            # Cancelled before the copy started
+            if not self.cancelled:
+                raise
+            results = {}
+        finally:
+            self._engines = []
+        if self.cancelled:
+            # Do not leave partial ISOs on the devices
+            with os_errors(EXIT_COPY_FAILED, "Unable to remove the partial copy of %s" % iso):
+                for target in targets:
+                    if exists(target):
+                        os.remove(target)
+            raise BackendError("Copy of %s was cancelled" % iso, EXIT_CANCELLED)
+        if len(results) > 1:
+            for target, code in results.items():
+                self.log("Result %s: %d" % (target, code))
+        return first_error(results)
+
+    def install_grub(self, device):
+        """ Install EFI and legacy Grub (skipped when Grub is already in the MBR and on the EFI partition). """
+        self.log("Install Grub to %s" % device.path)
+        self.phase('grub')
+        self.call_helper('install_grub', device=abspath(device.path),
+                         efi_dir=device.fat_mount, boot_dir=join(device.mount, 'boot'))
+
+    def unmount(self, partition, mount):
+        """ Unmount a partition if no process uses it. """
+        with os_errors(EXIT_MOUNT_FAILED, "Unable to check %s" % mount):
+            in_use = processes_using(mount)
+        if in_use:
+            raise BackendError("%s is in use. Close any programs using the device." % partition,
+                               EXIT_DEVICE_IN_USE)
+        self.run_command(['udisksctl', 'unmount', '-b', partition, '--no-user-interaction'])
+
+    def finish_device(self, device, iso_name, entry=None):
+        """ Write grub.cfg of the device and unmount its partitions.
+            Menu entries of ISOs that are no longer on the device are removed,
+            the entry of iso_name is replaced in place or appended (removed when entry is None)
+        """
+        # https://wiki.archlinux.org/index.php/Multiboot_USB_drive#Configuring_GRUB
+        # https://github.com/aguslr/multibootusb/tree/master/mbusb.d
+        with os_errors(EXIT_MOUNT_FAILED, "Unable to write grub.cfg on %s" % device.mount):
+            update_grub_cfg(join(device.mount, 'boot', 'grub', 'grub.cfg'), iso_name, entry,
+                            join(self.files_dir, 'grub-template'), device.mount, self.log)
+        self.unmount(device.partition, device.mount)
+        if not self.remove and device.partition != device.fat_partition:
+            self.unmount(device.fat_partition, device.fat_mount)
+
+    def run(self, iso, device_paths):
+        """ Add the ISO to the devices, remove it (remove) or write it to the devices (unpack).
+            Returns an exit code.
+        """
+        self.check_iso(iso)
+        self.check_devices(device_paths)
+        if self.unpack:
+            return self.write_image(iso, device_paths)
+
+        devices = []
+        for path in device_paths:
+            self.check_cancelled()
+            devices.append(self.prepare_device(path))
+        iso_name = basename(iso)
+        entry = None
+        if self.remove:
+            self.remove_iso(iso_name, devices)
+        else:
+            entry, unpacked = self.gather(iso, devices)
+            if not unpacked:
+                code = self.copy_iso(iso, devices)
+                if code != EXIT_OK:
+                    return code
+            for device in devices:
+                self.install_grub(device)
+        for device in devices:
+            self.finish_device(device, iso_name, entry)
+        return EXIT_OK
+
+
+# ===============================================
+# Command line usage (called from scripts/usb-creator)
+# ===============================================
+
+class Log(object):
+    """ Print messages and append them to the log file (like tee -a). """
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def __call__(self, message):
+        print(message, flush=True)
+        if self.f is None:
+            self.f = open(self.path, 'a', encoding='utf-8')
+        self.f.write(message + '\n')
+        self.f.flush()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+def usage(families=''):
+    print("""
+USB Creator Help
+Usage: usb-creator [OPTIONS] [PATH_TO_ISO] [DEVICE] [DEVICE ...]
+
+-D                      Show all supported distribution names.
+-d [family_name]        Show supported distribution names by family name:
+                        %s
+-f [distribution_name]  Force distribution name (see -D or -d parameter)
+-h                      This help screen.
+-l [path_to_iso]        Show ISO label
+-p                      Partition the USB device
+-r                      Remove the ISO from the USB device.
+-s [path_to_iso]        Show distribution name from ISO path
+-u                      Unpack ISO to USB device
+
+No parameters           Start the GUI
+-v                      Starts GUI with verbose output
+--startup-profile       Starts GUI and prints the time of each startup phase
+""" % families)
+
+
+def main(args=None, files_dir=FILES_DIR):
+    if args is None:
+        args = sys.argv[1:]
+    start = time.monotonic()
+    folder = user_dir()
+    os.makedirs(folder, exist_ok=True)
+    backend = Backend(files_dir, emitter=ProgressEmitter.from_env())
+
+    try:
+        opts, args = getopt.getopt(args, 'd:Df:hl:prs:u')
+    except getopt.GetoptError as e:
+        print(e, file=sys.stderr)
+        usage(' '.join(backend.scorer.families))
+        return EXIT_INVALID_ARGUMENT
+    for opt, value in opts:
+        if opt == '-D':
+            # Show list with distribution names
+            print(' '.join(backend.scorer.get_distros()))
+            return EXIT_OK
+        if opt == '-d':
+            # Show list with distribution names by family name
+            if value.lower() in backend.scorer.families:
+                print(' '.join(backend.scorer.get_distros(value)))
+            return EXIT_OK
+        if opt == '-f':
+            backend.force_distribution(value)
+        elif opt == '-h':
+            usage(' '.join(backend.scorer.families))
+            return EXIT_OK
+        elif opt == '-l':
+            # Show iso label
+            if isfile(value):
+                print(get_iso_label(value))
+            return EXIT_OK
+        elif opt == '-p':
+            backend.partition = True
+        elif opt == '-r':
+            backend.remove = True
+        elif opt == '-s':
+            # Show distribution name
+            if isfile(value):
+                label = get_iso_label(value) or basename(value)
+                print(backend.scorer.check_os(label)[1])
+            return EXIT_OK
+        elif opt == '-u':
+            backend.unpack = True
+
+    # Get required positional arguments ISO and Device(s)
+    if not args:
+        print('Missing ISO path.', file=sys.stderr)
+        return EXIT_INVALID_ARGUMENT
+    if len(args) < 2:
+        print('Missing device path.', file=sys.stderr)
+        return EXIT_INVALID_ARGUMENT
+    # The ISO can be written to more than one device: the ISO is read only once
+    iso, devices = args[0], args[1:]
+
+    log = Log(join(folder, 'usb-creator.log'))
+    backend.log = log
+    log("==========>>>>> Start log at %s <<<<<==========" % time.strftime('%a %d %b %Y %H:%M:%S %Z'))
+    code = EXIT_INVALID_ARGUMENT
+    try:
+        code = backend.run(iso, devices)
+    except BACKEND_ERRORS as e:
+        log(str(e))
+        code = error_exit_code(e)
+    finally:
+        backend.emitter.exit(code)
+        log("Finished with exit code %d in %.1f seconds (%d child processes)"
+            % (code, time.monotonic() - start, backend.processes))
+        log.close()
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
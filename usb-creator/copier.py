@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+
+# Streaming ISO copy engine.
+# A reader thread fills large page aligned buffers and hashes them while a
+# writer thread writes the previous buffer to the target (double buffering).
+# The source is read once: its digest is known when the copy is done and
+# only the target needs to be read back for verification.
+#
+# Several targets are written from a single read of the source (FanOutCopy).
+#
+# The writer records a digest per chunk (manifest). The target is verified
+# against the manifest with the page cache bypassed (O_DIRECT or dropped
+# pages) so the data is really read from the device, and verification
+# stops at the first bad chunk.
+
+import os
+import mmap
+import time
+import hashlib
+import threading
+from queue import Queue
+from os.path import exists, basename
+
+
+# Exit codes of scripts/usb-creator
+EXIT_OK = 0
+EXIT_TARGET_NOT_FOUND = 10
+EXIT_HASH_MISMATCH = 11
+EXIT_COPY_FAILED = 12
+
+BUFFER_SIZE = 4 * 1024 * 1024
+BUFFER_COUNT = 2
+HASH_NAME = 'sha256'
+# Fast digest for the chunk manifest
+CHUNK_HASH_NAME = 'blake2b'
+# Shared buffers when copying to several targets
+FANOUT_BUFFER_COUNT = 8
+# Seconds between progress reports
+PROGRESS_INTERVAL = 1
+
+
+class CopyError(Exception):
+    def __init__(self, message, exit_code=EXIT_COPY_FAILED):
+        super(CopyError, self).__init__(message)
+        self.exit_code = exit_code
+
+
+class VerifyError(CopyError):
+    def __init__(self, message, offset):
+        super(VerifyError, self).__init__(message, EXIT_HASH_MISMATCH)
+        self.offset = offset
+
+
+def chunk_digest(data):
+    return hashlib.new(CHUNK_HASH_NAME, data, digest_size=16).digest()
+
+
+def drop_cache(fd):
+    # Remove (clean) pages of this file from the page cache
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except (AttributeError, OSError):
+        pass
+
+
+def open_uncached(path):
+    """ Open a file for reading without using the page cache.
+        Returns (fd, direct): O_DIRECT if the file system supports it,
+        otherwise cached pages are dropped before reading.
+    """
+    flags = os.O_RDONLY
+    o_direct = getattr(os, 'O_DIRECT', 0)
+    if o_direct:
+        try:
+            return (os.open(path, flags | o_direct), True)
+        except OSError:
+            pass
+    fd = os.open(path, flags)
+    drop_cache(fd)
+    return (fd, False)
+
+
+class CopyEngine(object):
+    """ Copy source to target with a reader/writer thread pair.
+
+    progress_callback(phase, bytes_done, bytes_total, bytes_per_sec) is called
+    from the writer thread at most every progress_interval seconds.
+    """
+
+    def __init__(self, source, target, buffer_size=BUFFER_SIZE, buffer_count=BUFFER_COUNT,
+                 progress_callback=None, progress_interval=PROGRESS_INTERVAL, source_name=None):
+        self.source = source
+        # Name of the source in messages (the source can be a /proc/self/fd path)
+        self.source_name = source_name or source
+        self.target = target
+        # Keep the buffer size a multiple of the page size
+        self.buffer_size = max(mmap.PAGESIZE, buffer_size - buffer_size % mmap.PAGESIZE)
+        self.buffer_count = max(2, buffer_count)
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self.total = 0
+        self.done = 0
+        self.elapsed = 0
+        self.source_digest = ''
+        # (offset, length, digest) of every written chunk
+        self.manifest = []
+        self._error = None
+        self._cancel = threading.Event()
+        self._stop = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+        self._stop.set()
+
+    @property
+    def rate(self):
+        # Average bytes per second
+        if self.elapsed > 0:
+            return self.done / self.elapsed
+        return 0
+
+    def _report(self, phase, done, total, rate):
+        if self.progress_callback is not None:
+            self.progress_callback(phase, done, total, rate)
+
+    def _open_target(self):
+        try:
+            return open(self.target, 'wb')
+        except OSError as e:
+            raise CopyError("Unable to create %s: %s" % (self.target, e), EXIT_TARGET_NOT_FOUND)
+
+    def _write(self, dst, offset, data, digest):
+        dst.write(data)
+
+    def _flush(self, dst):
+        dst.flush()
+        os.fsync(dst.fileno())
+        # Written pages are clean now: drop them so verify reads the device
+        drop_cache(dst.fileno())
+
+    def _start(self):
+        self.total = os.path.getsize(self.source)
+        self.done = 0
+        self.manifest = []
+        self._error = None
+        if self._cancel.is_set():
+            raise CopyError("Copy of %s was cancelled" % self.source_name)
+        self._stop.clear()
+
+    def _write_chunk(self, dst, data):
+        digest = chunk_digest(data)
+        self.manifest.append((self.done, len(data), digest))
+        self._write(dst, self.done, data, digest)
+        self.done += len(data)
+
+    def _reader(self, src, free, full):
+        hasher = hashlib.new(HASH_NAME)
+        try:
+            while not self._stop.is_set():
+                buf = free.get()
+                n = src.readinto(buf)
+                if not n:
+                    free.put(buf)
+                    break
+                hasher.update(memoryview(buf)[:n])
+                full.put((buf, n))
+            self.source_digest = hasher.hexdigest()
+        except OSError as e:
+            self._error = CopyError("Read error on %s: %s" % (self.source_name, e))
+            self._stop.set()
+        finally:
+            # End of stream
+            full.put((None, 0))
+
+    def copy(self):
+        """ Copy source to target. Returns the hex digest of the source. """
+        self._start()
+        dst = self._open_target()
+
+        free = Queue()
+        full = Queue()
+        for _ in range(self.buffer_count):
+            free.put(mmap.mmap(-1, self.buffer_size))
+
+        start = time.monotonic()
+        last_report = start
+        last_done = 0
+        with open(self.source, 'rb', buffering=0) as src, dst:
+            reader = threading.Thread(target=self._reader, args=(src, free, full))
+            reader.daemon = True
+            reader.start()
+            try:
+                while True:
+                    buf, n = full.get()
+                    if buf is None:
+                        break
+                    if not self._stop.is_set():
+                        self._write_chunk(dst, memoryview(buf)[:n])
+                    free.put(buf)
+                    now = time.monotonic()
+                    if now - last_report >= self.progress_interval:
+                        self._report('copy', self.done, self.total, (self.done - last_done) / (now - last_report))
+                        last_report = now
+                        last_done = self.done
+                self._flush(dst)
+            except OSError as e:
+                self._stop.set()
+                raise CopyError("Write error on %s: %s" % (self.target, e))
+            finally:
+                self._stop.set()
+                # Unblock the reader if it waits for a free buffer
+                free.put(mmap.mmap(-1, mmap.PAGESIZE))
+                reader.join()
+
+        self.elapsed = time.monotonic() - start
+        if self._error is not None:
+            raise self._error
+        if self.done != self.total:
+            raise CopyError("Copy of %s was interrupted" % self.source_name)
+        self._report('copy', self.done, self.total, self.rate)
+        return self.source_digest
+
+    def verify(self):
+        """ Read the target back from the device and compare every chunk with
+            the manifest. Raises VerifyError at the first bad chunk.
+        """
+        if not self.manifest:
+            return
+        buf = mmap.mmap(-1, self.buffer_size)
+        view = memoryview(buf)
+        fd, direct = open_uncached(self.target)
+        start = time.monotonic()
+        last_report = start
+        try:
+            for offset, length, digest in self.manifest:
+                if self._cancel.is_set():
+                    raise CopyError("Verification of %s was cancelled" % self.target)
+                n = -1
+                if direct and offset % mmap.PAGESIZE == 0:
+                    try:
+                        n = os.preadv(fd, [buf], offset)
+                    except OSError:
+                        n = -1
+                if n < 0:
+                    if direct:
+                        # O_DIRECT not possible: fall back to dropping the cached pages
+                        os.close(fd)
+                        fd = os.open(self.target, os.O_RDONLY)
+                        drop_cache(fd)
+                        direct = False
+                    n = os.preadv(fd, [buf], offset)
+                n = min(n, length)
+                if n != length or chunk_digest(view[:n]) != digest:
+                    raise VerifyError("Hash mismatch of %s at offset %d" % (self.target, offset), offset)
+                now = time.monotonic()
+                if now - last_report >= self.progress_interval:
+                    done = offset + length
+                    self._report('verify', done, self.total, done / (now - start))
+                    last_report = now
+            self._report('verify', self.total, self.total, self.total / max(time.monotonic() - start, 1e-6))
+        finally:
+            os.close(fd)
+
+
+class FanOutCopy(object):
+    """ Copy one source to the targets of several engines (CopyEngine or RawWriter).
+
+    The source is read and hashed once into a ring of buffer_count shared
+    buffers and every target has its own writer thread. A buffer goes back to
+    the reader when all writers are done with it: a slow target holds up the
+    reader, but never more than buffer_count buffers are in use.
+    """
+
+    def __init__(self, engines, buffer_count=FANOUT_BUFFER_COUNT):
+        self.engines = engines
+        self.source = engines[0].source
+        self.source_name = engines[0].source_name
+        self.buffer_size = engines[0].buffer_size
+        self.buffer_count = max(2, buffer_count)
+        self.source_digest = ''
+        # Exit code and error per target
+        self.results = {}
+        self.errors = {}
+        self._cancel = threading.Event()
+        self._refs = {}
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        self._cancel.set()
+        for engine in self.engines:
+            engine.cancel()
+
+    def _release(self, buf, free):
+        with self._lock:
+            self._refs[id(buf)] -= 1
+            unused = self._refs[id(buf)] == 0
+        if unused:
+            free.put(buf)
+
+    def _writer_error(self, engine, error):
+        """ Return error as CopyError (any exception of a writer fails its target only). """
+        if isinstance(error, CopyError):
+            return error
+        if isinstance(error, OSError):
+            return CopyError("Write error on %s: %s" % (engine.target, error))
+        return CopyError("Copy to %s failed: %r" % (engine.target, error))
+
+    def _writer(self, engine, chunks, free):
+        error = None
+        dst = None
+        try:
+            dst = engine._open_target()
+        except Exception as e:
+            error = self._writer_error(engine, e)
+            engine._stop.set()
+        start = time.monotonic()
+        last_report = start
+        last_done = 0
+        while True:
+            buf, n = chunks.get()
+            if buf is None:
+                break
+            try:
+                if error is None and not engine._stop.is_set():
+                    engine._write_chunk(dst, memoryview(buf)[:n])
+                    now = time.monotonic()
+                    if now - last_report >= engine.progress_interval:
+                        engine._report('copy', engine.done, engine.total,
+                                       (engine.done - last_done) / (now - last_report))
+                        last_report = now
+                        last_done = engine.done
+            except Exception as e:
+                error = self._writer_error(engine, e)
+                engine._stop.set()
+            finally:
+                # Always release the buffer: a failed target must not stall the others
+                self._release(buf, free)
+        try:
+            if dst is not None:
+                try:
+                    if error is None:
+                        engine._flush(dst)
+                finally:
+                    dst.close()
+            engine.elapsed = time.monotonic() - start
+            if error is None and engine.done != engine.total:
+                error = CopyError("Copy of %s to %s was interrupted" % (self.source_name, engine.target))
+            if error is None:
+                engine._report('copy', engine.done, engine.total, engine.rate)
+        except Exception as e:
+            if error is None:
+                error = self._writer_error(engine, e)
+        self.errors[engine.target] = error
+        self.results[engine.target] = error.exit_code if error is not None else EXIT_OK
+
+    def copy(self):
+        """ Copy the source to all targets. Returns {target: exit code}. """
+        for engine in self.engines:
+            engine._start()
+        # Results in the order of the targets: failed until the writer of a target finishes
+        self.results = {engine.target: EXIT_COPY_FAILED for engine in self.engines}
+        self.errors = {engine.target: CopyError("Copy of %s to %s did not finish"
+                                                % (self.source_name, engine.target))
+                       for engine in self.engines}
+        free = Queue()
+        for _ in range(self.buffer_count):
+            free.put(mmap.mmap(-1, self.buffer_size))
+        queues = []
+        writers = []
+        for engine in self.engines:
+            chunks = Queue()
+            writer = threading.Thread(target=self._writer, args=(engine, chunks, free))
+            writer.daemon = True
+            writer.start()
+            queues.append(chunks)
+            writers.append(writer)
+
+        read_error = None
+        hasher = hashlib.new(HASH_NAME)
+        try:
+            with open(self.source, 'rb', buffering=0) as src:
+                while not self._cancel.is_set():
+                    if all(engine._stop.is_set() for engine in self.engines):
+                        # Every target failed
+                        break
+                    buf = free.get()
+                    n = src.readinto(buf)
+                    if not n:
+                        free.put(buf)
+                        break
+                    hasher.update(memoryview(buf)[:n])
+                    with self._lock:
+                        self._refs[id(buf)] = len(queues)
+                    for chunks in queues:
+                        chunks.put((buf, n))
+            self.source_digest = hasher.hexdigest()
+        except OSError as e:
+            read_error = CopyError("Read error on %s: %s" % (self.source_name, e))
+        finally:
+            # End of stream
+            for chunks in queues:
+                chunks.put((None, 0))
+            for writer in writers:
+                writer.join()
+
+        for engine in self.engines:
+            engine.source_digest = self.source_digest
+            if read_error is not None:
+                self.errors[engine.target] = read_error
+                self.results[engine.target] = read_error.exit_code
+        return self.results
+
+
+def expected_digest(source, source_digest):
+    # Use the published hash of the ISO if it is available
+    sidecar = "%s.%s" % (source, HASH_NAME)
+    if exists(sidecar):
+        with open(sidecar, 'r') as f:
+            words = f.read().split()
+            if words:
+                return words[0].lower()
+    return source_digest
+
+
+def format_rate(bytes_per_sec):
+    return "%.1f MB/s" % (bytes_per_sec / (1024 * 1024))
+
+
+def progress_logger(log, emitter=None, label='', copy_phase='copy'):
+    """ Return a progress callback that logs the percentage every PROGRESS_INTERVAL
+        seconds and sends the progress to emitter (progress.ProgressEmitter).
+    """
+    last_log = [time.monotonic()]
+
+    def progress(phase, done, total, rate):
+        if phase == 'copy':
+            phase = copy_phase
+        if emitter is not None:
+            emitter.update(phase, done, total, force=done == total)
+        now = time.monotonic()
+        if now - last_log[0] < PROGRESS_INTERVAL or done == total:
+            return
+        last_log[0] = now
+        perc = int(done * 100 / total) if total else 100
+        if phase == 'verify':
+            log("%sVerified: %d%% (%s)" % (label, perc, format_rate(rate)))
+        else:
+            log("%sCopied: %d%% (%s)" % (label, perc, format_rate(rate)))
+    return progress
+
+
+def copy_targets(engines, log=print, emitter=None, verify=True, copy_phase='copy', expected=None):
+    """ Copy the source of the engines to their targets (read once for all targets),
+        check the source with its published hash (expected, or read from the
+        .sha256 file next to the source) and verify the targets.
+        Returns {target: exit code of scripts/usb-creator}.
+    """
+    source = engines[0].source
+    source_name = engines[0].source_name
+    total = os.path.getsize(source)
+    multi = len(engines) > 1
+    interval = PROGRESS_INTERVAL
+    if emitter is not None and emitter.enabled:
+        interval = min(interval, emitter.interval)
+    emitters = {}
+    labels = {}
+    for engine in engines:
+        emitters[engine.target] = emitter.for_target(engine.target) if emitter is not None and multi else emitter
+        labels[engine.target] = "%s: " % engine.target if multi else ''
+        engine.progress_callback = progress_logger(log, emitters[engine.target],
+                                                   labels[engine.target], copy_phase)
+        engine.progress_interval = interval
+        if emitters[engine.target] is not None:
+            emitters[engine.target].phase(copy_phase, total)
+
+    log("Prepare copy %s" % basename(source_name))
+    if multi:
+        fanout = FanOutCopy(engines)
+        results = fanout.copy()
+        errors = fanout.errors
+        source_digest = fanout.source_digest
+    else:
+        engine = engines[0]
+        results = {engine.target: EXIT_OK}
+        errors = {engine.target: None}
+        try:
+            source_digest = engine.copy()
+        except CopyError as e:
+            results[engine.target] = e.exit_code
+            errors[engine.target] = e
+            source_digest = ''
+
+    copied = []
+    for engine in engines:
+        target = engine.target
+        if results[target] != EXIT_OK:
+            log(str(errors[target]))
+        elif not exists(target):
+            log("Unable to verify hash: %s does not exist" % target)
+            results[target] = EXIT_COPY_FAILED
+        else:
+            log("%sCopied: 100%% in %.1f seconds (%s)" % (labels[target], engine.elapsed, format_rate(engine.rate)))
+            copied.append(engine)
+    if not copied:
+        return results
+
+    # Check the source with the published hash
+    if expected is None:
+        expected = expected_digest(source, source_digest)
+    if expected != source_digest:
+        log("Hash mismatch of %s. Original: %s, Source: %s" % (source_name, expected, source_digest))
+        for engine in copied:
+            results[engine.target] = EXIT_HASH_MISMATCH
+        return results
+
+    if not verify:
+        return results
+
+    # Verify the targets on the devices against the chunk manifest (in parallel)
+    def verify_target(engine):
+        log("Verify hash of %s" % engine.target)
+        if emitters[engine.target] is not None:
+            emitters[engine.target].phase('verify', engine.total)
+        try:
+            engine.verify()
+        except CopyError as e:
+            # VerifyError or cancelled
+            log(str(e))
+            results[engine.target] = e.exit_code
+        except OSError as e:
+            log("Unable to verify hash of %s: %s" % (engine.target, e))
+            results[engine.target] = EXIT_COPY_FAILED
+
+    if len(copied) == 1:
+        verify_target(copied[0])
+    else:
+        verifiers = [threading.Thread(target=verify_target, args=(engine,)) for engine in copied]
+        for verifier in verifiers:
+            verifier.start()
+        for verifier in verifiers:
+            verifier.join()
+    return results
+
+
+def first_error(results):
+    """ Return the first non-zero exit code of {target: exit code} or EXIT_OK. """
+    for code in results.values():
+        if code != EXIT_OK:
+            return code
+    return EXIT_OK
+
+
+def copy_iso(source, target, log=print, emitter=None):
+    """ Copy and verify an ISO. Returns an exit code of scripts/usb-creator.
+        Progress events are sent to emitter (progress.ProgressEmitter) as well.
+    """
+    return copy_targets([CopyEngine(source, target)], log, emitter)[target]
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+# Precompiled candidate index of the distribution families file.
+# Character bigrams map to the distribution names that contain them so that
+# only plausible names are passed to the (slow) fuzzy scorer.
+#
+# Compiled by the update target of debian/rules, after get-distro-families.sh
+# has refreshed the families file:
+#   distroindex compile data/files/distributions/families
+#
+# Why the prefilter never drops a name with a fuzzy partial ratio above MIN_RATIO:
+# partial_ratio compares the shorter string (length L) with a window (length W <= L)
+# of the longer string: ratio = 2M / (L + W), M = matched characters.
+# - M >= r * L / (2 - r): the name needs at least that many characters in the query.
+# - The matched characters form blocks. Blocks are separated by at least one
+#   unmatched character, so there are at most (L - M) + (W - M) + 1 blocks and at
+#   least M - blocks bigrams of the name are also bigrams of the query:
+#   shared >= M * (3 - 2 / r) - 1
+
+import sys
+import json
+from os.path import exists, getmtime
+from collections import Counter
+
+from .utils import get_config_dict
+
+INDEX_VERSION = 1
+NGRAM = 2
+# Minimum fuzzy ratio to accept a distribution name
+MIN_RATIO = 80
+
+
+def ngrams(text):
+    return [text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)]
+
+
+# Lower bounds for a (rounded) ratio above min_ratio
+def required_matches(length, min_ratio=MIN_RATIO):
+    r = (min_ratio + 0.5) / 100
+    return r * length / (2 - r)
+
+
+def required_ngrams(length, min_ratio=MIN_RATIO):
+    r = (min_ratio + 0.5) / 100
+    return required_matches(length, min_ratio) * (3 - 2 / r) - 1
+
+
+def load_families(families_file):
+    """ Return ([family, ...], [(family, name), ...]) from the families file. """
+    cfg = get_config_dict(families_file)
+    families = cfg.get('FAMILIES', '').split()
+    candidates = []
+    for family in families:
+        for name in cfg.get(family.upper(), '').split():
+            candidates.append((family, name))
+    return (families, candidates)
+
+
+class DistroIndex(object):
+
+    def __init__(self):
+        self.families = []
+        # (family, name) tuples in families file order
+        self.candidates = []
+        # Unique names sorted by length (longest first), then file order:
+        # the first name that scores 100 cannot be beaten.
+        self.names = []
+        self.family_of = {}
+        self.ngram_index = {}
+        # Names too short to contain a bigram
+        self.short_ids = []
+        self._char_counts = []
+
+    @classmethod
+    def from_candidates(cls, families, candidates):
+        index = cls()
+        index.families = list(families)
+        index.candidates = list(candidates)
+        index._compile()
+        return index
+
+    @classmethod
+    def from_families(cls, families_file):
+        return cls.from_candidates(*load_families(families_file))
+
+    @classmethod
+    def load(cls, index_file):
+        with open(index_file, 'r') as f:
+            data = json.load(f)
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError("Unsupported index version: %s" % data.get('version'))
+        index = cls()
+        index.families = data['families']
+        index.candidates = [tuple(c) for c in data['candidates']]
+        index.names = data['names']
+        index.family_of = data['family_of']
+        index.ngram_index = {k: [tuple(v) for v in ids] for k, ids in data['ngrams'].items()}
+        index.short_ids = data['short']
+        index._char_counts = [Counter(n) for n in index.names]
+        return index
+
+    @classmethod
+    def load_or_compile(cls, families_file, index_file=None):
+        """ Use the precompiled index if it is newer than the families file. """
+        if index_file is None:
+            index_file = families_file + '.idx'
+        if exists(index_file) and exists(families_file) \
+           and getmtime(index_file) >= getmtime(families_file):
+            try:
+                return cls.load(index_file)
+            except (ValueError, KeyError, OSError):
+                pass
+        if exists(families_file):
+            return cls.from_families(families_file)
+        return cls()
+
+    def save(self, index_file):
+        data = {'version': INDEX_VERSION,
+                'families': self.families,
+                'candidates': self.candidates,
+                'names': self.names,
+                'family_of': self.family_of,
+                'ngrams': self.ngram_index,
+                'short': self.short_ids}
+        with open(index_file, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+
+    def _compile(self):
+        order = []
+        for family, name in self.candidates:
+            if name not in self.family_of:
+                self.family_of[name] = family
+                order.append(name)
+        self.names = sorted(order, key=lambda n: -len(n))
+        self.ngram_index = {}
+        self.short_ids = []
+        for i, name in enumerate(self.names):
+            grams = Counter(ngrams(name))
+            if not grams:
+                self.short_ids.append(i)
+            for gram, cnt in grams.items():
+                # (name id, occurrences of the bigram in the name)
+                self.ngram_index.setdefault(gram, []).append((i, cnt))
+        self._char_counts = [Counter(n) for n in self.names]
+
+    def plausible(self, query):
+        """ Return the ids (in scan order) of the names that can reach MIN_RATIO. """
+        query_len = len(query)
+        if query_len < NGRAM:
+            return list(range(len(self.names)))
+        hits = Counter()
+        for gram in set(ngrams(query)):
+            for i, cnt in self.ngram_index.get(gram, ()):
+                hits[i] += cnt
+        query_chars = Counter(query)
+        ids = []
+        for i, shared in hits.items():
+            name = self.names[i]
+            length = len(name)
+            if length < query_len:
+                if shared < required_ngrams(length):
+                    continue
+                overlap = sum((self._char_counts[i] & query_chars).values())
+                if overlap < required_matches(length):
+                    continue
+            ids.append(i)
+        ids.extend(self.short_ids)
+        return sorted(ids)
+
+    def substring_match(self, query, ids):
+        """ Return the longest name with ratio 100: the name is part of the query
+            or the query is part of the name ('ubuntu' -> ubuntustudio).
+            Names are scanned longest first, so this is the name the fuzzy
+            scorer picks on a ratio of 100.
+        """
+        for i in ids:
+            name = self.names[i]
+            if name in query or query in name:
+                return name
+        return ''
+
+
+# ===============================================
+# Command line usage (called from the update target of debian/rules)
+# ===============================================
+
+def usage():
+    print("Usage: distroindex compile FAMILIES_FILE [INDEX_FILE]")
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) < 2 or args[0] != 'compile' or not exists(args[1]):
+        usage()
+        return 1
+    index_file = args[2] if len(args) > 2 else args[1] + '.idx'
+    index = DistroIndex.from_families(args[1])
+    index.save(index_file)
+    print("%d distribution names indexed in %s" % (len(index.names), index_file))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+# Distribution name detection.
+# The families table (data/files/distributions/families) is loaded once
+# and a query is scored against the distribution names in a single call.
+# The n-gram index (distroindex) limits the fuzzy scoring to plausible names.
+
+import sys
+import time
+import random
+import string
+
+from .utils import get_fuzzy_ratio
+from .distroindex import DistroIndex, MIN_RATIO
+
+FAMILIES_FILE = '/usr/share/usb-creator/distributions/families'
+
+
+def best_match(query, candidates, min_ratio=MIN_RATIO):
+    """ Score query against all candidates with fuzzy partial ratio.
+        On equal ratio the longer candidate wins.
+        Returns (candidate, ratio) or ('', 0) when nothing scores above min_ratio.
+    """
+    hname = ''
+    hratio = 0
+    for name in candidates:
+        ratio = get_fuzzy_ratio(query, name, 2)
+        if ratio > min_ratio:
+            if ratio > hratio or (ratio == hratio and len(name) > len(hname)):
+                hratio = ratio
+                hname = name
+    return (hname, hratio)
+
+
+class DistroScorer(object):
+
+    def __init__(self, families_file=FAMILIES_FILE, index=None):
+        if index is None:
+            index = DistroIndex.load_or_compile(families_file)
+        self.index = index
+
+    @property
+    def families(self):
+        return self.index.families
+
+    def get_distros(self, family=None):
+        if family is None:
+            return [n for f, n in self.index.candidates]
+        family = family.lower()
+        return [n for f, n in self.index.candidates if f == family]
+
+    def score(self, query):
+        """ Score a query (ISO label or path) against all distribution names.
+            Returns (family, name, ratio) or ('', '', 0) if not found.
+        """
+        query = query.lower()
+        if not query:
+            return ('', '', 0)
+        index = self.index
+        ids = index.plausible(query)
+
+        # Fast path: the longest name that scores 100
+        name = index.substring_match(query, ids)
+        if name:
+            return (index.family_of[name], name, 100)
+
+        # Names are scanned longest first: on equal ratio the longer name wins
+        hname = ''
+        hratio = 0
+        for i in ids:
+            name = index.names[i]
+            ratio = get_fuzzy_ratio(query, name, 2)
+            if ratio > MIN_RATIO and ratio > hratio:
+                hratio = ratio
+                hname = name
+                if ratio == 100:
+                    break
+        if not hname:
+            return ('', '', 0)
+        return (index.family_of[hname], hname, hratio)
+
+    def check_os(self, *queries):
+        """ Return the (family, name, ratio) of the first query that scores. """
+        for query in queries:
+            result = self.score(query)
+            if result[1]:
+                return result
+        return ('', '', 0)
+
+
+# ===============================================
+# Benchmark
+# ===============================================
+
+BENCH_QUERIES = ['linuxmint-21.2-cinnamon-64bit.iso', 'Ubuntu 22.04.3 LTS amd64',
+                 'debian-live-12.1.0-amd64-kde.iso', 'Fedora-WS-Live-38-1-6',
+                 'archlinux-2023.09.01-x86_64.iso', 'MX-23_x64', 'systemrescue-10.02-amd64.iso',
+                 'kali-linux-2023.3-live-amd64.iso', 'openSUSE-Tumbleweed-DVD-x86_64',
+                 'manjaro-kde-23.0-230903-linux65.iso', 'nothing-to-find-here.iso']
+
+
+def benchmark(families_file=FAMILIES_FILE, sizes=(250, 1000, 5000), rounds=3):
+    """ Compare the indexed scorer with scoring all names for growing catalogues.
+        Prints the average lookup latency per query and checks that both agree.
+    """
+    base = DistroIndex.load_or_compile(families_file)
+    rnd = random.Random(0)
+    print("%8s %14s %14s %8s" % ('names', 'indexed (ms)', 'all (ms)', 'equal'))
+    for size in sizes:
+        families = list(base.families) or ['independent']
+        candidates = list(base.candidates)
+        while len(candidates) < size:
+            name = ''.join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(3, 12)))
+            candidates.append((rnd.choice(families), name))
+        index = DistroIndex.from_candidates(families, candidates)
+        scorer = DistroScorer(index=index)
+        names = [n for f, n in index.candidates]
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            indexed = [scorer.score(q)[1] for q in BENCH_QUERIES]
+        indexed_ms = (time.perf_counter() - start) * 1000 / (rounds * len(BENCH_QUERIES))
+
+        start = time.perf_counter()
+        brute = [best_match(q.lower(), names)[0] for q in BENCH_QUERIES]
+        brute_ms = (time.perf_counter() - start) * 1000 / len(BENCH_QUERIES)
+
+        print("%8d %14.2f %14.2f %8s" % (len(index.names), indexed_ms, brute_ms, indexed == brute))
+
+
+def compare(families_file=FAMILIES_FILE):
+    """ Check that the indexed scorer finds the same names as scoring all names
+        for every distribution name of the families file (alone and in an
+        ISO file name) and the benchmark queries. Returns the mismatches.
+    """
+    scorer = DistroScorer(families_file)
+    names = scorer.index.names
+    queries = list(BENCH_QUERIES)
+    for name in names:
+        queries.extend([name, "%s-1.0-amd64.iso" % name, name[:-1]])
+    mismatches = []
+    for query in queries:
+        indexed = scorer.score(query)[1]
+        brute = best_match(query.lower(), names)[0]
+        if indexed != brute:
+            mismatches.append((query, indexed, brute))
+    print("%d queries, %d mismatches" % (len(queries), len(mismatches)))
+    for query, indexed, brute in mismatches:
+        print("%s: %s (all names: %s)" % (query, indexed, brute))
+    return mismatches
+
+
+# ===============================================
+# Command line usage (debugging, not used by usb-creator itself)
+# ===============================================
+
+def usage():
+    print("Usage: distros check QUERY [QUERY ...]\n"
+          "       distros list [FAMILY]\n"
+          "       distros bench [FAMILIES_FILE]\n"
+          "       distros compare [FAMILIES_FILE]")
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if not args:
+        usage()
+        return 1
+    command = args[0]
+    if command == 'check' and len(args) > 1:
+        family, name, ratio = DistroScorer().check_os(*args[1:])
+        print("family: %s\nname: %s\nratio: %s" % (family, name, ratio))
+    elif command == 'list':
+        family = args[1] if len(args) > 1 else None
+        print(' '.join(DistroScorer().get_distros(family)))
+    elif command == 'bench':
+        benchmark(args[1] if len(args) > 1 else FAMILIES_FILE)
+    elif command == 'compare':
+        return 1 if compare(args[1] if len(args) > 1 else FAMILIES_FILE) else 0
+    else:
+        usage()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# Size and free space of an unmounted file system, read from its superblock
+# (ext2/3/4, FAT12/16/32 and exFAT) so a partition does not have to be
+# mounted to show the available space.
+# Reading a partition needs read access to the block device: callers fall
+# back to mounting the partition when None is returned.
+
+import sys
+import array
+import struct
+
+EXT_MAGIC = 0xEF53
+EXT_FEATURE_INCOMPAT_64BIT = 0x80
+FSINFO_LEAD_SIG = 0x41615252
+FSINFO_STRUC_SIG = 0x61417272
+# Largest FAT (in bytes) that is scanned when the free count is not known
+MAX_FAT_SCAN = 4 * 1024 * 1024
+
+
+def _read(f, offset, size):
+    f.seek(offset)
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Short read at %d" % offset)
+    return data
+
+
+def ext_space(f):
+    """ Return (total, free) bytes of an ext2/3/4 file system.
+        Free excludes the blocks reserved for root (like statvfs f_bavail).
+    """
+    sb = _read(f, 1024, 1024)
+    if struct.unpack_from('<H', sb, 0x38)[0] != EXT_MAGIC:
+        return None
+    blocks, reserved, free = struct.unpack_from('<III', sb, 0x04)
+    block_size = 1024 << struct.unpack_from('<I', sb, 0x18)[0]
+    if struct.unpack_from('<I', sb, 0x60)[0] & EXT_FEATURE_INCOMPAT_64BIT:
+        blocks_hi, reserved_hi, free_hi = struct.unpack_from('<III', sb, 0x150)
+        blocks |= blocks_hi << 32
+        reserved |= reserved_hi << 32
+        free |= free_hi << 32
+    return (blocks * block_size, max(0, free - reserved) * block_size)
+
+
+def fat_space(f):
+    """ Return (total, free) bytes of a FAT12/16/32 file system. """
+    bs = _read(f, 0, 512)
+    if bs[510:512] != b'\x55\xaa':
+        return None
+    bytes_per_sector, sectors_per_cluster, reserved, fats, root_entries, total16, \
+        _media, fat_size16 = struct.unpack_from('<HBHBHHBH', bs, 0x0B)
+    if not bytes_per_sector or not sectors_per_cluster or not fats:
+        return None
+    total_sectors = total16 or struct.unpack_from('<I', bs, 0x20)[0]
+    fat_size = fat_size16 or struct.unpack_from('<I', bs, 0x24)[0]
+    root_sectors = (root_entries * 32 + bytes_per_sector - 1) // bytes_per_sector
+    data_sectors = total_sectors - reserved - fats * fat_size - root_sectors
+    clusters = data_sectors // sectors_per_cluster
+    cluster_size = bytes_per_sector * sectors_per_cluster
+    total = clusters * cluster_size
+
+    if clusters >= 65525:
+        # FAT32: free cluster count in the FSInfo sector
+        fsinfo_sector = struct.unpack_from('<H', bs, 0x30)[0]
+        fsinfo = _read(f, fsinfo_sector * bytes_per_sector, 512)
+        lead, = struct.unpack_from('<I', fsinfo, 0)
+        struc, free_clusters = struct.unpack_from('<II', fsinfo, 484)
+        if lead == FSINFO_LEAD_SIG and struc == FSINFO_STRUC_SIG and free_clusters <= clusters:
+            return (total, free_clusters * cluster_size)
+        entry_size = 4
+    else:
+        entry_size = 2 if clusters >= 4085 else 1.5
+
+    # Count the free entries of the first FAT (small for FAT12/16)
+    fat_bytes = int((clusters + 2) * entry_size + 1)
+    if fat_bytes > MAX_FAT_SCAN:
+        return None
+    fat = _read(f, reserved * bytes_per_sector, fat_bytes)
+    if entry_size == 1.5:
+        free_clusters = 0
+        for cluster in range(2, clusters + 2):
+            value = struct.unpack_from('<H', fat, cluster * 3 // 2)[0]
+            value = value >> 4 if cluster & 1 else value & 0x0FFF
+            if value == 0:
+                free_clusters += 1
+    else:
+        entries = array.array('I' if entry_size == 4 else 'H')
+        entries.frombytes(fat[2 * entry_size:(clusters + 2) * entry_size])
+        if sys.byteorder != 'little':
+            entries.byteswap()
+        free_clusters = entries.count(0)
+    return (total, free_clusters * cluster_size)
+
+
+def exfat_space(f):
+    """ Return (total, free) bytes of an exFAT file system. """
+    bs = _read(f, 0, 512)
+    if bs[3:11] != b'EXFAT   ':
+        return None
+    heap_offset, cluster_count, root_cluster = struct.unpack_from('<III', bs, 0x58)
+    sector_shift, cluster_shift = struct.unpack_from('<BB', bs, 0x6C)
+    percent_in_use = bs[0x70]
+    sector_size = 1 << sector_shift
+    cluster_size = sector_size << cluster_shift
+    total = cluster_count * cluster_size
+
+    def cluster_offset(cluster):
+        return heap_offset * sector_size + (cluster - 2) * cluster_size
+
+    # Count the free clusters in the allocation bitmap (entry 0x81 of the root directory)
+    root = _read(f, cluster_offset(root_cluster), cluster_size)
+    for pos in range(0, len(root), 32):
+        entry_type = root[pos]
+        if entry_type == 0:
+            break
+        if entry_type == 0x81:
+            first_cluster, length = struct.unpack_from('<IQ', root, pos + 20)
+            bitmap = _read(f, cluster_offset(first_cluster), (cluster_count + 7) // 8)
+            used = bin(int.from_bytes(bitmap, 'little') & ((1 << cluster_count) - 1)).count('1')
+            return (total, (cluster_count - used) * cluster_size)
+    if percent_in_use <= 100:
+        return (total, cluster_count * (100 - percent_in_use) // 100 * cluster_size)
+    return None
+
+
+READERS = {'ext2': ext_space, 'ext3': ext_space, 'ext4': ext_space,
+           'vfat': fat_space, 'fat': fat_space, 'exfat': exfat_space}
+
+
+def get_space(device_path, fs_type):
+    """ Return (total, free) bytes of the unmounted file system on device_path
+        or None if it cannot be read.
+    """
+    reader = READERS.get(fs_type)
+    if reader is None:
+        return None
+    try:
+        with open(device_path, 'rb') as f:
+            return reader(f)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+# ===============================================
+# Command line usage
+# ===============================================
+
+def usage():
+    print("Usage: fsinfo DEVICE FSTYPE")
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) != 2:
+        usage()
+        return 1
+    space = get_space(args[0], args[1])
+    if space is None:
+        return 1
+    print("total=%d free=%d" % space)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
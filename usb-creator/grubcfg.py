@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+# grub.cfg of the USB device as a header and menu entries keyed by ISO name.
+# The ISO name of an entry is taken from its iso_path= or isofile= line.
+# Text between entries (comments, settings) is kept as a node of its own so
+# that replacing or removing an entry does not touch it.
+# Adding, replacing and removing entries is done on the parsed model and the
+# file is written once (temporary file + rename) instead of running sed
+# over the whole file for every configured ISO.
+
+import os
+import re
+import tempfile
+from os.path import exists, join, dirname, basename
+
+ENTRY_START = re.compile(r'^\s*(menuentry|submenu)\b')
+# The value is a grub word: iso_path='/My ISO.iso', iso_path='/it'\''s.iso'
+ISO_KEY = re.compile(r'\b(?:iso_path|isofile)=')
+# Characters that end an unquoted grub word
+WORD_END = ' \t\n;|&'
+
+
+def read_word(text, pos=0):
+    """ Return the value of the grub (shell-like) word at pos: quotes are
+        removed and escapes resolved. Single quotes do not escape anything,
+        in double quotes a backslash escapes \\, ", $ and a newline.
+    """
+    value = []
+    quote = None
+    i = pos
+    while i < len(text):
+        char = text[i]
+        if quote == "'":
+            if char == "'":
+                quote = None
+            else:
+                value.append(char)
+        elif quote == '"':
+            if char == '"':
+                quote = None
+            elif char == '\\' and i + 1 < len(text) and text[i + 1] in '\\"$\n':
+                i += 1
+                value.append(text[i])
+            else:
+                value.append(char)
+        elif char in WORD_END:
+            break
+        elif char in '\'"':
+            quote = char
+        elif char == '\\' and i + 1 < len(text):
+            i += 1
+            value.append(text[i])
+        else:
+            value.append(char)
+        i += 1
+    return ''.join(value)
+
+
+def entry_iso_name(text):
+    """ Return the ISO name of the iso_path= or isofile= value in text or None. """
+    match = ISO_KEY.search(text)
+    if match is None:
+        return None
+    return basename(read_word(text, match.end()).rstrip('/')) or None
+
+
+class MenuEntry(object):
+
+    def __init__(self, text):
+        self.text = text.strip('\n')
+        self.iso_name = entry_iso_name(self.text)
+
+
+class TextBlock(object):
+    """ Text between menu entries: never matched by ISO name. """
+
+    iso_name = None
+
+    def __init__(self, text):
+        self.text = text.strip('\n')
+
+
+class GrubConfig(object):
+
+    def __init__(self, text=''):
+        self.header = ''
+        # Menu entries and the text blocks between them in file order
+        self.entries = []
+        self.parse(text)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8', errors='surrogateescape') as f:
+            return cls(f.read())
+
+    def parse(self, text):
+        """ Split text in the header (before the first entry), menu entries
+            and the text blocks between them.
+        """
+        header = []
+        entries = []
+        between = []
+        block = None
+        depth = 0
+        for line in text.splitlines():
+            if block is None:
+                if ENTRY_START.match(line):
+                    if between:
+                        entries.append(TextBlock('\n'.join(between)))
+                        between = []
+                    block = [line]
+                    depth = line.count('{') - line.count('}')
+                    if depth <= 0 and '{' in line:
+                        entries.append(MenuEntry('\n'.join(block)))
+                        block = None
+                elif entries:
+                    between.append(line)
+                else:
+                    header.append(line)
+            else:
+                block.append(line)
+                depth += line.count('{') - line.count('}')
+                if depth <= 0:
+                    entries.append(MenuEntry('\n'.join(block)))
+                    block = None
+        if block is not None:
+            # Unterminated entry: keep it as is
+            entries.append(MenuEntry('\n'.join(block)))
+        elif between:
+            entries.append(TextBlock('\n'.join(between)))
+        self.header = '\n'.join(header).strip('\n')
+        # Blocks of blank lines only are rendered as separators anyway
+        self.entries = [e for e in entries if e.text.strip()]
+
+    def _index(self, iso_name):
+        for i, entry in enumerate(self.entries):
+            if entry.iso_name == iso_name:
+                return i
+        return -1
+
+    def get_entry(self, iso_name):
+        i = self._index(iso_name)
+        return self.entries[i] if i >= 0 else None
+
+    def iso_names(self):
+        return [e.iso_name for e in self.entries if e.iso_name]
+
+    def set_entry(self, iso_name, text):
+        """ Replace the entry of iso_name in place or append it. """
+        entry = MenuEntry(text)
+        entry.iso_name = iso_name
+        i = self._index(iso_name)
+        if i >= 0:
+            self.entries[i] = entry
+        else:
+            self.entries.append(entry)
+
+    def remove_entry(self, iso_name):
+        """ Returns True if an entry was removed. """
+        count = len(self.entries)
+        self.entries = [e for e in self.entries if e.iso_name != iso_name]
+        return len(self.entries) != count
+
+    def prune(self, root):
+        """ Remove the entries of ISOs that are not on the device (mounted on root).
+            Returns the names of the removed ISOs.
+        """
+        removed = [name for name in self.iso_names() if not exists(join(root, name))]
+        self.entries = [e for e in self.entries if e.iso_name not in removed]
+        return removed
+
+    def render(self):
+        blocks = [self.header] if self.header else []
+        blocks.extend(e.text for e in self.entries)
+        return '\n\n'.join(blocks) + '\n'
+
+    def save(self, path):
+        """ Write the configuration atomically. """
+        fd, tmp_path = tempfile.mkstemp(prefix='.grub.cfg.', dir=dirname(path) or '.')
+        try:
+            with open(fd, 'w', encoding='utf-8', errors='surrogateescape') as f:
+                f.write(self.render())
+                f.flush()
+                os.fsync(f.fileno())
+            # Keep the mode of an existing file
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777 if exists(path) else 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+def update_grub_cfg(path, iso_name, entry=None, template=None, root=None, log=print):
+    """ Update grub.cfg at path: remove entries of ISOs that are no longer
+        on the device (root) and add or replace the entry of iso_name
+        (remove it when entry is None). A new grub.cfg starts from template.
+    """
+    if exists(path):
+        log("Use existing %s" % path)
+        config = GrubConfig.load(path)
+    else:
+        log("Create grub.cfg from %s" % template)
+        config = GrubConfig()
+        if template:
+            with open(template, encoding='utf-8') as f:
+                config.header = f.read().strip('\n')
+    if root is not None:
+        for name in config.prune(root):
+            log("Remove menu entry of %s" % name)
+    if entry is None:
+        config.remove_entry(iso_name)
+    else:
+        if entry_iso_name(entry) != iso_name:
+            # The entry would not be found again when grub.cfg is read the next time
+            log("Menu entry of %s does not set iso_path='/%s'" % (iso_name, iso_name))
+        config.set_entry(iso_name, entry)
+    config.save(path)
+    return config
@@ -0,0 +1,693 @@
+#!/usr/bin/env python3
+
+# Privileged helper of usb-creator.
+# The helper is started once with pkexec (one polkit authorization) and
+# serves typed operations on a Unix socket in the user's
+# ~/.usb-creator/helper directory until it is stopped or idle for
+# IDLE_TIMEOUT seconds. The socket path is not an argument: it is derived
+# from the home of PKEXEC_UID, and the directory must belong to that user
+# and be private (0700), so the socket is reachable by that user only.
+# Only the user that started it (PKEXEC_UID) can connect, and operations
+# only accept removable devices and partitions/mount points on them.
+# Every connection is handled in its own thread: operations on the same
+# device wait for each other, operations on other devices run concurrently.
+#
+# Protocol: the client sends one JSON line {"op": ..., "args": {...}} per
+# connection and receives JSON lines: {"event": "log", "message": ...},
+# progress events (progress.py) and finally {"event": "result", "code": N}.
+# Files the helper reads (the ISO of write_image) are opened by the client
+# and passed with the request as file descriptors (SCM_RIGHTS), so the
+# helper never opens a path of the user as root.
+#
+# Command line: pkexec runs "usb-creator-helper serve". The other commands
+# (see usage()) send one operation to the helper, for debugging.
+
+import os
+import re
+import sys
+import pwd
+import json
+import stat
+import time
+import array
+import fcntl
+import socket
+import struct
+import threading
+import subprocess
+from contextlib import contextmanager, ExitStack
+from os.path import join, abspath, basename, realpath
+
+from .progress import ProgressEmitter, CallbackEmitter, DEFAULT_HZ
+from .topology import BlockTopology
+
+HELPER_PATH = '/usr/lib/usb-creator/usb-creator-helper'
+# Socket of the helper in the home directory of the user
+SOCKET_DIR = join('.usb-creator', 'helper')
+SOCKET_NAME = 'helper.sock'
+# Seconds without requests before the helper exits
+IDLE_TIMEOUT = 15 * 60
+# Seconds to wait for the polkit authorization
+START_TIMEOUT = 120
+MAX_REQUEST_SIZE = 64 * 1024
+# File descriptors passed with a request
+MAX_FDS = 4
+# Seconds between checks of the idle timeout and the quit operation
+ACCEPT_INTERVAL = 1
+
+# Jobs (jobs.py) in several threads ask for one authorization
+_start_lock = threading.Lock()
+
+# Exit codes of scripts/usb-creator
+EXIT_OK = 0
+EXIT_INVALID_ARGUMENT = 1
+EXIT_DEVICE_NOT_FOUND = 2
+EXIT_NOT_DETACHABLE = 3
+EXIT_PARTITION_NOT_FOUND = 4
+EXIT_ISO_NOT_FOUND = 6
+
+LABEL_COMMANDS = {'vfat': 'fatlabel', 'fat': 'fatlabel', 'exfat': 'exfatlabel',
+                  'ntfs': 'ntfslabel', 'ext2': 'e2label', 'ext3': 'e2label', 'ext4': 'e2label'}
+
+
+class HelperError(Exception):
+    def __init__(self, message, exit_code=EXIT_INVALID_ARGUMENT):
+        super(HelperError, self).__init__(message)
+        self.exit_code = exit_code
+
+
+def socket_dir(uid):
+    """ Return the directory of the helper socket of the user with uid. """
+    return join(pwd.getpwuid(uid).pw_dir, SOCKET_DIR)
+
+
+# ===============================================
+# Device validation (privileged side)
+# ===============================================
+
+def block_device_name(device):
+    """ Return the kernel name of a block device path or raise HelperError. """
+    path = realpath(device)
+    try:
+        if not stat.S_ISBLK(os.stat(path).st_mode):
+            raise HelperError("%s is not a block device." % device, EXIT_DEVICE_NOT_FOUND)
+    except OSError:
+        raise HelperError("%s does not exist." % device, EXIT_DEVICE_NOT_FOUND)
+    return basename(path)
+
+
+def removable_disk(device, topology):
+    """ Return the name of the removable disk of a disk or partition path. """
+    block_device_name(device)
+    disk = topology.disk(device)
+    if disk is None or not disk.removable:
+        raise HelperError("%s is not a detachable device." % device, EXIT_NOT_DETACHABLE)
+    return disk.name
+
+
+def whole_disk(device, topology):
+    name = removable_disk(device, topology)
+    if block_device_name(device) != name:
+        raise HelperError("%s is not a whole disk." % device)
+    return name
+
+
+def unescape_mount_field(field):
+    """ Decode a field of mountinfo: spaces, tabs, newlines and backslashes are
+        escaped as \\ooo, other bytes (UTF-8 labels) are as they are.
+    """
+    field = re.sub(rb'\\([0-7]{3})', lambda m: bytes([int(m.group(1), 8)]), field)
+    return field.decode('utf-8', 'surrogateescape')
+
+
+def mounts():
+    """ Return [(mount point, source device), ...] from /proc/self/mountinfo. """
+    result = []
+    with open('/proc/self/mountinfo', 'rb') as f:
+        for line in f:
+            fields = line.split()
+            sep = fields.index(b'-')
+            result.append((unescape_mount_field(fields[4]), unescape_mount_field(fields[sep + 2])))
+    return result
+
+
+def mount_source(path):
+    """ Return the source device of the mount that contains path. """
+    path = realpath(path)
+    best = ('', '')
+    for mount_point, source in mounts():
+        if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) \
+           and len(mount_point) > len(best[0]):
+            best = (mount_point, source)
+    return best
+
+
+def check_on_disk(path, disk, topology, mount_point=False):
+    """ Raise HelperError if path is not on a partition of the removable disk. """
+    point, source = mount_source(path)
+    if not source.startswith('/dev/') or removable_disk(source, topology) != disk:
+        raise HelperError("%s is not on %s." % (path, disk), EXIT_PARTITION_NOT_FOUND)
+    if mount_point and realpath(path) != point:
+        raise HelperError("%s is not a mount point." % path, EXIT_PARTITION_NOT_FOUND)
+
+
+def read_request(conn):
+    """ Read the request line of a connection and the file descriptors passed with it.
+        Returns (bytes, [fd, ...]).
+    """
+    data = b''
+    fds = array.array('i')
+    flags = getattr(socket, 'MSG_CMSG_CLOEXEC', 0)
+    while b'\n' not in data and len(data) < MAX_REQUEST_SIZE:
+        msg, ancdata, msg_flags, addr = conn.recvmsg(MAX_REQUEST_SIZE,
+                                                     socket.CMSG_SPACE(MAX_FDS * fds.itemsize), flags)
+        for level, kind, cdata in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(cdata[:len(cdata) - len(cdata) % fds.itemsize])
+        if msg_flags & socket.MSG_CTRUNC:
+            for fd in fds:
+                os.close(fd)
+            raise HelperError("Too many file descriptors.")
+        if not msg:
+            break
+        data += msg
+    return data.split(b'\n', 1)[0], list(fds)
+
+
+def send_request(sock, data, fds=()):
+    """ Send a request line with file descriptors (SCM_RIGHTS). """
+    if not fds:
+        sock.sendall(data)
+        return
+    sent = sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+    sock.sendall(data[sent:])
+
+
+# ===============================================
+# Privileged side
+# ===============================================
+
+class Connection(object):
+    """ Connection of a request. The operation logs to it explicitly, also from
+        the threads it starts (writers and verifiers of write_image).
+    """
+
+    def __init__(self, fd, fds=()):
+        self.fd = fd
+        # File descriptors passed with the request
+        self.fds = list(fds)
+        # Block devices read for this request: the helper runs for a long time
+        # and a device name may belong to another disk since the last request
+        self.topology = BlockTopology()
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def send(self, event):
+        data = (json.dumps(event) + '\n').encode('utf-8')
+        with self._lock:
+            if self.closed:
+                return
+            try:
+                os.write(self.fd, data)
+            except OSError:
+                # Client went away: the operation goes on without output
+                self.closed = True
+
+    def log(self, message):
+        self.send({'event': 'log', 'message': message})
+
+    def run(self, args):
+        """ Run a command and send its output as log lines. Returns the exit code. """
+        try:
+            proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except OSError as e:
+            self.log("%s: %s" % (args[0], e))
+            return 127
+        for line in proc.stdout:
+            self.log(line.decode('utf-8', 'replace').rstrip())
+        return proc.wait()
+
+    def passed_file(self, index=0):
+        """ Return a path to read a file the client opened and passed with the request. """
+        if index >= len(self.fds):
+            raise HelperError("No file passed with the request.")
+        fd = self.fds[index]
+        if not stat.S_ISREG(os.fstat(fd).st_mode) or \
+           fcntl.fcntl(fd, fcntl.F_GETFL) & os.O_ACCMODE == os.O_WRONLY:
+            raise HelperError("Passed file is not a readable file.")
+        # The magic link opens the same file (no lookup of the user's path)
+        return '/proc/self/fd/%d' % fd
+
+    def close_files(self):
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+
+
+class Helper(object):
+
+    def __init__(self, uid, idle_timeout=IDLE_TIMEOUT):
+        self.uid = uid
+        self.gid = pwd.getpwuid(uid).pw_gid
+        self.socket_dir = socket_dir(uid)
+        self.idle_timeout = idle_timeout
+        self.running = False
+        self._lock = threading.Lock()
+        self._device_locks = {}
+        self._threads = set()
+        self._last_request = time.monotonic()
+
+    @contextmanager
+    def locked(self, conn, *disks):
+        """ Hold the locks of disks (in the same order in every thread). """
+        with self._lock:
+            locks = [(disk, self._device_locks.setdefault(disk, threading.Lock()))
+                     for disk in sorted(set(disks))]
+        with ExitStack() as stack:
+            waited = False
+            for disk, lock in locks:
+                if not lock.acquire(blocking=False):
+                    conn.log("Waiting for another operation on %s" % disk)
+                    lock.acquire()
+                    waited = True
+                stack.callback(lock.release)
+            if waited:
+                # The disks may have been replaced while waiting: check them again
+                conn.topology.refresh()
+                for disk, _ in locks:
+                    removable_disk(join('/dev', disk), conn.topology)
+            yield
+
+    def open_socket_dir(self):
+        """ Open the socket directory (not a symlink) and check that it belongs
+            to the user and is private. Returns the file descriptor of the directory:
+            the socket is created and removed relative to it.
+        """
+        try:
+            dir_fd = os.open(self.socket_dir, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC)
+        except OSError as e:
+            raise HelperError("Unsafe socket directory %s: %s" % (self.socket_dir, e.strerror))
+        st = os.fstat(dir_fd)
+        if st.st_uid != self.uid or stat.S_IMODE(st.st_mode) != 0o700:
+            os.close(dir_fd)
+            raise HelperError("Unsafe socket directory %s: must belong to uid %d with mode 0700"
+                              % (self.socket_dir, self.uid))
+        return dir_fd
+
+    def remove_socket(self, dir_fd):
+        """ Remove an old socket. Anything else in its place is left alone. """
+        try:
+            st = os.lstat(SOCKET_NAME, dir_fd=dir_fd)
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(st.st_mode):
+            raise HelperError("%s is not a socket." % join(self.socket_dir, SOCKET_NAME))
+        os.unlink(SOCKET_NAME, dir_fd=dir_fd)
+
+    def serve(self):
+        dir_fd = self.open_socket_dir()
+        try:
+            self.remove_socket(dir_fd)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            # The directory is private to the user: the socket itself needs no owner
+            # change (no chown of a path the user can replace)
+            old_umask = os.umask(0o111)
+            try:
+                sock.bind('/proc/self/fd/%d/%s' % (dir_fd, SOCKET_NAME))
+            finally:
+                os.umask(old_umask)
+        except BaseException:
+            os.close(dir_fd)
+            raise
+        sock.listen(8)
+        sock.settimeout(ACCEPT_INTERVAL)
+        self.running = True
+        self._last_request = time.monotonic()
+        try:
+            while self.running:
+                try:
+                    conn, _ = sock.accept()
+                except socket.timeout:
+                    with self._lock:
+                        idle = not self._threads and \
+                               time.monotonic() - self._last_request >= self.idle_timeout
+                    if idle:
+                        break
+                    continue
+                thread = threading.Thread(target=self.serve_connection, args=(conn,),
+                                          name="usb-creator-helper connection")
+                thread.daemon = True
+                with self._lock:
+                    self._threads.add(thread)
+                thread.start()
+        finally:
+            sock.close()
+            try:
+                self.remove_socket(dir_fd)
+            except (HelperError, OSError):
+                pass
+            os.close(dir_fd)
+            # Let running operations finish
+            with self._lock:
+                threads = list(self._threads)
+            for thread in threads:
+                thread.join()
+
+    def serve_connection(self, conn):
+        try:
+            with conn:
+                conn.settimeout(None)
+                self.handle(conn)
+        finally:
+            with self._lock:
+                self._threads.discard(threading.current_thread())
+                self._last_request = time.monotonic()
+
+    def handle(self, conn):
+        creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        pid, uid, gid = struct.unpack('3i', creds)
+        if uid not in (self.uid, 0):
+            return
+        client = Connection(conn.fileno())
+        code = EXIT_INVALID_ARGUMENT
+        try:
+            line, client.fds = read_request(conn)
+            request = json.loads(line.decode('utf-8'))
+            op = request.get('op', '')
+            func = getattr(self, 'op_' + op, None)
+            if func is None:
+                raise HelperError("Unknown operation: %s" % op)
+            code = func(client, **request.get('args', {}))
+        except HelperError as e:
+            client.log(str(e))
+            code = e.exit_code
+        except (ValueError, TypeError) as e:
+            client.log("Invalid request: %s" % e)
+        except Exception as e:
+            client.log("Error: %s" % e)
+        client.send({'event': 'result', 'code': code})
+        client.close_files()
+
+    # Operations: the connection of the request and keyword arguments of the request
+
+    def op_ping(self, conn):
+        return EXIT_OK
+
+    def op_quit(self, conn):
+        self.running = False
+        return EXIT_OK
+
+    def op_device_info(self, conn, device):
+        with self.locked(conn, whole_disk(device, conn.topology)):
+            conn.run(['partprobe', device])
+            os.sync()
+            conn.run(['udevadm', 'settle', '--timeout=10'])
+            conn.run(['parted', device, 'print'])
+        return EXIT_OK
+
+    def op_partition(self, conn, device):
+        disk = whole_disk(device, conn.topology)
+        with self.locked(conn, disk):
+            return self.partition(conn, device, disk)
+
+    def partition(self, conn, device, disk):
+        topology = conn.topology
+        conn.log("Unmount %s partitions" % device)
+        for mount_point, source in mounts():
+            # Compare whole disk names: /dev/sdb is not the disk of /dev/sdba1
+            if not source.startswith('/dev/'):
+                continue
+            found = topology.disk(source)
+            if found is not None and found.name == disk:
+                conn.run(['umount', mount_point])
+
+        conn.log("Partition %s (hybrid)" % device)
+        fd = os.open(device, os.O_WRONLY)
+        try:
+            os.write(fd, bytes(2 * 1024 * 1024))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        conn.run(['parted', device, '-a', 'optimal', '-s', '--',
+                  'mktable', 'gpt',
+                  'mkpart', 'primary', '1MiB', '3MiB',
+                  'mkpart', 'primary', 'fat16', '3MiB', '20MiB',
+                  'mkpart', 'primary', 'ext4', '20MiB', '100%',
+                  'name', '1', 'grub',
+                  'name', '2', 'esp',
+                  'name', '3', 'usbcreator',
+                  'set', '1', 'bios_grub', 'on',
+                  'set', '2', 'esp', 'on'])
+
+        conn.log("Probing new paritions")
+        conn.run(['partprobe', device])
+        os.sync()
+        conn.run(['udevadm', 'settle', '--timeout=10'])
+        topology.refresh()
+
+        conn.log("Create file systems")
+        conn.run(['mkfs.fat', '-F16', '-v', '-I', '-n', 'ESP', topology.partition(device, 2)])
+        return conn.run(['mkfs.ext4', '-Fqv', '-L', 'USBCREATOR', topology.partition(device, 3)])
+
+    def op_set_label(self, conn, partition, fstype, label):
+        disk = removable_disk(partition, conn.topology)
+        command = LABEL_COMMANDS.get(fstype)
+        if command is None:
+            raise HelperError("Cannot label file system %s" % fstype)
+        if not re.match(r'^[A-Za-z0-9_-]{1,11}$', label):
+            raise HelperError("Invalid label: %s" % label)
+        conn.log("Set label: %s %s %s" % (command, partition, label))
+        with self.locked(conn, disk):
+            return conn.run([command, partition, label])
+
+    def op_chown(self, conn, path):
+        disk = removable_disk(mount_source(path)[1], conn.topology)
+        check_on_disk(path, disk, conn.topology, mount_point=True)
+        with self.locked(conn, disk):
+            for dirpath, dirnames, filenames in os.walk(path):
+                os.lchown(dirpath, self.uid, self.gid)
+                for name in filenames + [d for d in dirnames if os.path.islink(join(dirpath, d))]:
+                    os.lchown(join(dirpath, name), self.uid, self.gid)
+        return EXIT_OK
+
+    def op_install_grub(self, conn, device, efi_dir, boot_dir):
+        disk = whole_disk(device, conn.topology)
+        check_on_disk(efi_dir, disk, conn.topology)
+        check_on_disk(boot_dir, disk, conn.topology)
+        with self.locked(conn, disk):
+            return self.install_grub(conn, device, efi_dir, boot_dir)
+
+    def install_grub(self, conn, device, efi_dir, boot_dir):
+        with open(device, 'rb') as f:
+            grub_installed = b'GRUB' in f.read(512)
+        efi = False
+        for dirpath, dirnames, filenames in os.walk(efi_dir):
+            if [f for f in filenames if f.lower().startswith('boot') and f.lower().endswith('.efi')]:
+                efi = True
+                break
+        if grub_installed and efi:
+            conn.log("Grub already installed on %s" % device)
+            return EXIT_OK
+        for target in ('x86_64-efi', 'i386-efi'):
+            conn.run(['grub-install', '--recheck', '--removable', '--efi-directory=%s' % efi_dir,
+                      '--boot-directory=%s' % boot_dir, '--target=%s' % target])
+        return conn.run(['grub-install', '--target=i386-pc', device])
+
+    def op_write_image(self, conn, source, devices, verify=False, discard=False,
+                       block_size=None, expected='', progress=False, hz=DEFAULT_HZ):
+        """ Write the ISO passed as file descriptor to the devices.
+            source: name of the ISO for the log, expected: published hash of the ISO
+        """
+        from .rawwriter import write_images, BLOCK_SIZE
+        try:
+            path = conn.passed_file()
+        except (HelperError, OSError):
+            raise HelperError("%s not found." % source, EXIT_ISO_NOT_FOUND)
+        if not devices:
+            raise HelperError("No device given.")
+        disks = [whole_disk(device, conn.topology) for device in devices]
+        emitter = CallbackEmitter(conn.send, hz) if progress else None
+        with self.locked(conn, *disks):
+            results = write_images(path, devices, conn.log, emitter, int(block_size or BLOCK_SIZE),
+                                   discard=discard, verify=verify, source_name=basename(source),
+                                   expected=expected or None)
+        if len(results) > 1:
+            for device, code in results.items():
+                conn.log("Result %s: %d" % (device, code))
+        for code in results.values():
+            if code != EXIT_OK:
+                return code
+        return EXIT_OK
+
+
+# ===============================================
+# User side
+# ===============================================
+
+class HelperClient(object):
+
+    def __init__(self):
+        self.socket_dir = socket_dir(os.getuid())
+        self.socket_path = join(self.socket_dir, SOCKET_NAME)
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def ping(self):
+        try:
+            return self._request('ping', {}) == EXIT_OK
+        except OSError:
+            return False
+
+    def start(self, timeout=START_TIMEOUT):
+        """ Start the helper with pkexec if it is not running. Returns an exit code. """
+        with _start_lock:
+            return self._start(timeout)
+
+    def _start(self, timeout):
+        if self.ping():
+            return EXIT_OK
+        # The helper only serves in a private directory of the user
+        os.makedirs(self.socket_dir, mode=0o700, exist_ok=True)
+        os.chmod(self.socket_dir, 0o700)
+        try:
+            proc = subprocess.Popen(['pkexec', HELPER_PATH, 'serve'],
+                                    stdin=subprocess.DEVNULL, start_new_session=True)
+        except OSError:
+            return 127
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            if self.ping():
+                return EXIT_OK
+            if proc.poll() is not None:
+                # Authorization was refused or the helper failed
+                return proc.returncode or EXIT_INVALID_ARGUMENT
+            time.sleep(0.1)
+        return EXIT_INVALID_ARGUMENT
+
+    def stop(self):
+        if self.ping():
+            self._request('quit', {})
+
+    def call(self, op, args, log=print, emitter=None, files=()):
+        """ Run an operation in the helper (started if needed). Returns an exit code.
+            files: paths the helper reads, opened here (as the user) and passed to the helper
+        """
+        fds = []
+        try:
+            for path in files:
+                try:
+                    fds.append(os.open(path, os.O_RDONLY | os.O_CLOEXEC))
+                except OSError as e:
+                    log("Unable to open %s: %s" % (path, e))
+                    return EXIT_ISO_NOT_FOUND
+            code = self.start()
+            if code != EXIT_OK:
+                log("Unable to start the privileged helper (%d)" % code)
+                return code
+            if emitter is not None and emitter.enabled:
+                args = dict(args, progress=True, hz=emitter.hz)
+            return self._request(op, args, log, emitter, fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def _request(self, op, args, log=None, emitter=None, fds=()):
+        code = EXIT_INVALID_ARGUMENT
+        with self._connect() as sock:
+            send_request(sock, (json.dumps({'op': op, 'args': args}) + '\n').encode('utf-8'), fds)
+            for line in sock.makefile('rb'):
+                try:
+                    event = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    continue
+                kind = event.get('event')
+                if kind == 'result':
+                    code = event.get('code', code)
+                elif kind == 'log':
+                    if log is not None:
+                        log(event.get('message', ''))
+                elif emitter is not None:
+                    # Progress events of the helper
+                    emitter.emit(event)
+        return code
+
+
+# ===============================================
+# Command line usage
+# ===============================================
+
+def usage():
+    print("Usage: helper serve (as root, started by pkexec)\n"
+          "       helper start|stop|ping\n"
+          "       helper device_info DEVICE\n"
+          "       helper partition DEVICE\n"
+          "       helper set_label PARTITION FSTYPE LABEL\n"
+          "       helper chown MOUNT_POINT\n"
+          "       helper install_grub DEVICE EFI_DIR BOOT_DIR\n"
+          "       helper write_image [--verify] [--discard] [--block-size=BYTES] SOURCE DEVICE [DEVICE ...]")
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    options = [a for a in args if a.startswith('--')]
+    args = [a for a in args if not a.startswith('--')]
+    if not args:
+        usage()
+        return EXIT_INVALID_ARGUMENT
+    command = args[0]
+
+    if command == 'serve' and len(args) == 1:
+        uid = int(os.environ.get('PKEXEC_UID', os.getuid()))
+        try:
+            Helper(uid).serve()
+        except HelperError as e:
+            print(str(e), file=sys.stderr)
+            return e.exit_code
+        return EXIT_OK
+
+    def log(message):
+        print(message, flush=True)
+
+    client = HelperClient()
+    if command == 'start':
+        return client.start()
+    if command == 'stop':
+        client.stop()
+        return EXIT_OK
+    if command == 'ping':
+        return EXIT_OK if client.ping() else EXIT_INVALID_ARGUMENT
+
+    paths = [abspath(a) for a in args[1:]]
+    if command in ('device_info', 'partition') and len(args) == 2:
+        request = {'device': paths[0]}
+    elif command == 'set_label' and len(args) == 4:
+        request = {'partition': paths[0], 'fstype': args[2], 'label': args[3]}
+    elif command == 'chown' and len(args) == 2:
+        request = {'path': paths[0]}
+    elif command == 'install_grub' and len(args) == 4:
+        request = {'device': paths[0], 'efi_dir': paths[1], 'boot_dir': paths[2]}
+    elif command == 'write_image' and len(args) > 2:
+        from .copier import expected_digest
+        request = {'source': paths[0], 'devices': paths[1:], 'expected': expected_digest(paths[0], ''),
+                   'verify': '--verify' in options, 'discard': '--discard' in options}
+        for option in options:
+            if option.startswith('--block-size='):
+                request['block_size'] = int(option.split('=', 1)[1])
+        return client.call(command, request, log, ProgressEmitter.from_env(), files=[paths[0]])
+    else:
+        usage()
+        return EXIT_INVALID_ARGUMENT
+    emitter = ProgressEmitter.from_env()
+    return client.call(command, request, log, emitter)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+# Persistent cache with ISO introspection results.
+# Rows are keyed by path and are only valid as long as the device, inode,
+# size and modification time of the ISO did not change.
+# Stale rows are evicted when they are looked up, unused rows after MAX_AGE_DAYS.
+
+import os
+import sys
+import time
+import sqlite3
+import threading
+from os.path import join, expanduser, isfile, abspath
+
+from .isoreader import inspect_iso, IsoError, IsoCancelled
+
+CACHE_FILE = 'iso-cache.db'
+# Increase when the columns change: the cache is rebuilt
+SCHEMA_VERSION = 1
+MAX_AGE_DAYS = 90
+MAX_ENTRIES = 1000
+
+# Cached ISO information (besides the stat key)
+INFO_COLUMNS = ('label', 'loopback', 'vmlinuz', 'initrd', 'options', 'family', 'distro')
+
+
+def stat_key(iso_path):
+    st = os.stat(iso_path)
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class IsoCache(object):
+
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = expanduser('~/.usb-creator')
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.db_path = join(cache_dir, CACHE_FILE)
+        # The GUI reads the cache from worker threads
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        self._init_db()
+
+    def _init_db(self):
+        with self.lock, self.conn:
+            version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                self.conn.execute('DROP TABLE IF EXISTS isos')
+            self.conn.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+            self.conn.execute('CREATE TABLE IF NOT EXISTS isos ('
+                              'path TEXT PRIMARY KEY, dev INTEGER, ino INTEGER, '
+                              'size INTEGER, mtime_ns INTEGER, accessed REAL, %s)'
+                              % ', '.join(['%s TEXT' % c for c in INFO_COLUMNS]))
+            # Evict entries that were not used for a long time
+            self.conn.execute('DELETE FROM isos WHERE accessed < ?',
+                              (time.time() - MAX_AGE_DAYS * 86400,))
+            self.conn.execute('DELETE FROM isos WHERE path NOT IN '
+                              '(SELECT path FROM isos ORDER BY accessed DESC LIMIT ?)',
+                              (MAX_ENTRIES,))
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, iso_path):
+        """ Return cached information dictionary or None if not cached or stale. """
+        iso_path = abspath(iso_path)
+        try:
+            key = stat_key(iso_path)
+        except OSError:
+            self.delete(iso_path)
+            return None
+        with self.lock, self.conn:
+            row = self.conn.execute('SELECT dev, ino, size, mtime_ns, %s FROM isos WHERE path = ?'
+                                    % ', '.join(INFO_COLUMNS), (iso_path,)).fetchone()
+            if row is None:
+                return None
+            if tuple(row[:4]) != key:
+                # ISO changed: evict
+                self.conn.execute('DELETE FROM isos WHERE path = ?', (iso_path,))
+                return None
+            self.conn.execute('UPDATE isos SET accessed = ? WHERE path = ?', (time.time(), iso_path))
+        return dict(zip(INFO_COLUMNS, [v or '' for v in row[4:]]))
+
+    def set(self, iso_path, info):
+        """ Save (part of) the information dictionary of an ISO. """
+        iso_path = abspath(iso_path)
+        try:
+            key = stat_key(iso_path)
+        except OSError:
+            return
+        cached = self.get(iso_path) or {}
+        cached.update({k: v for k, v in info.items() if k in INFO_COLUMNS})
+        values = [cached.get(c, '') for c in INFO_COLUMNS]
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO isos (path, dev, ino, size, mtime_ns, accessed, %s) '
+                              'VALUES (?, ?, ?, ?, ?, ?, %s)'
+                              % (', '.join(INFO_COLUMNS), ', '.join(['?'] * len(INFO_COLUMNS))),
+                              [iso_path] + list(key) + [time.time()] + values)
+
+    def delete(self, iso_path):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM isos WHERE path = ?', (abspath(iso_path),))
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM isos')
+
+
+def get_iso_info(iso_path, cache=None, cancel=None):
+    """ Return the ISO information from the cache or introspect the ISO
+        and save the result in the cache.
+        IsoCancelled is raised when the cancel event is set during the introspection.
+    """
+    if cache is not None:
+        info = cache.get(iso_path)
+        if info is not None:
+            return info
+    info = dict.fromkeys(INFO_COLUMNS, '')
+    try:
+        info.update(inspect_iso(iso_path, cancel))
+    except IsoCancelled:
+        raise
+    except (IsoError, OSError):
+        return info
+    if cache is not None:
+        cache.set(iso_path, info)
+    return info
+
+
+# ===============================================
+# Command line usage (debugging, not used by usb-creator itself)
+# ===============================================
+
+def usage():
+    print("Usage: isocache inspect PATH_TO_ISO\n"
+          "       isocache clear")
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if not args:
+        usage()
+        return 1
+    command = args[0]
+    cache = IsoCache()
+    try:
+        if command == 'clear':
+            cache.clear()
+            return 0
+        if len(args) < 2 or not isfile(args[1]):
+            usage()
+            return 1
+        iso_path = args[1]
+        if command == 'inspect':
+            info = get_iso_info(iso_path, cache)
+            for column in INFO_COLUMNS:
+                print("%s: %s" % (column, info[column]))
+        else:
+            usage()
+            return 1
+    finally:
+        cache.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,552 @@
+#!/usr/bin/env python3
+
+# In-process ISO9660 reader with Joliet and Rock Ridge support.
+# The directory tree is parsed once into a path index, a directory index
+# (directory -> entries) and a file name index so that kernel, initrd and
+# configuration lookups are dictionary lookups and don't need to list the
+# ISO with 7z.
+#
+# ECMA-119: https://www.ecma-international.org/publications-and-standards/standards/ecma-119/
+# Rock Ridge (SUSP/RRIP): IEEE P1281/P1282
+# Joliet: https://pismotec.com/cfs/jolspec.html
+
+import re
+import sys
+import struct
+from os.path import dirname, basename, isfile
+
+SECTOR_SIZE = 2048
+# Volume descriptors start at sector 16
+VD_START = 16
+VD_PRIMARY = 1
+VD_SUPPLEMENTARY = 2
+VD_TERMINATOR = 255
+JOLIET_ESCAPES = (b'%/@', b'%/C', b'%/E')
+# Directory record flags
+FLAG_DIRECTORY = 0x02
+FLAG_MULTI_EXTENT = 0x80
+# Safety net against looping directory structures
+MAX_DEPTH = 64
+
+# Search patterns (in search order)
+VMLINUZ_PATTERNS = ['vmlinuz*', 'bzImage*', 'linux*', 'generic*', 'gentoo*', 'kernel*']
+INITRD_PATTERNS = ['init*', '*.img', '*.*gz', '*.*lz', '*.xz']
+
+
+class IsoError(Exception):
+    pass
+
+
+class IsoCancelled(IsoError):
+    pass
+
+
+class IsoEntry(object):
+    __slots__ = ('path', 'name', 'size', 'extent', 'depth', 'is_dir', 'index')
+
+    def __init__(self, path, name, size, extent, depth, is_dir, index=0):
+        self.path = path
+        self.name = name
+        self.size = size
+        self.extent = extent
+        self.depth = depth
+        self.is_dir = is_dir
+        # Position in the listing
+        self.index = index
+
+    def __repr__(self):
+        return "IsoEntry(%r, size=%d, extent=%d, depth=%d)" % (self.path, self.size, self.extent, self.depth)
+
+
+class IsoReader(object):
+    """ Parse the volume descriptors and directory records of an ISO once.
+
+    Paths in the index have no leading slash, like the 7z listing:
+    e.g. 'casper/vmlinuz' or 'boot/grub/grub.cfg'.
+    """
+
+    def __init__(self, iso_path, cancel=None):
+        self.iso_path = iso_path
+        # threading.Event: stop parsing when it is set
+        self.cancel = cancel
+        self.label = ''
+        self.entries = {}
+        # Lower case path -> entry for case insensitive lookups
+        self._lower = {}
+        # Directory path ('' is the root) -> entries in the directory
+        self._children = {'': []}
+        # Lower case file name -> entries with that name (in listing order)
+        self._names = {}
+        self._file = open(iso_path, 'rb')
+        try:
+            self._parse()
+        except Exception:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _read(self, sector, length):
+        self._file.seek(sector * SECTOR_SIZE)
+        return self._file.read(length)
+
+    def _parse(self):
+        primary = None
+        joliet = None
+        sector = VD_START
+        while True:
+            vd = self._read(sector, SECTOR_SIZE)
+            if len(vd) < SECTOR_SIZE or vd[1:6] != b'CD001':
+                break
+            vd_type = vd[0]
+            if vd_type == VD_TERMINATOR:
+                break
+            if vd_type == VD_PRIMARY and primary is None:
+                primary = vd
+            elif vd_type == VD_SUPPLEMENTARY and vd[88:91] in JOLIET_ESCAPES:
+                joliet = vd
+            sector += 1
+
+        if primary is None:
+            raise IsoError("No primary volume descriptor found in %s" % self.iso_path)
+
+        # Volume identifier: this is what "dd bs=1 skip=32808 count=32" returns
+        self.label = primary[40:72].decode('ascii', 'replace').strip(' \x00')
+
+        root = primary[156:190]
+        susp_skip = self._rock_ridge_skip(root)
+        if susp_skip is not None:
+            self._walk(root, susp_skip=susp_skip)
+        elif joliet is not None:
+            self._walk(joliet[156:190], joliet=True)
+        else:
+            self._walk(root)
+
+    # Return the SUSP skip length if the root directory has a Rock Ridge "SP" entry
+    def _rock_ridge_skip(self, root_record):
+        extent, size = struct.unpack_from('<I4xI', root_record, 2)
+        data = self._read(extent, min(size, SECTOR_SIZE))
+        if not data:
+            return None
+        # First record is "." with the SUSP indicator in its system use area
+        rec_len = data[0]
+        name_len = data[32]
+        su_start = 33 + name_len + (1 - name_len % 2)
+        su = data[su_start:rec_len]
+        if len(su) >= 7 and su[0:2] == b'SP' and su[4:6] == b'\xbe\xef':
+            return su[6]
+        return None
+
+    def _walk(self, root_record, joliet=False, susp_skip=None):
+        extent, size = struct.unpack_from('<I4xI', root_record, 2)
+        # Iterative walk over (extent, size, parent path, depth)
+        stack = [(extent, size, '', 1)]
+        visited = set()
+        while stack:
+            extent, size, parent, depth = stack.pop()
+            if extent in visited or depth > MAX_DEPTH:
+                continue
+            visited.add(extent)
+            subdirs = []
+            for rec in self._records(self._read(extent, size)):
+                if self.cancel is not None and self.cancel.is_set():
+                    raise IsoCancelled("Introspection of %s cancelled" % self.iso_path)
+                flags = rec[25]
+                name_len = rec[32]
+                raw_name = rec[33:33 + name_len]
+                # Skip "." and ".."
+                if name_len == 1 and raw_name in (b'\x00', b'\x01'):
+                    continue
+                name = None
+                if susp_skip is not None:
+                    su_start = 33 + name_len + (1 - name_len % 2) + susp_skip
+                    name = self._rock_ridge_name(rec[su_start:])
+                if name is None:
+                    name = self._decode_name(raw_name, joliet)
+                rec_extent, rec_size = struct.unpack_from('<I4xI', rec, 2)
+                path = name if not parent else "%s/%s" % (parent, name)
+                is_dir = bool(flags & FLAG_DIRECTORY)
+                entry = self.entries.get(path)
+                if entry is not None and not is_dir:
+                    # Multi-extent file (> 4GB): add the size of this part
+                    entry.size += rec_size
+                    continue
+                entry = IsoEntry(path, name, 0 if is_dir else rec_size, rec_extent, depth, is_dir,
+                                 len(self.entries))
+                self.entries[path] = entry
+                self._lower.setdefault(path.lower(), entry)
+                self._children[parent].append(entry)
+                self._names.setdefault(name.lower(), []).append(entry)
+                if is_dir:
+                    self._children.setdefault(path, [])
+                    subdirs.append((rec_extent, rec_size, path, depth + 1))
+            # Keep the listing order depth first and sorted like the ISO itself
+            stack.extend(reversed(subdirs))
+
+    # Yield directory records from a directory extent.
+    # Records never cross a sector boundary: a zero length byte means
+    # the rest of the sector is padding.
+    def _records(self, data):
+        pos = 0
+        end = len(data)
+        while pos < end:
+            rec_len = data[pos]
+            if rec_len == 0:
+                pos = (pos // SECTOR_SIZE + 1) * SECTOR_SIZE
+                continue
+            if rec_len < 34 or pos + rec_len > end:
+                break
+            yield data[pos:pos + rec_len]
+            pos += rec_len
+
+    def _decode_name(self, raw_name, joliet):
+        if joliet:
+            name = raw_name.decode('utf-16-be', 'replace')
+        else:
+            name = raw_name.decode('ascii', 'replace')
+        # Remove version number and trailing dot: NAME.EXT;1
+        name = name.split(';')[0]
+        if name.endswith('.'):
+            name = name[:-1]
+        return name
+
+    # Get the alternate name (NM) from the Rock Ridge system use entries
+    def _rock_ridge_name(self, su):
+        parts = []
+        found = False
+        pos = 0
+        while pos + 4 <= len(su):
+            sig = su[pos:pos + 2]
+            length = su[pos + 2]
+            if length < 4:
+                break
+            if sig == b'NM':
+                found = True
+                nm_flags = su[pos + 4]
+                parts.append(su[pos + 5:pos + length])
+                if not nm_flags & 0x01:
+                    break
+            elif sig == b'CE':
+                # Continuation area
+                block, offset, ce_len = struct.unpack_from('<I4xI4xI', su, pos + 4)
+                self._file.seek(block * SECTOR_SIZE + offset)
+                su = self._file.read(ce_len)
+                pos = 0
+                continue
+            elif sig == b'ST':
+                break
+            pos += length
+        if not found:
+            return None
+        return b''.join(parts).decode('utf-8', 'replace')
+
+    # ===============================================
+    # Lookups
+    # ===============================================
+
+    def get_entry(self, path, ignore_case=False):
+        path = path.strip('/')
+        if ignore_case:
+            return self._lower.get(path.lower())
+        return self.entries.get(path)
+
+    def exists(self, path, ignore_case=False):
+        return self.get_entry(path, ignore_case) is not None
+
+    def paths(self):
+        return self.entries.keys()
+
+    def files(self):
+        return [e for e in self.entries.values() if not e.is_dir]
+
+    def directories(self):
+        """ Return the paths of the directories ('' is the root). """
+        return self._children.keys()
+
+    def list_dir(self, path):
+        """ Return the entries of a directory ('' is the root). """
+        return self._children.get(path.strip('/'), [])
+
+    def walk(self, path=''):
+        """ Yield the entries below a directory in listing order. """
+        stack = [path.strip('/')]
+        while stack:
+            children = self._children.get(stack.pop(), [])
+            for e in children:
+                yield e
+            stack.extend(reversed([e.path for e in children if e.is_dir]))
+
+    def named(self, name, ignore_case=False):
+        """ Return the entries with file name name in listing order. """
+        entries = self._names.get(name.lower(), [])
+        if ignore_case:
+            return list(entries)
+        return [e for e in entries if e.name == name]
+
+    def has_prefix(self, path):
+        """ Return True if a path in the ISO starts with path
+            ('live/vmlinuz' for 'live/vmlinuz-6.1.0-amd64').
+        """
+        parent, _, name = path.strip('/').rpartition('/')
+        return any(e.name.startswith(name) for e in self.list_dir(parent))
+
+    def read_file(self, path, max_size=1024 * 1024):
+        entry = self.get_entry(path)
+        if entry is None or entry.is_dir:
+            return None
+        return self._read(entry.extent, min(entry.size, max_size))
+
+    def read_text(self, path):
+        data = self.read_file(path)
+        if data is None:
+            return None
+        return data.decode('utf-8', 'replace')
+
+    def find_files(self, regexp, ignore_case=False):
+        flags = re.IGNORECASE if ignore_case else 0
+        ptrn = re.compile(regexp, flags)
+        return [e for e in self.entries.values() if ptrn.search(e.path)]
+
+    def find_file(self, patterns, prefix=''):
+        """ Return the path of the largest file matching the first matching
+            shell pattern (case insensitive). Paths containing "efi" or
+            square brackets are skipped. Optional prefix is a directory.
+        """
+        # Files below prefix from the directory index
+        candidates = []
+        for e in self.walk(prefix):
+            lpath = e.path.lower()
+            if not e.is_dir and 'efi' not in lpath and '[' not in lpath and ']' not in lpath:
+                candidates.append(e)
+        for ptrn in patterns:
+            regexp = re.compile(_shell_pattern_to_regexp(ptrn), re.IGNORECASE)
+            best = None
+            for e in candidates:
+                if not regexp.search(e.name):
+                    continue
+                if best is None or e.size > best.size or \
+                   (e.size == best.size and e.depth < best.depth):
+                    best = e
+            if best is not None:
+                return best.path
+        return ''
+
+
+def _shell_pattern_to_regexp(ptrn):
+    regexp = ''
+    for c in ptrn:
+        if c == '*':
+            regexp += '.*'
+        elif c == '?':
+            regexp += '.'
+        else:
+            regexp += re.escape(c)
+    return '^%s$' % regexp
+
+
+# ===============================================
+# Boot configuration search
+# ===============================================
+
+# Remove words containing variables or words from the given list, squeeze spaces
+def _clean_options(words, remove):
+    remove_ptrn = re.compile(r'\$|%s' % '|'.join(remove), re.IGNORECASE)
+    return ' '.join([w for w in words if not remove_ptrn.search(w)])
+
+
+def _absolute(path, base_dir):
+    if not path.startswith('/'):
+        path = '/%s/%s' % (base_dir.strip('/'), path)
+    return path
+
+
+def _first_line(text, regexp):
+    ptrn = re.compile(regexp, re.IGNORECASE)
+    for line in text.splitlines():
+        if ptrn.search(line):
+            return line
+    return ''
+
+
+def search_kernel(reader):
+    """ Search kernel, initrd and boot options in the ISO.
+        Returns a (vmlinuz, initrd, boot_options) tuple.
+    """
+    vmlinuz = ''
+    initrd = ''
+    options = ''
+
+    # Get kernel/initramfs paths from grub.cfg
+    grub_cfg_ptrn = re.compile(r'boot/grub.*/grub\.cfg$')
+    grub_cfgs = [e for e in reader.named('grub.cfg') if grub_cfg_ptrn.search(e.path)]
+    if grub_cfgs:
+        grub_cfg = grub_cfgs[0].path
+        grub_dir = dirname(grub_cfg)
+        cfg = reader.read_text(grub_cfg) or ''
+        line = _first_line(cfg, r'^\s*linux')
+        words = line.split()
+        if len(words) > 1:
+            kernel_path = _absolute(words[1], grub_dir)
+            if reader.exists(kernel_path):
+                vmlinuz = kernel_path
+                options = _clean_options(words[2:], ['label', 'uuid'])
+        line = _first_line(cfg, r'^\s*initrd')
+        words = line.split()
+        if len(words) > 1:
+            initrd_path = _absolute(words[1], grub_dir)
+            if reader.exists(initrd_path):
+                initrd = initrd_path
+
+    # Get kernel/initramfs paths from isolinux/*.cfg
+    if not vmlinuz or not initrd:
+        isolinux_cfgs = set()
+        for d in reader.directories():
+            # Configuration files below directories named *isolinux
+            if basename(d).endswith('isolinux'):
+                isolinux_cfgs.update(e for e in reader.walk(d) if e.path.endswith('.cfg'))
+        isolinux_cfgs = sorted(isolinux_cfgs, key=lambda e: e.index)
+        if not isolinux_cfgs:
+            # isolinux not in default directory: search for it
+            search_cfgs = reader.named('isolinux.cfg')
+            if search_cfgs:
+                isolinux_dir = dirname(search_cfgs[0].path)
+                isolinux_cfgs = [e for e in reader.list_dir(isolinux_dir) if e.path.endswith('.cfg')]
+        for e in isolinux_cfgs:
+            # Exit loop if kernel and initramfs were found
+            if vmlinuz and initrd:
+                break
+            cfg_dir = dirname(e.path)
+            cfg = reader.read_text(e.path) or ''
+            if not vmlinuz:
+                words = _first_line(cfg, r'^\s*kernel').split()
+                if len(words) > 1:
+                    kernel_path = _absolute(words[1], cfg_dir)
+                    if reader.exists(kernel_path):
+                        vmlinuz = kernel_path
+            if not initrd:
+                match_obj = re.search(r'initrd=(\S*)', cfg)
+                if match_obj:
+                    for initrd_path in match_obj.group(1).split(','):
+                        if not initrd_path:
+                            continue
+                        initrd_path = _absolute(initrd_path, cfg_dir)
+                        if reader.exists(initrd_path):
+                            # Multiple initramfs files are loaded from the loop device
+                            if initrd:
+                                initrd = "(loop)%s" % initrd
+                            initrd = "%s %s" % (initrd_path, initrd)
+                            if not options:
+                                line = _first_line(cfg, r'initrd=')
+                                options = _clean_options(line.split(), ['label', 'uuid', 'append', 'initrd'])
+                    initrd = initrd.strip()
+
+    # Search for vmlinuz file if not able via configuration
+    if not vmlinuz:
+        vmlinuz = reader.find_file(VMLINUZ_PATTERNS)
+
+    # Search for initrd in the same directory as vmlinuz was found
+    if not initrd and vmlinuz:
+        initrd = reader.find_file(INITRD_PATTERNS, dirname(vmlinuz))
+
+    # initrd not found: search whole of the ISO
+    if not initrd:
+        initrd = reader.find_file(INITRD_PATTERNS)
+
+    if vmlinuz and not vmlinuz.startswith('/'):
+        vmlinuz = '/%s' % vmlinuz
+    if initrd and not initrd.startswith('/'):
+        initrd = '/%s' % initrd
+
+    return (vmlinuz, initrd, options)
+
+
+def search_loopback(reader):
+    """ Return the loopback.cfg path if its kernel paths exist in the ISO.
+        https://www.aioboot.com/en/boot-linux-iso/
+    """
+    loopback = '/boot/grub/loopback.cfg'
+    lbs = sorted([e for d in reader.directories() if d.endswith('boot/grub')
+                  for e in reader.list_dir(d) if e.name.startswith('loopback.cfg')],
+                 key=lambda e: e.index)
+    if not lbs:
+        return ''
+    cfg = reader.read_text(lbs[0].path)
+    if cfg is None:
+        # Just gamble that loopback is correctly formatted
+        return loopback
+    # Check if linux/initrd/source paths are correct
+    ptrn = re.compile(r'^\s+linux|^\s+initrd|^\s*source')
+    kernel_paths = []
+    for line in cfg.splitlines():
+        if ptrn.search(line):
+            words = line.split()
+            if len(words) > 1:
+                kernel_paths.append(words[1])
+            if len(kernel_paths) == 2:
+                break
+    for kp in kernel_paths:
+        kp = kp.strip('/')
+        if not reader.exists(kp) and not reader.has_prefix(kp):
+            # Path not found: use legacy (vmlinuz/initrd)
+            return ''
+    return loopback
+
+
+def inspect_iso(iso_path, cancel=None):
+    """ Gather all boot information of an ISO in a single pass.
+        Returns a dictionary with label, loopback, vmlinuz, initrd and options.
+        Raises IsoCancelled when the cancel event is set while the ISO is parsed.
+    """
+    info = {'label': '', 'loopback': '', 'vmlinuz': '', 'initrd': '', 'options': ''}
+    with IsoReader(iso_path, cancel) as reader:
+        info['label'] = reader.label
+        info['loopback'] = search_loopback(reader)
+        info['vmlinuz'], info['initrd'], info['options'] = search_kernel(reader)
+    return info
+
+
+# ===============================================
+# Command line usage (debugging, not used by usb-creator itself)
+# ===============================================
+
+def usage():
+    print("Usage: isoreader [label|list|inspect] PATH_TO_ISO")
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) != 2 or not isfile(args[1]):
+        usage()
+        return 1
+    command, iso_path = args
+    try:
+        if command == 'label':
+            with IsoReader(iso_path) as reader:
+                print(reader.label)
+        elif command == 'list':
+            with IsoReader(iso_path) as reader:
+                for e in reader.entries.values():
+                    print("%d %d %s%s" % (e.size, e.depth, e.path, '/' if e.is_dir else ''))
+        elif command == 'inspect':
+            info = inspect_iso(iso_path)
+            for key in ('label', 'loopback', 'vmlinuz', 'initrd', 'options'):
+                print("%s: %s" % (key, info[key]))
+        else:
+            usage()
+            return 1
+    except (IsoError, OSError) as e:
+        print("%s: %s" % (basename(iso_path), e), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
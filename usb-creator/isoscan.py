@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+# Background scan of a directory of ISOs (the ISO field of the GUI can be a
+# directory). The directory and the mounted device are listed once with
+# os.scandir and the sizes come from the stat results cached in the
+# directory entries: one stat per ISO, which matters on network shares.
+# A scan can be cancelled and reports partial totals while it runs.
+#
+# Sizes of unpacked ISOs (directory trees) are cached per directory and
+# only scanned again when the modification time of a directory changed, so
+# refreshing a device with unpacked distributions only stats directories.
+
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Seconds between partial totals
+REPORT_INTERVAL = 0.1
+# Directories of a tree level that are scanned in parallel (slow USB and network file systems)
+PARALLEL_MIN_DIRS = 8
+WALK_WORKERS = 4
+MAX_CACHED_DIRS = 100000
+
+
+def list_isos(path):
+    """ Return {name: os.DirEntry} of the *.iso entries of a directory
+        (hidden entries are skipped, like glob does).
+    """
+    isos = {}
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.endswith('.iso') and not entry.name.startswith('.'):
+                    isos[entry.name] = entry
+    except OSError:
+        pass
+    return isos
+
+
+def entry_size(entry, dir_size):
+    """ Return the size of an ISO entry in KiB. dir_size(path) returns the size
+        of an unpacked ISO directory.
+    """
+    try:
+        if entry.is_dir():
+            return dir_size(entry.path)
+        return entry.stat().st_size / 1024
+    except OSError:
+        return 0
+
+
+class DirSizeCache(object):
+    """ Size of the files in directory trees (symbolic links are skipped).
+
+    Per directory the size of its files and its subdirectories are cached with
+    the modification time of the directory, which changes when entries are
+    added, removed or renamed. Files that are rewritten in place are not seen.
+    """
+
+    def __init__(self, workers=WALK_WORKERS, parallel_min_dirs=PARALLEL_MIN_DIRS):
+        self.workers = workers
+        self.parallel_min_dirs = parallel_min_dirs
+        # {path: (st_mtime_ns, bytes of the files, [subdirectory paths])}
+        self._dirs = {}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _scan_dir(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._dirs.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2]
+        size = 0
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_symlink():
+                    continue
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    # Cached stat of the directory entry
+                    size += entry.stat().st_size
+        if len(self._dirs) >= MAX_CACHED_DIRS:
+            self._dirs.clear()
+        self._dirs[path] = (mtime, size, subdirs)
+        return size, subdirs
+
+    def _scan_level(self, paths):
+        if len(paths) < self.parallel_min_dirs or self.workers < 2:
+            return [self._scan_dir_safe(path) for path in paths]
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        return list(self._pool.map(self._scan_dir_safe, paths))
+
+    def _scan_dir_safe(self, path):
+        try:
+            return self._scan_dir(path)
+        except OSError:
+            # Removed while scanning or no permission
+            self._dirs.pop(path, None)
+            return 0, []
+
+    def size(self, path):
+        """ Return the size of the files in the tree of path in bytes. """
+        path = os.path.abspath(path)
+        total = 0
+        level = [path]
+        while level:
+            next_level = []
+            for size, subdirs in self._scan_level(level):
+                total += size
+                next_level.extend(subdirs)
+            level = next_level
+        return total
+
+    def clear(self):
+        self._dirs.clear()
+
+
+dir_sizes = DirSizeCache()
+
+
+def tree_size(path):
+    """ Size of the files in a directory tree in KiB (cached). """
+    return dir_sizes.size(path) / 1024
+
+
+class IsoDirScan(object):
+    """ Sum the sizes of the ISOs in iso_dir minus the sizes of the ISOs with the
+        same name on mount (they are overwritten).
+
+    progress(required, done, count) is called from the scan thread at most every
+    REPORT_INTERVAL seconds, finished(required, count) when the scan is done.
+    Neither is called after cancel().
+    """
+
+    def __init__(self, iso_dir, mount='', dir_size=tree_size, progress=None, finished=None):
+        self.iso_dir = iso_dir
+        self.mount = mount
+        self.dir_size = dir_size
+        self.progress = progress
+        self.finished = finished
+        self.required = 0
+        self.count = 0
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="ISO directory scan")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        """ Scan in the calling thread. Returns the required KiB (None when cancelled). """
+        isos = list_isos(self.iso_dir)
+        on_device = list_isos(self.mount) if self.mount and isos else {}
+        self.count = len(isos)
+        required = 0
+        last_report = time.monotonic()
+        for done, (name, entry) in enumerate(sorted(isos.items()), 1):
+            if self._cancel.is_set():
+                return None
+            required += entry_size(entry, self.dir_size)
+            if name in on_device:
+                # The ISO on the device is overwritten
+                required -= entry_size(on_device[name], self.dir_size)
+            self.required = max(0, required)
+            now = time.monotonic()
+            if self.progress is not None and now - last_report >= REPORT_INTERVAL and done < self.count:
+                last_report = now
+                self.progress(self.required, done, self.count)
+        if self._cancel.is_set():
+            return None
+        if self.finished is not None:
+            self.finished(self.required, self.count)
+        return self.required
+
+
+# ===============================================
+# Command line usage
+# ===============================================
+
+def benchmark(path, rounds=3):
+    """ Time the size of a directory tree: os.walk, first scan (sequential and
+        parallel) and cached. Returns [(name, seconds, bytes), ...].
+    """
+    def walk_size(path):
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(path):
+            for name in filenames:
+                fp = os.path.join(dirpath, name)
+                if not os.path.islink(fp):
+                    total += os.path.getsize(fp)
+        return total
+
+    result = []
+    for name, func in (('os.walk', walk_size),
+                       ('scandir', lambda p: DirSizeCache(workers=1).size(p)),
+                       ('scandir parallel', lambda p: DirSizeCache().size(p))):
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            size = func(path)
+            timings.append(time.perf_counter() - start)
+        result.append((name, min(timings), size))
+    cache = DirSizeCache()
+    cache.size(path)
+    start = time.perf_counter()
+    size = cache.size(path)
+    result.append(('cached', time.perf_counter() - start, size))
+    return result
+
+
+def usage():
+    print("Usage: isoscan ISO_DIRECTORY [MOUNT_POINT]\n"
+          "       isoscan benchmark DIRECTORY")
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) == 2 and args[0] == 'benchmark' and os.path.isdir(args[1]):
+        for name, seconds, size in benchmark(args[1]):
+            print("%8.1f ms  %-16s %d MB" % (seconds * 1000, name, size / (1024 * 1024)))
+        return 0
+    if not args or len(args) > 2 or not os.path.isdir(args[0]):
+        usage()
+        return 1
+    start = time.perf_counter()
+    scan = IsoDirScan(args[0], args[1] if len(args) > 1 else '',
+                      progress=lambda required, done, count: print("%d/%d: %d MB" % (done, count, required / 1024)))
+    required = scan.run()
+    print("%d ISOs, required: %d MB (%.1f ms)" % (scan.count, required / 1024, (time.perf_counter() - start) * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
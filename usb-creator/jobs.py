@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+# Python API of the backend: add ISOs to, remove ISOs from or write ISOs to
+# USB devices in-process, without a shell or a usb-creator process per job.
+#
+#   jobs = importlib.import_module('usb-creator.jobs')
+#   job = jobs.add_iso('/dev/sdb', '/isos/debian.iso', {'partition': True},
+#                      on_phase=print, on_progress=print)
+#   result = job.run()                   # in the calling thread
+#   future = executor.submit(job.run)    # in a thread pool
+#   result = await job.run_async()       # in an asyncio loop
+#   job.cancel()                         # from any thread
+#
+# Callbacks are called from the thread that runs the job (and from the copy
+# threads for on_progress): marshal them to your loop if needed.
+# Progress and phase events have the format of progress.py.
+#
+# Root operations go to the privileged helper (helper.py), which is started
+# once with pkexec. It handles each request in its own thread: jobs on
+# different devices run concurrently, operations on the same device wait.
+
+import time
+import threading
+from concurrent.futures import Future
+
+from .backend import Backend, BACKEND_ERRORS, FILES_DIR, EXIT_OK, EXIT_CANCELLED, error_exit_code
+from .progress import CallbackEmitter, DEFAULT_HZ
+
+ACTION_ADD = 'add'
+ACTION_REMOVE = 'remove'
+ACTION_WRITE = 'write'
+
+# Job options and their defaults
+DEFAULT_OPTIONS = {
+    # Partition the device before adding the ISO (-p)
+    'partition': False,
+    # Force the distribution name (-f)
+    'distribution': '',
+    'files_dir': FILES_DIR,
+    # Progress events per second
+    'progress_hz': DEFAULT_HZ,
+}
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+
+
+class JobResult(object):
+    """ Result of a job.
+
+    code: exit code of the backend (see backend.py, EXIT_CANCELLED when cancelled)
+    message: last log message (the error message when code is not EXIT_OK)
+    phases: [(phase, seconds), ...] in the order the phases started
+    processes: number of child processes started (udisksctl, 7z)
+    """
+
+    def __init__(self, code, message='', started=0, finished=0, phases=None, processes=0):
+        self.code = code
+        self.message = message
+        self.started = started
+        self.finished = finished
+        self.phases = phases or []
+        self.processes = processes
+
+    @property
+    def ok(self):
+        return self.code == EXIT_OK
+
+    @property
+    def cancelled(self):
+        return self.code == EXIT_CANCELLED
+
+    @property
+    def elapsed(self):
+        return self.finished - self.started
+
+    def __repr__(self):
+        return "JobResult(code=%d, elapsed=%.1f, message=%r)" % (self.code, self.elapsed, self.message)
+
+
+class Job(object):
+
+    def __init__(self, action, iso, devices, options=None,
+                 on_progress=None, on_phase=None, on_log=None):
+        if action not in (ACTION_ADD, ACTION_REMOVE, ACTION_WRITE):
+            raise ValueError("Unknown action: %s" % action)
+        self.action = action
+        self.iso = iso
+        self.devices = [devices] if isinstance(devices, str) else list(devices)
+        self.options = dict(DEFAULT_OPTIONS)
+        if options:
+            unknown = set(options) - set(DEFAULT_OPTIONS)
+            if unknown:
+                raise ValueError("Unknown options: %s" % ', '.join(sorted(unknown)))
+            self.options.update(options)
+        self.on_progress = on_progress
+        self.on_phase = on_phase
+        self.on_log = on_log
+        self.state = PENDING
+        self.result = None
+        self.messages = []
+        # {phase: [start, end]} in the order the phases started
+        self._timings = {}
+        self._lock = threading.Lock()
+        self._backend = None
+        self._cancel_requested = False
+
+    def __repr__(self):
+        return "Job(%s, %s, %s, %s)" % (self.action, self.iso, ' '.join(self.devices), self.state)
+
+    def _log(self, message):
+        self.messages.append(message)
+        if self.on_log is not None:
+            self.on_log(message)
+
+    def _event(self, event):
+        # Progress events of the backend, the copy threads and the helper
+        phase = event.get('phase', '')
+        now = event.get('time', time.time())
+        with self._lock:
+            if event.get('event') == 'phase' and phase not in self._timings:
+                self._timings[phase] = [now, now]
+            elif phase in self._timings:
+                self._timings[phase][1] = now
+        if event.get('event') == 'phase':
+            if self.on_phase is not None:
+                self.on_phase(phase)
+        elif self.on_progress is not None:
+            self.on_progress(event)
+
+    def _phases(self, finished):
+        phases = list(self._timings.items())
+        if phases:
+            # The last phase lasts until the end of the job
+            phases[-1][1][1] = finished
+        return [(name, end - start) for name, (start, end) in phases]
+
+    def cancel(self):
+        """ Cancel the job: a pending job does not start, a running job stops
+            at the next step (a running copy is stopped and removed).
+        """
+        with self._lock:
+            self._cancel_requested = True
+            backend = self._backend
+        if backend is not None:
+            backend.cancel()
+
+    def run(self):
+        """ Run the job in the calling thread. Returns a JobResult. """
+        with self._lock:
+            if self.state != PENDING:
+                raise RuntimeError("%r was already started" % self)
+            self.state = RUNNING
+            backend = Backend(self.options['files_dir'], self._log,
+                              CallbackEmitter(self._event, self.options['progress_hz']))
+            backend.remove = self.action == ACTION_REMOVE
+            backend.unpack = self.action == ACTION_WRITE
+            backend.partition = bool(self.options['partition'])
+            if self._cancel_requested:
+                backend.cancel()
+            self._backend = backend
+
+        started = time.time()
+        try:
+            if self.options['distribution']:
+                backend.force_distribution(self.options['distribution'])
+            code = backend.run(self.iso, self.devices)
+        except BACKEND_ERRORS as e:
+            self._log(str(e))
+            code = error_exit_code(e)
+        finally:
+            finished = time.time()
+            with self._lock:
+                self._backend = None
+                self.state = DONE
+        self.result = JobResult(code, self.messages[-1] if self.messages else '', started, finished,
+                                self._phases(finished), backend.processes)
+        return self.result
+
+    def start(self, executor=None):
+        """ Run the job in executor (or a new thread). Returns a concurrent.futures.Future. """
+        if executor is not None:
+            return executor.submit(self.run)
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self.run())
+            except BaseException as e:
+                future.set_exception(e)
+
+        thread = threading.Thread(target=run, name="usb-creator job")
+        thread.daemon = True
+        thread.start()
+        return future
+
+    def run_async(self, executor=None):
+        """ Return an asyncio future of the JobResult (call it from a running loop). """
+        import asyncio
+        return asyncio.wrap_future(self.start(executor))
+
+
+def add_iso(device, iso, options=None, on_progress=None, on_phase=None, on_log=None):
+    """ Return a job that adds iso to the multi-boot device(s).
+        device: device path or list of device paths (the ISO is read once for all devices)
+    """
+    return Job(ACTION_ADD, iso, device, options, on_progress, on_phase, on_log)
+
+
+def remove_iso(device, iso_name, options=None, on_progress=None, on_phase=None, on_log=None):
+    """ Return a job that removes the ISO with file name iso_name from the device(s). """
+    return Job(ACTION_REMOVE, iso_name, device, options, on_progress, on_phase, on_log)
+
+
+def write_image(device, iso, options=None, on_progress=None, on_phase=None, on_log=None):
+    """ Return a job that writes iso to the whole device(s) and verifies it (-u). """
+    return Job(ACTION_WRITE, iso, device, options, on_progress, on_phase, on_log)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Resolve the grub theme icon for an ISO name or label.
+# The icon names are indexed once (like the distribution names) and the
+# results are memoized per name so repainting the ISO list costs nothing.
+
+from os.path import join, basename, splitext
+from glob import glob
+from functools import lru_cache
+
+from .distroindex import DistroIndex
+from .distros import DistroScorer
+
+ICONS_DIR = '/usr/share/usb-creator/grub/themes/usb-creator/icons'
+# Generic icons that are never matched by name
+GENERIC_ICONS = ['iso', 'linux']
+CACHE_SIZE = 256
+
+
+def get_logos(icons_dir=ICONS_DIR):
+    logos_dict = {}
+    for logo in glob(join(icons_dir, '*.png')):
+        key = splitext(basename(logo))[0]
+        logos_dict[key] = logo
+    return logos_dict
+
+
+class LogoResolver(object):
+
+    def __init__(self, icons_dir=ICONS_DIR, distro_scorer=None, cache_size=CACHE_SIZE):
+        self.logos = get_logos(icons_dir)
+
+        # Index the icon names to fuzzy match them with the ISO name
+        candidates = [('logo', key) for key in sorted(self.logos) if key not in GENERIC_ICONS]
+        index = DistroIndex.from_candidates(['logo'], candidates)
+        self.logo_scorer = DistroScorer(index=index)
+
+        # Map the distribution names of the families catalogue to an icon:
+        # the distribution icon or else the icon of the family
+        self.distro_scorer = distro_scorer
+        self.distro_logos = {}
+        if distro_scorer is not None:
+            for family, name in distro_scorer.index.candidates:
+                logo = self.logos.get(name, self.logos.get(family))
+                if logo and name not in self.distro_logos:
+                    self.distro_logos[name] = logo
+
+        self.resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def _resolve(self, search_string):
+        """ Return the icon path for an ISO name or label or '' if not found. """
+        search_string = search_string.lower()
+        family, key, ratio = self.logo_scorer.score(search_string)
+        if key:
+            return self.logos[key]
+        if self.distro_scorer is not None:
+            family, name, ratio = self.distro_scorer.score(search_string)
+            if name:
+                return self.distro_logos.get(name, '')
+        return ''
+
+    def clear(self):
+        self.resolve.cache_clear()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# Machine readable progress events of the backend.
+# Events are JSON lines written to the file descriptor in the
+# USB_CREATOR_PROGRESS_FD environment variable, e.g.:
+#
+#   USB_CREATOR_PROGRESS_FD=3 usb-creator my.iso /dev/sdb 3>progress.jsonl
+#
+# {"event": "phase", "phase": "copy", "time": 1700000000.1}
+# {"event": "progress", "phase": "copy", "time": 1700000001.3, "bytes_done": 104857600,
+#  "bytes_total": 2147483648, "rate": 52428800.0, "avg_rate": 50331648.0, "eta": 40.6}
+# {"event": "exit", "phase": "done", "time": 1700000050.2, "code": 0}
+#
+# When an ISO is written to several devices the events of a device have a "target" key.
+#
+# Phases: gather, partition, unpack, copy, verify, grub, dd, remove, done
+# Progress events are sent at most USB_CREATOR_PROGRESS_HZ times per second (default 4).
+
+import os
+import json
+import time
+
+PROGRESS_FD_ENV = 'USB_CREATOR_PROGRESS_FD'
+PROGRESS_HZ_ENV = 'USB_CREATOR_PROGRESS_HZ'
+DEFAULT_HZ = 4
+
+
+class ProgressEmitter(object):
+
+    def __init__(self, fd=None, hz=DEFAULT_HZ, target=None):
+        self.fd = fd
+        self.hz = hz
+        self.interval = 1.0 / hz if hz > 0 else 0
+        self.target = target
+        self.phase_name = ''
+        self._phase_start = 0
+        self._phase_start_bytes = 0
+        self._last_time = 0
+        self._last_bytes = 0
+
+    @classmethod
+    def from_env(cls):
+        """ Return an emitter for the file descriptor in the environment
+            (or an emitter that does nothing when it is not set).
+        """
+        fd = None
+        hz = DEFAULT_HZ
+        try:
+            fd = int(os.environ[PROGRESS_FD_ENV])
+            os.fstat(fd)
+        except (KeyError, ValueError, OSError):
+            fd = None
+        try:
+            hz = float(os.environ.get(PROGRESS_HZ_ENV, DEFAULT_HZ))
+        except ValueError:
+            pass
+        return cls(fd, hz)
+
+    def for_target(self, target):
+        """ Return an emitter on the same file descriptor for the events of a target. """
+        return ProgressEmitter(self.fd, self.hz, target)
+
+    @property
+    def enabled(self):
+        return self.fd is not None
+
+    def emit(self, event):
+        if self.fd is None:
+            return
+        if self.target is not None:
+            event['target'] = self.target
+        try:
+            # Lines are shorter than PIPE_BUF: writes of several threads do not mix
+            os.write(self.fd, (json.dumps(event) + '\n').encode('utf-8'))
+        except OSError:
+            # Reader went away: stop sending events
+            self.fd = None
+
+    def phase(self, name, bytes_total=0):
+        now = time.time()
+        self.phase_name = name
+        self._phase_start = now
+        self._phase_start_bytes = 0
+        self._last_time = now
+        self._last_bytes = 0
+        event = {'event': 'phase', 'phase': name, 'time': now}
+        if bytes_total:
+            event['bytes_total'] = bytes_total
+        self.emit(event)
+
+    def update(self, phase, bytes_done, bytes_total, force=False):
+        """ Send a progress event (rate limited unless force is True). """
+        if not self.enabled:
+            return
+        if phase != self.phase_name:
+            self.phase(phase, bytes_total)
+        now = time.time()
+        elapsed = now - self._last_time
+        if not force and elapsed < self.interval:
+            return
+        rate = (bytes_done - self._last_bytes) / elapsed if elapsed > 0 else 0.0
+        phase_elapsed = now - self._phase_start
+        avg_rate = (bytes_done - self._phase_start_bytes) / phase_elapsed if phase_elapsed > 0 else 0.0
+        eta = (bytes_total - bytes_done) / avg_rate if avg_rate > 0 else None
+        self._last_time = now
+        self._last_bytes = bytes_done
+        self.emit({'event': 'progress', 'phase': phase, 'time': now,
+                   'bytes_done': bytes_done, 'bytes_total': bytes_total,
+                   'rate': round(rate, 1), 'avg_rate': round(avg_rate, 1),
+                   'eta': round(eta, 1) if eta is not None else None})
+
+    def exit(self, code):
+        self.emit({'event': 'exit', 'phase': 'done', 'time': time.time(), 'code': code})
+
+
+class CallbackEmitter(ProgressEmitter):
+    """ Pass the events to a function instead of writing them to a file descriptor
+        (jobs.py). The function is called from the thread that sends the event.
+    """
+
+    def __init__(self, callback, hz=DEFAULT_HZ, target=None):
+        super(CallbackEmitter, self).__init__(None, hz, target)
+        self.callback = callback
+
+    def for_target(self, target):
+        return CallbackEmitter(self.callback, self.hz, target)
+
+    @property
+    def enabled(self):
+        return self.callback is not None
+
+    def emit(self, event):
+        if self.callback is None:
+            return
+        if self.target is not None:
+            event['target'] = self.target
+        self.callback(event)
+
+
+class ProgressReader(object):
+    """ Parse JSON lines from a (non-blocking) stream of bytes. """
+
+    def __init__(self):
+        self._buffer = b''
+
+    def feed(self, data):
+        """ Return the list of complete events in data. """
+        self._buffer += data
+        events = []
+        while b'\n' in self._buffer:
+            line, self._buffer = self._buffer.split(b'\n', 1)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                events.append(json.loads(line.decode('utf-8')))
+            except ValueError:
+                pass
+        return events
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# Write an ISO image to one or more whole devices (usb-creator -u).
+# Replaces "dd bs=64k oflag=dsync": the image is written in large blocks
+# through the page cache while the amount of dirty data is kept small by
+# starting writeback of every window and waiting for the previous one
+# (sync_file_range). The device is flushed once at the end.
+#
+# Optional:
+# - discard the device first and do not write the all-zero blocks of the
+#   image: skipped when the device reports that discarded blocks read back
+#   as zeros (queue/discard_zeroes_data), zeroed with BLKZEROOUT when the
+#   device zeroes without a data transfer (queue/write_zeroes_max_bytes),
+#   written like any other block otherwise
+# - read the device back and compare it with the chunk manifest
+#
+# Runs as root in the privileged helper (write_image operation, helper.py):
+# log lines and progress events go to the client of the helper.
+
+import os
+import fcntl
+import ctypes
+import struct
+
+from .copier import CopyEngine, CopyError, copy_targets, drop_cache, chunk_digest, \
+                    EXIT_TARGET_NOT_FOUND
+
+BLOCK_SIZE = 4 * 1024 * 1024
+# Bytes between writeback of the written data
+WRITEBACK_SIZE = 32 * 1024 * 1024
+
+# linux/fs.h
+BLKDISCARD = 0x1277
+BLKZEROOUT = 0x127f
+SECTOR_SIZE = 512
+SYNC_FILE_RANGE_WAIT_BEFORE = 1
+SYNC_FILE_RANGE_WRITE = 2
+SYNC_FILE_RANGE_WAIT_AFTER = 4
+
+
+def _load_sync_file_range():
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        func = libc.sync_file_range
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong, ctypes.c_uint]
+    func.restype = ctypes.c_int
+    return func
+
+_sync_file_range = _load_sync_file_range()
+
+
+def sync_range(fd, offset, length, flags):
+    """ Returns False if sync_file_range is not available. """
+    if _sync_file_range is None:
+        return False
+    if _sync_file_range(fd, offset, length, flags) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return True
+
+
+def discard_device(fd, length):
+    """ Discard the first length bytes of a block device. Returns True on success. """
+    try:
+        fcntl.ioctl(fd, BLKDISCARD, struct.pack('QQ', 0, length))
+        return True
+    except OSError:
+        return False
+
+
+def zero_out(fd, offset, length):
+    """ Zero a range of a block device (offset and length in whole sectors). Returns True on success. """
+    if offset % SECTOR_SIZE or length % SECTOR_SIZE:
+        return False
+    try:
+        fcntl.ioctl(fd, BLKZEROOUT, struct.pack('QQ', offset, length))
+        return True
+    except OSError:
+        return False
+
+
+def queue_attribute(fd, name):
+    """ Return an attribute of the request queue of the block device of fd ('' if unknown). """
+    try:
+        rdev = os.fstat(fd).st_rdev
+        with open('/sys/dev/block/%d:%d/queue/%s' % (os.major(rdev), os.minor(rdev), name)) as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+# How the zero blocks of the image are handled after a discard
+ZEROES_WRITE = ''
+ZEROES_SKIP = 'skip'
+ZEROES_ZEROOUT = 'zeroout'
+
+
+def zeroes_mode(fd):
+    if queue_attribute(fd, 'discard_zeroes_data') == '1':
+        return ZEROES_SKIP
+    try:
+        if int(queue_attribute(fd, 'write_zeroes_max_bytes') or 0) > 0:
+            return ZEROES_ZEROOUT
+    except ValueError:
+        pass
+    return ZEROES_WRITE
+
+
+class RawWriter(CopyEngine):
+    """ Write source to a block device (see CopyEngine for progress and verify). """
+
+    def __init__(self, source, device, block_size=BLOCK_SIZE, writeback_size=WRITEBACK_SIZE,
+                 discard=False, progress_callback=None, **kwargs):
+        super(RawWriter, self).__init__(source, device, buffer_size=block_size,
+                                        progress_callback=progress_callback, **kwargs)
+        self.writeback_size = max(self.buffer_size, writeback_size)
+        self.discard = discard
+        self.discarded = False
+        self.zeroes = ZEROES_WRITE
+        self.skipped = 0
+        # {length: chunk digest of length zero bytes}
+        self._zero_digests = {}
+        self._window_start = 0
+        self._prev_window = None
+
+    def _open_target(self):
+        try:
+            fd = os.open(self.target, os.O_WRONLY)
+        except OSError as e:
+            raise CopyError("Unable to open %s: %s" % (self.target, e), EXIT_TARGET_NOT_FOUND)
+        self._window_start = 0
+        self._prev_window = None
+        self.skipped = 0
+        self.discarded = self.discard and discard_device(fd, self.total)
+        self.zeroes = zeroes_mode(fd) if self.discarded else ZEROES_WRITE
+        return open(fd, 'wb', buffering=0)
+
+    def _is_zero(self, length, digest):
+        # Compare the chunk digest of the manifest: no compare of the data
+        zero_digest = self._zero_digests.get(length)
+        if zero_digest is None:
+            zero_digest = self._zero_digests[length] = chunk_digest(bytes(length))
+        return digest == zero_digest
+
+    def _write(self, dst, offset, data, digest):
+        end = offset + len(data)
+        if self.zeroes and self._is_zero(len(data), digest) and \
+           (self.zeroes == ZEROES_SKIP or zero_out(dst.fileno(), offset, len(data))):
+            # Discarded blocks read back as zeros or the device zeroed the range
+            self.skipped += len(data)
+        else:
+            while data:
+                n = os.pwrite(dst.fileno(), data, offset)
+                data = data[n:]
+                offset += n
+        if end - self._window_start >= self.writeback_size:
+            self._writeback(dst.fileno(), end)
+
+    def _writeback(self, fd, end):
+        # Start writeback of this window and wait for the previous window
+        start = self._window_start
+        if sync_range(fd, start, end - start, SYNC_FILE_RANGE_WRITE):
+            if self._prev_window is not None:
+                prev_start, prev_end = self._prev_window
+                sync_range(fd, prev_start, prev_end - prev_start,
+                           SYNC_FILE_RANGE_WAIT_BEFORE | SYNC_FILE_RANGE_WRITE | SYNC_FILE_RANGE_WAIT_AFTER)
+                os.posix_fadvise(fd, prev_start, prev_end - prev_start, os.POSIX_FADV_DONTNEED)
+        else:
+            os.fdatasync(fd)
+            drop_cache(fd)
+        self._prev_window = (start, end)
+        self._window_start = end
+
+    def _flush(self, dst):
+        os.fsync(dst.fileno())
+        drop_cache(dst.fileno())
+
+
+def write_images(source, devices, log=print, emitter=None, block_size=BLOCK_SIZE,
+                 discard=False, verify=False, source_name=None, expected=None):
+    """ Write an ISO to one or more devices (the ISO is read once).
+        source_name and expected: see CopyEngine and copy_targets.
+        Returns {device: exit code of scripts/usb-creator}.
+    """
+    writers = [RawWriter(source, device, block_size=block_size, discard=discard, source_name=source_name)
+               for device in devices]
+    results = copy_targets(writers, log, emitter, verify=verify, copy_phase='dd', expected=expected)
+    for writer in writers:
+        if writer.discarded and writer.zeroes:
+            log("Discarded %s, %d zero bytes not written (%s)" % (writer.target, writer.skipped, writer.zeroes))
+        elif writer.discarded:
+            log("Discarded %s (zero blocks were written: the device does not read back zeros)" % writer.target)
+    return results
+
+
+def write_image(source, device, log=print, emitter=None, block_size=BLOCK_SIZE,
+                discard=False, verify=False):
+    """ Write an ISO to a device. Returns an exit code of scripts/usb-creator. """
+    return write_images(source, [device], log, emitter, block_size, discard, verify)[device]
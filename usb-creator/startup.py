@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+# Startup timing of the GUI (usb-creator --startup-profile).
+# Phases are marked in order; the report shows the time of each phase
+# and the time since the start of main().
+
+import sys
+import time
+
+
+class StartupProfile(object):
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.start = time.perf_counter()
+        self._last = self.start
+        self.phases = []
+
+    def mark(self, phase):
+        """ End a phase. """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last, now - self.start))
+        self._last = now
+
+    def report(self, out=None):
+        if not self.enabled:
+            return
+        out = out or sys.stderr
+        print("Startup profile (ms):", file=out)
+        for phase, duration, total in self.phases:
+            print("  %-20s %8.1f %8.1f" % (phase, duration * 1000, total * 1000), file=out)
+        out.flush()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+# Menu entry templates (data/files/loopback-template, grub-template and
+# data/files/distributions/FAMILY/NAME) with [PLACEHOLDER] fields.
+# A template is split once into literal text and fields; rendering is a
+# single join instead of one sed call per placeholder. Values that end up
+# inside quotes in grub.cfg are escaped for those quotes.
+#
+# Placeholders: MENUTITLE, CLASS, ISONAME, ISOLABEL, LOOPBACK, VMLINUZ, INITRD, OPTIONS
+
+import re
+import sys
+import time
+from os.path import join, exists
+
+FILES_DIR = '/usr/share/usb-creator'
+PLACEHOLDER = re.compile(r'\[([A-Z]+)\]')
+# Loopback configuration used when no template matches
+DEFAULT_LOOPBACK = '/boot/grub/grub.cfg'
+
+
+def _escape_single(value):
+    # 'It's' -> 'It'\''s'
+    return value.replace("'", "'\\''")
+
+
+def _escape_double(value):
+    return re.sub(r'([\\"$])', r'\\\1', value)
+
+
+def _quote_state(text):
+    """ Return the quote that is open at the end of a grub.cfg line (or None). """
+    quote = None
+    escaped = False
+    for char in text:
+        if escaped:
+            escaped = False
+        elif char == '\\' and quote != "'":
+            escaped = True
+        elif quote is None and char in "'\"":
+            quote = char
+        elif char == quote:
+            quote = None
+    return quote
+
+
+class Template(object):
+
+    def __init__(self, text):
+        self.text = text
+        # [(literal, field name or None, escape function or None), ...]
+        self.parts = []
+        pos = 0
+        for match in PLACEHOLDER.finditer(text):
+            literal = text[pos:match.start()]
+            line = text[text.rfind('\n', 0, match.start()) + 1:match.start()]
+            quote = _quote_state(line)
+            escape = _escape_single if quote == "'" else _escape_double if quote == '"' else None
+            self.parts.append((literal, match.group(1), escape))
+            pos = match.end()
+        self.parts.append((text[pos:], None, None))
+        self.fields = set(p[1] for p in self.parts if p[1])
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(f.read())
+
+    def render(self, values):
+        """ Fill in the fields (missing values are empty). """
+        out = []
+        for literal, field, escape in self.parts:
+            out.append(literal)
+            if field:
+                value = str(values.get(field, ''))
+                out.append(escape(value) if escape else value)
+        return ''.join(out)
+
+    def render_many(self, values_list):
+        return [self.render(values) for values in values_list]
+
+
+class TemplateStore(object):
+    """ Compiled templates of a files directory (each file is read once). """
+
+    def __init__(self, files_dir=FILES_DIR):
+        self.files_dir = files_dir
+        self._templates = {}
+
+    def get(self, path):
+        template = self._templates.get(path)
+        if template is None:
+            template = Template.load(path)
+            self._templates[path] = template
+        return template
+
+    def menuentry_path(self, family, name, live=False):
+        """ Return (template path, True if it is the loopback fallback). """
+        distributions = join(self.files_dir, 'distributions')
+        path = join(distributions, family, name)
+        if family and name and exists(path):
+            return path, False
+        if family:
+            # Use the family jewels
+            candidates = ['generic-live', 'generic'] if live else ['generic']
+            for candidate in candidates:
+                path = join(distributions, family, candidate)
+                if exists(path):
+                    return path, False
+        # We shouldn't get here and this probably won't work :(
+        return join(self.files_dir, 'loopback-template'), True
+
+    def render_menuentry(self, values, family='', name='', loopback=False):
+        """ Render the menu entry of an ISO.
+            loopback: the ISO has a loopback.cfg (values['LOOPBACK'])
+        """
+        if loopback:
+            path, fallback = join(self.files_dir, 'loopback-template'), False
+        else:
+            live = any('live' in values.get(k, '').lower() for k in ('ISO', 'VMLINUZ', 'ISOLABEL'))
+            path, fallback = self.menuentry_path(family, name, live)
+        if fallback:
+            values = dict(values, LOOPBACK=DEFAULT_LOOPBACK)
+        return self.get(path).render(values)
+
+
+_store = None
+
+
+def get_store(files_dir=FILES_DIR):
+    global _store
+    if _store is None or _store.files_dir != files_dir:
+        _store = TemplateStore(files_dir)
+    return _store
+
+
+def benchmark(files_dir=FILES_DIR, count=1000):
+    """ Render count menu entries per template. Returns {template path: seconds}. """
+    import glob
+    store = TemplateStore(files_dir)
+    paths = [join(files_dir, 'loopback-template'), join(files_dir, 'grub-template')]
+    paths += sorted(p for p in glob.glob(join(files_dir, 'distributions', '*', '*')))
+    values_list = [{'MENUTITLE': "Distro %d 64-bit" % i, 'CLASS': 'linux', 'ISONAME': 'distro-%d.iso' % i,
+                    'ISOLABEL': 'DISTRO_%d' % i, 'LOOPBACK': '/boot/grub/loopback.cfg',
+                    'VMLINUZ': '/live/vmlinuz', 'INITRD': '/live/initrd.img',
+                    'OPTIONS': 'boot=live quiet splash'} for i in range(count)]
+    result = {}
+    for path in paths:
+        try:
+            template = store.get(path)
+        except (OSError, UnicodeDecodeError):
+            # families file and the like
+            continue
+        start = time.perf_counter()
+        template.render_many(values_list)
+        result[path] = time.perf_counter() - start
+    return result
+
+
+# ===============================================
+# Command line usage (debugging, not used by usb-creator itself)
+# ===============================================
+
+def usage():
+    print("Usage: templates menuentry [--files-dir=DIR] [--loopback] FAMILY NAME KEY=VALUE [KEY=VALUE ...]\n"
+          "       templates benchmark [--files-dir=DIR] [COUNT]")
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    options = dict(a[2:].split('=', 1) if '=' in a else (a[2:], '') for a in args if a.startswith('--'))
+    args = [a for a in args if not a.startswith('--')]
+    files_dir = options.get('files-dir', FILES_DIR)
+    if args and args[0] == 'benchmark':
+        count = int(args[1]) if len(args) > 1 else 1000
+        timings = benchmark(files_dir, count)
+        for path, seconds in timings.items():
+            print("%8.2f ms  %s" % (seconds * 1000, path))
+        total = sum(timings.values())
+        print("%8.2f ms  %d templates x %d entries" % (total * 1000, len(timings), count))
+        return 0
+    if len(args) < 3 or args[0] != 'menuentry':
+        usage()
+        return 1
+    values = dict(a.split('=', 1) for a in args[3:] if '=' in a)
+    print(get_store(files_dir).render_menuentry(values, args[1], args[2], 'loopback' in options))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
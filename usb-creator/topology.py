@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# Block device topology from sysfs (/sys/class/block).
+# Disks and partitions are indexed by name, device path and device number
+# (major, minor), so the disk of a partition is a dictionary lookup and
+# partition names like nvme0n1p1 and mmcblk0p1 are handled without
+# guessing from the device name.
+#
+# A disk is detachable when sysfs marks it removable or when it is
+# connected with USB or FireWire (NVMe and SATA disks in USB enclosures
+# are not marked removable): the rule of the UDisks Drive.Removable and
+# Drive.ConnectionBus properties the GUI lists devices with.
+
+import os
+import sys
+from os.path import join, exists, basename, dirname, realpath
+
+SYS_CLASS_BLOCK = '/sys/class/block'
+SECTOR_SIZE = 512
+# Drive.ConnectionBus of UDisks of drives that can be detached
+DETACHABLE_BUSES = ('usb', 'ieee1394')
+# Subsystems of sysfs parents: ConnectionBus
+BUS_SUBSYSTEMS = {'usb': 'usb', 'firewire': 'ieee1394', 'mmc': 'sdio'}
+
+
+def _read_sysfs(path, default=''):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def connection_bus(sys_path):
+    """ Return the bus a disk is connected with (usb, ieee1394, sdio or ''),
+        from the subsystems of its parents in sysfs.
+    """
+    path = dirname(sys_path)
+    while path.startswith('/sys/devices/'):
+        try:
+            subsystem = basename(os.readlink(join(path, 'subsystem')))
+        except OSError:
+            subsystem = ''
+        if subsystem in BUS_SUBSYSTEMS:
+            return BUS_SUBSYSTEMS[subsystem]
+        path = dirname(path)
+    return ''
+
+
+class BlockDevice(object):
+
+    def __init__(self, name, sys_path):
+        self.name = name
+        self.path = join('/dev', name)
+        self.sys_path = sys_path
+        major, _, minor = _read_sysfs(join(sys_path, 'dev'), '0:0').partition(':')
+        self.devnum = (int(major), int(minor or 0))
+        self.size = int(_read_sysfs(join(sys_path, 'size'), '0')) * SECTOR_SIZE
+        partition = _read_sysfs(join(sys_path, 'partition'))
+        self.partition_number = int(partition) if partition else 0
+        # Disk of a partition: the parent directory in sysfs
+        self.parent = basename(dirname(sys_path)) if self.partition_number else None
+        self.connection_bus = '' if self.partition_number else connection_bus(sys_path)
+        self.removable = _read_sysfs(join(sys_path, 'removable')) == '1' \
+                         or self.connection_bus in DETACHABLE_BUSES
+        self.children = []
+
+    @property
+    def is_partition(self):
+        return self.parent is not None
+
+    def __repr__(self):
+        return "BlockDevice(%s, %d:%d)" % (self.path, self.devnum[0], self.devnum[1])
+
+
+class BlockTopology(object):
+
+    def __init__(self, sys_class_block=SYS_CLASS_BLOCK):
+        self.sys_class_block = sys_class_block
+        self.by_name = {}
+        self.by_devnum = {}
+        self.refresh()
+
+    def refresh(self):
+        """ Read the block devices from sysfs. """
+        by_name = {}
+        try:
+            names = os.listdir(self.sys_class_block)
+        except OSError:
+            names = []
+        for name in names:
+            by_name[name] = BlockDevice(name, realpath(join(self.sys_class_block, name)))
+        for device in by_name.values():
+            if device.is_partition and device.parent in by_name:
+                disk = by_name[device.parent]
+                disk.children.append(device)
+                # The removable flag and the bus are only known for the disk
+                device.removable = disk.removable
+                device.connection_bus = disk.connection_bus
+        for device in by_name.values():
+            device.children.sort(key=lambda d: d.partition_number)
+        self.by_name = by_name
+        self.by_devnum = dict((d.devnum, d) for d in by_name.values())
+
+    def get(self, device):
+        """ Return the BlockDevice of a device path, name or (major, minor) or None.
+            The topology is read again once for devices that were added later.
+        """
+        for retry in (False, True):
+            if retry:
+                self.refresh()
+            if isinstance(device, tuple):
+                found = self.by_devnum.get(device)
+            else:
+                found = self.by_name.get(basename(device))
+                if found is None and exists(device):
+                    # Symlinks like /dev/disk/by-id/...
+                    try:
+                        rdev = os.stat(device).st_rdev
+                        found = self.by_devnum.get((os.major(rdev), os.minor(rdev)))
+                    except OSError:
+                        pass
+            if found is not None:
+                return found
+        return None
+
+    def disk(self, device):
+        """ Return the disk of a partition (or the disk itself). """
+        found = self.get(device)
+        if found is not None and found.is_partition:
+            return self.by_name.get(found.parent)
+        return found
+
+    def disk_path(self, device):
+        found = self.disk(device)
+        return found.path if found is not None else device
+
+    def partitions(self, device):
+        found = self.get(device)
+        return list(found.children) if found is not None else []
+
+    def partition(self, device, number):
+        """ Return the path of partition number of a disk. """
+        for child in self.partitions(device):
+            if child.partition_number == number:
+                return child.path
+        # Not known yet: nvme0n1 -> nvme0n1p1, sdb -> sdb1
+        path = realpath(device)
+        return "%s%s%d" % (path, 'p' if path[-1].isdigit() else '', number)
+
+    def is_removable(self, device):
+        found = self.get(device)
+        return found is not None and found.removable
+
+
+_topology = None
+
+
+def get_topology():
+    global _topology
+    if _topology is None:
+        _topology = BlockTopology()
+    return _topology
+
+
+# ===============================================
+# Command line usage (debugging, not used by usb-creator itself)
+# ===============================================
+
+def usage():
+    print("Usage: topology disk DEVICE\n"
+          "       topology partitions DEVICE\n"
+          "       topology partition DEVICE NUMBER\n"
+          "       topology removable DEVICE")
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) < 2:
+        usage()
+        return 1
+    topology = get_topology()
+    command, device = args[0], args[1]
+    if command == 'disk':
+        print(topology.disk_path(device))
+    elif command == 'partitions':
+        for child in topology.partitions(device):
+            print(child.path)
+    elif command == 'partition' and len(args) == 3:
+        print(topology.partition(device, int(args[2])))
+    elif command == 'removable':
+        return 0 if topology.is_removable(device) else 1
+    else:
+        usage()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,6 +5,9 @@ import gi
 gi.require_version('Gtk', '3.0')
 
 import os
+import sys
+import time
+from collections import OrderedDict
 from gi.repository import Gtk, GObject, GdkPixbuf
 
 # Treeview needs subclassing of gobject
@@ -15,6 +18,42 @@ from gi.repository import Gtk, GObject, GdkPixbuf
 #self.myTreeView = TreeViewHandler(self.myTreeView, self.myLogObject)
 #self.myTreeView.connect('checkbox-toggled', self.myCallback)
 
+COLUMN_TYPES = {'str': str, 'bool': bool, 'int': int, 'float': float,
+                'GdkPixbuf.Pixbuf': GdkPixbuf.Pixbuf}
+PIXBUF_CACHE_SIZE = 128
+
+
+class PixbufCache(object):
+    """ Bounded cache of loaded (and scaled) images keyed by (path, height). """
+
+    def __init__(self, max_size=PIXBUF_CACHE_SIZE):
+        self.max_size = max_size
+        self._pixbufs = OrderedDict()
+
+    def get(self, path, height=None):
+        key = (path, height)
+        pb = self._pixbufs.get(key)
+        if pb is not None:
+            self._pixbufs.move_to_end(key)
+            return pb
+        if not os.path.isfile(path):
+            return None
+        pb = GdkPixbuf.Pixbuf.new_from_file(path)
+        if height:
+            width = int(pb.get_width() * (height / pb.get_height()))
+            pb = pb.scale_simple(width, height, GdkPixbuf.InterpType.BILINEAR)
+        self._pixbufs[key] = pb
+        if len(self._pixbufs) > self.max_size:
+            self._pixbufs.popitem(last=False)
+        return pb
+
+    def clear(self):
+        self._pixbufs.clear()
+
+
+pixbuf_cache = PixbufCache()
+
+
 class TreeViewHandler(GObject.GObject):
 
     __gsignals__ = {
@@ -37,10 +76,12 @@ class TreeViewHandler(GObject.GObject):
 
     # General function to fill a treeview
     # Set setCursorWeight to 400 if you don't want bold font
+    # The model is detached from the treeview while the rows are added
     def fillTreeview(self, contentList, columnTypesList, setCursor=0, setCursorWeight=400, firstItemIsColName=False, appendToExisting=False, appendToTop=False, fontSize=10000, fixedImgHeight=None):
         # Check if this is a multi-dimensional array
         multiCols = self.isListOfLists(contentList)
         colNameList = []
+        colTypes = [self.getColumnType(t) for t in columnTypesList]
 
         if len(contentList) == 0 or (len(self.treeview.get_columns()) !=  len(columnTypesList)):
             # Empty treeview
@@ -48,165 +89,89 @@ class TreeViewHandler(GObject.GObject):
 
         liststore = self.treeview.get_model()
         if liststore is None or not appendToExisting:
-            # Dirty but need to dynamically create a list store
             for col in self.treeview.get_columns():
                 self.treeview.remove_column(col)
-            dynListStore = 'Gtk.ListStore('
-            for i in range(len(columnTypesList)):
-                dynListStore += str(columnTypesList[i]) + ', '
-            dynListStore += 'int, int)'
-            msg = "Create list store eval string: %(eval)s" % { "eval": dynListStore }
-            if self.debug: print(msg)
-            if self.log: self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-            liststore = eval(dynListStore)
+            # Two extra columns: weight and font size
+            liststore = Gtk.ListStore(*(colTypes + [int, int]))
+            if self.debug: print("Create list store: %s" % str(columnTypesList))
 
         # Create list with column names
         if not appendToExisting:
             if multiCols:
-                #for i in range(len(contentList[0])):
                 for i in range(len(columnTypesList)):
                     if firstItemIsColName and len(contentList) > 0:
-                        msg = "First item is column name (multi-column list): %(iscolname)s" % { "iscolname": contentList[0][i] }
-                        if self.debug: print(msg)
-                        if self.log: self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
                         colNameList.append(contentList[0][i])
                     else:
                         colNameList.append('Column ' + str(i))
             else:
                 if firstItemIsColName and len(contentList) > 0:
-                    msg = "First item is column name (single-column list): %(iscolname)s" % { "iscolname": contentList[0] }
-                    if self.debug: print(msg)
-                    if self.log: self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
                     colNameList.append(contentList[0])
                 else:
                     colNameList.append('Column 0')
+            if self.debug: print("Create column names: %s" % str(colNameList))
 
-            msg = "Create column names: %(cols)s" % { "cols": str(colNameList) }
-            if self.debug: print(msg)
-            if self.log: self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-
-        # Add data to the list store
+        # Convert the rows to the column types
+        rows = []
+        weightRow = setCursor + 1 if firstItemIsColName else setCursor
         for i in range(len(contentList)):
             # Skip first row if that is a column name
-            skip = False
             if firstItemIsColName and i == 0:
-                msg = "First item is column name: skip first item"
-                if self.debug: print(msg)
-                if self.log: self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                skip = True
-
-            if not skip:
-                weight = 400
-                weightRow = setCursor
-                if firstItemIsColName:
-                    weightRow += 1
-                if i == weightRow:
-                    weight = setCursorWeight
-                if multiCols:
-                    # Dynamically add data for multi-column list store
-                    if appendToTop:
-                        dynListStoreAppend = 'liststore.insert(0, ['
-                    else:
-                        dynListStoreAppend = 'liststore.append(['
-                    for j in range(len(contentList[i])):
-                        val = str(contentList[i][j]).strip()
-                        if str(columnTypesList[j]) == 'str':
-                            # Make sure it's a single line
-                            val = '"' + val.replace('\n', ' ').replace('\r', '').replace('"', '\\"') + '"'
-                        if str(columnTypesList[j]) == 'GdkPixbuf.Pixbuf':
-                            if os.path.isfile(val):
-                                if fixedImgHeight:
-                                    pb = GdkPixbuf.Pixbuf.new_from_file(val)
-                                    nw = pb.get_width() * (fixedImgHeight / pb.get_height())
-                                    val = 'GdkPixbuf.Pixbuf.new_from_file("%(val)s").scale_simple(%(width)s, %(height)s, GdkPixbuf.InterpType.BILINEAR)' % { "val": val, "width": nw, "height": fixedImgHeight }
-                                else:
-                                    val = 'GdkPixbuf.Pixbuf.new_from_file("%(val)s")' % { "val": val }
-                            else:
-                                val = None
-                        dynListStoreAppend += '%s, ' % val
-                    dynListStoreAppend += '%s, %s])' % (str(weight), fontSize)
-
-                    msg = "Add data to list store: %(data)s" % { "data": dynListStoreAppend }
-                    if self.debug: print(msg)
-                    if self.log: self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                    eval(dynListStoreAppend)
-                else:
-                    if appendToTop:
-                        msg = "Add data to top of list store: %(totop)s" % { "totop": str(contentList[i]) }
-                        if self.debug: print(msg)
-                        if self.log: self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                        liststore.insert(0, [contentList[i], weight, fontSize])
-                    else:
-                        msg = "Add data to bottom of list store: %(tobottom)s" % { "tobottom": str(contentList[i]) }
-                        if self.debug: print(msg)
-                        if self.log: self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                        liststore.append([contentList[i], weight, fontSize])
+                continue
+            weight = setCursorWeight if i == weightRow else 400
+            if multiCols:
+                row = [self.convertValue(contentList[i][j], columnTypesList[j], fixedImgHeight)
+                       for j in range(len(contentList[i]))]
+            else:
+                row = [contentList[i]]
+            rows.append(row + [weight, fontSize])
+
+        # Detach the model: the treeview is not updated for every row
+        self.treeview.set_model(None)
+        for row in rows:
+            if appendToTop:
+                liststore.insert(0, row)
+            else:
+                liststore.append(row)
+        if self.log:
+            self.log.write("Added %d rows to list store" % len(rows), 'self.treeview.fillTreeview', 'debug')
 
         # Create columns
         if not appendToExisting:
+            existing = [col.get_title() for col in self.treeview.get_columns()]
+            weightCol = len(colNameList)
             for i in range(len(colNameList)):
                 # Create a column only if it does not exist
-                colFound = ''
-                cols = self.treeview.get_columns()
-                for col in cols:
-                    if col.get_title() == colNameList[i]:
-                        colFound = col.get_title()
-                        break
-
-                if colFound == '':
-                    # Build renderer and attributes to define the column
-                    # Possible attributes for text: text, foreground, background, weight
-                    attr = ', text=' + str(i) + ', weight=' + str(len(colNameList)) + ', size=' + str(len(colNameList) + 1)
-                    renderer = 'Gtk.CellRendererText()'  # an object that renders text into a Gtk.TreeView cell
-                    if str(columnTypesList[i]) == 'bool':
-                        renderer = 'Gtk.CellRendererToggle()'  # an object that renders a toggle button into a TreeView cell
-                        attr = ', active=' + str(i)
-                    if str(columnTypesList[i]) == 'GdkPixbuf.Pixbuf':
-                        renderer = 'Gtk.CellRendererPixbuf()'  # an object that renders a pixbuf into a Gtk.TreeView cell
-                        attr = ', pixbuf=' + str(i)
-                    dynCol = 'Gtk.TreeViewColumn("' + str(colNameList[i]) + '", ' + renderer + attr + ')'
-
-                    msg = "Create column: %(col)s" % { "col": dynCol }
-                    if self.debug: print(msg)
-                    if self.log: self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                    col = eval(dynCol)
-
-                    # Get the renderer of the column and add type specific properties
-                    rend = col.get_cells()[0]
-                    #if str(columnTypesList[i]) == 'str':
-                        # TODO: Right align text in column - add parameter to function
-                        #rend.set_property('xalign', 1.0)
-                    if str(columnTypesList[i]) == 'bool':
-                        # If checkbox column, add toggle function
-                        msg = "Check box found: add toggle function"
-                        if self.debug: print(msg)
-                        if self.log: self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                        rend.connect('toggled', self.tvchk_on_toggle, liststore, i)
-
-                    # Let the last colum fill the treeview
-                    if i == len(colNameList):
-                        msg = "Last column fills treeview: %(colnr)d" % { "colnr": i }
-                        if self.debug: print(msg)
-                        if self.log: self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                        col.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
-
-                    # Finally add the column
-                    self.treeview.append_column(col)
-                    msg = "Column added: %(col)s" % { "col": col.get_title() }
-                    if self.debug: print(msg)
-                    if self.log: self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
+                if str(colNameList[i]) in existing:
+                    if self.debug: print("Column already exists: %s" % colNameList[i])
+                    continue
+                # Possible attributes for text: text, foreground, background, weight
+                colType = str(columnTypesList[i])
+                if colType == 'bool':
+                    renderer = Gtk.CellRendererToggle()
+                    col = Gtk.TreeViewColumn(str(colNameList[i]), renderer, active=i)
+                    # If checkbox column, add toggle function
+                    renderer.connect('toggled', self.tvchk_on_toggle, liststore, i)
+                elif colType == 'GdkPixbuf.Pixbuf':
+                    renderer = Gtk.CellRendererPixbuf()
+                    col = Gtk.TreeViewColumn(str(colNameList[i]), renderer, pixbuf=i)
                 else:
-                    msg = "Column already exists: %(col)s" % { "col": colFound }
-                    if self.debug: print(msg)
-                    if self.log: self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
+                    renderer = Gtk.CellRendererText()
+                    col = Gtk.TreeViewColumn(str(colNameList[i]), renderer, text=i,
+                                             weight=weightCol, size=weightCol + 1)
+
+                # Let the last colum fill the treeview
+                if i == len(colNameList):
+                    col.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+
+                # Finally add the column
+                self.treeview.append_column(col)
+                if self.debug: print("Column added: %s" % col.get_title())
 
         # Add liststore, set cursor and set the headers
         self.treeview.set_model(liststore)
         if setCursor >= 0:
             self.treeview.set_cursor(setCursor)
         self.treeview.set_headers_visible(firstItemIsColName)
-        if self.log:
-            self.log.write("Add Liststore to Treeview", 'self.treeview.fillTreeview', 'debug')
 
         # Scroll to selected cursor
         selection = self.treeview.get_selection()
@@ -214,9 +179,29 @@ class TreeViewHandler(GObject.GObject):
         if treeIter:
             path = tm.get_path(treeIter)
             self.treeview.scroll_to_cell(path)
-            msg = "Scrolled to selected row: %(row)d" % { "row": setCursor }
-            if self.debug: print(msg)
-            if self.log: self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
+            if self.debug: print("Scrolled to selected row: %d" % setCursor)
+
+    # Return the type of a column type name ('str', 'bool', 'int', 'GdkPixbuf.Pixbuf')
+    def getColumnType(self, colType):
+        if not isinstance(colType, str):
+            return colType
+        return COLUMN_TYPES.get(colType, str)
+
+    # Convert a value to the column type
+    def convertValue(self, value, colType, fixedImgHeight=None):
+        colType = str(colType)
+        if colType == 'str':
+            # Make sure it's a single line
+            return str(value).strip().replace('\n', ' ').replace('\r', '')
+        if colType == 'GdkPixbuf.Pixbuf':
+            if isinstance(value, GdkPixbuf.Pixbuf):
+                return value
+            return pixbuf_cache.get(str(value).strip(), fixedImgHeight)
+        if colType == 'bool':
+            return bool(value) and str(value) != 'False'
+        if colType == 'int':
+            return int(value)
+        return value
 
     def tvchk_on_toggle(self, cell, path, liststore, colNr, *ignore):
         if path is not None:
@@ -307,6 +292,14 @@ class TreeViewHandler(GObject.GObject):
             it = model.get_iter(rowNr)
             model.remove(it)
 
+    # Replace the image in a row (e.g. when it was looked up in the background)
+    def setImage(self, rowNr, colNr, imagePath, fixedImgHeight=None):
+        model = self.treeview.get_model()
+        pb = pixbuf_cache.get(imagePath, fixedImgHeight)
+        if model is None or pb is None:
+            return
+        model[model.get_iter(rowNr)][colNr] = pb
+
     def addRow(self, rowList):
         model = self.treeview.get_model()
         model.append(rowList)
@@ -358,6 +351,28 @@ class TreeViewHandler(GObject.GObject):
 GObject.type_register(TreeViewHandler)
 
 
+def benchmark(rows=1000, image=None):
+    """ Fill a treeview with rows like the ISO list. Returns seconds. """
+    treeview = Gtk.TreeView()
+    handler = TreeViewHandler(treeview)
+    column_types = ['bool', 'GdkPixbuf.Pixbuf', 'str', 'str']
+    content = [[False, image or '', "distro-%d.iso" % i, "%d MB" % i] for i in range(rows)]
+    start = time.perf_counter()
+    handler.fillTreeview(contentList=content, columnTypesList=column_types)
+    return time.perf_counter() - start
+
+
+# Needs a display, headless with Xvfb:
+# xvfb-run python3 -c "import importlib; importlib.import_module('usb-creator.treeview').main()" [ROWS] [IMAGE]
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    rows = int(args[0]) if args else 1000
+    image = args[1] if len(args) > 1 else None
+    print("Filled %d rows in %.1f ms" % (rows, benchmark(rows, image) * 1000))
+    return 0
+
+
 # TODO - implement clickable image in TreeViewHandler
 # http://www.daa.com.au/pipermail/pygtk/2010-March/018355.html
 #class CellRendererPixbufXt(Gtk.CellRendererPixbuf):
@@ -10,6 +10,9 @@ from os.path import exists
 import os
 import time
 
+from .fsinfo import get_space
+from .topology import get_topology, DETACHABLE_BUSES
+
 
 # Subclass dict class to overwrite the __missing__() method
 # to implement autovivificious dictionaries:
@@ -20,6 +23,14 @@ class Tree(dict):
         return value
 
 
+# Milliseconds to collect device changes before the callbacks are called
+CHANGED_DELAY = 250
+WATCHED_INTERFACES = ('org.freedesktop.UDisks2.Block',
+                      'org.freedesktop.UDisks2.Filesystem',
+                      'org.freedesktop.UDisks2.Partition',
+                      'org.freedesktop.UDisks2.Drive')
+
+
 class Udisks2():
     def __init__(self, flash_only=True, debug=False):
         super(Udisks2, self).__init__()
@@ -27,127 +38,236 @@ class Udisks2():
         self.debug = debug
         self.flash_only = flash_only
         self.devices = Tree()
+        # One client for the lifetime of the application
+        self.client = None
+        self.manager = None
+        # UDisks object path: (drive path, device path)
+        self._objects = {}
+        # The device tree needs to be built (again): a change could not be applied to it
+        self.dirty = True
+        self._callbacks = []
+        self._changed_drives = set()
+        self._changed_id = None
+
+    def get_manager(self):
+        if self.client is None:
+            self.client = UDisks.Client.new_sync(None)
+            self.manager = self.client.get_object_manager()
+        return self.manager
 
     # Create multi-dimensional dictionary with drive/device/deviceinfo
     def fill_devices(self):
-
+        """ Build the device tree. While the UDisks signals keep the tree up to
+            date (watch), it is only built again when a change marked it dirty.
+            Returns True if the tree was built.
+        """
+        if self._callbacks and not self.dirty:
+            return False
         self.devices.clear()
+        self._objects.clear()
+        for o in self.get_manager().get_objects():
+            self._add_object(o)
+        self.dirty = False
+        return True
+
+    def watch(self, callback):
+        """ Keep the device tree up to date with UDisks signals and call
+            callback(drive_paths) with the drives that were added, removed or changed.
+        """
+        manager = self.get_manager()
+        if not self._callbacks:
+            manager.connect('object-added', self._on_object_added)
+            manager.connect('object-removed', self._on_object_removed)
+            manager.connect('interface-added', self._on_interface_changed)
+            manager.connect('interface-removed', self._on_interface_changed)
+            manager.connect('interface-proxy-properties-changed', self._on_properties_changed)
+        self._callbacks.append(callback)
+
+    def _changed(self, drive_path):
+        if drive_path is None:
+            return
+        self._changed_drives.add(drive_path)
+        if self._changed_id is None:
+            self._changed_id = GLib.timeout_add(CHANGED_DELAY, self._emit_changed)
+
+    def _emit_changed(self):
+        self._changed_id = None
+        drive_paths = self._changed_drives
+        self._changed_drives = set()
+        for callback in self._callbacks:
+            callback(drive_paths)
+        return False
+
+    def _mark_dirty(self):
+        # Build the tree again at the next fill_devices and tell the callbacks
+        self.dirty = True
+        if self._changed_id is None:
+            self._changed_id = GLib.timeout_add(CHANGED_DELAY, self._emit_changed)
+
+    def _update_object(self, manager, o):
+        """ Add, update or remove the device of an object. """
+        try:
+            drive_path = self._add_object(o)
+        except (GLib.Error, AttributeError):
+            # Properties of an object that is going away
+            self._mark_dirty()
+            return
+        if drive_path is None:
+            # No longer a device of interest
+            self._on_object_removed(manager, o)
+        else:
+            self._changed(drive_path)
+
+    def _update_drive(self, manager, drive_name):
+        # Block devices of a drive (drive properties changed or drive added after its block devices)
+        for obj in manager.get_objects():
+            block = obj.get_block()
+            if block is not None and block.get_cached_property('Drive').get_string() == drive_name:
+                self._update_object(manager, obj)
+
+    def _on_object_added(self, manager, o):
+        if o.get_block() is not None:
+            self._update_object(manager, o)
+        elif o.get_drive() is not None:
+            self._update_drive(manager, o.get_object_path())
+
+    def _on_interface_changed(self, manager, o, interface):
+        # An interface was added to or removed from an object (Filesystem after mkfs)
+        if o.get_block() is not None:
+            self._update_object(manager, o)
+        elif o.get_object_path() in self._objects:
+            self._on_object_removed(manager, o)
+
+    def _on_object_removed(self, manager, o):
+        paths = self._objects.pop(o.get_object_path(), None)
+        if paths is None:
+            return
+        drive_path, device_path = paths
+        if drive_path not in self.devices:
+            return
+        if device_path == drive_path:
+            del self.devices[drive_path]
+            for key in [k for k, v in self._objects.items() if v[0] == drive_path]:
+                del self._objects[key]
+        else:
+            self.devices[drive_path].pop(device_path, None)
+        self._changed(drive_path)
+
+    def _on_properties_changed(self, manager, object_proxy, interface_proxy, changed, invalidated):
+        if interface_proxy.get_interface_name() not in WATCHED_INTERFACES:
+            return
+        o = manager.get_object(object_proxy.get_object_path())
+        if o is None:
+            self._mark_dirty()
+        elif o.get_block() is not None:
+            self._update_object(manager, o)
+        elif o.get_drive() is not None:
+            self._update_drive(manager, o.get_object_path())
+
+    def _add_object(self, o):
+        """ Add or update the device of a UDisks object.
+            Returns the drive path or None if the object is not a device of interest.
+        """
+        block = None
+        partition = None
+        fs = None
+        drive = None
+        device_path = ''
+        fs_type = ''
+        drive_path = ''
+        add_device = False
+        removable = False
+        ejectable = False
+        connection_bus = ''
+        mount_point = ''
+        total_size = 0
+        free_size = 0
+
+        block = o.get_block()
+        if block is None:
+            return None
 
-        client = UDisks.Client.new_sync(None)
-        manager = client.get_object_manager()
-        objects = manager.get_objects()
-
-        for o in objects:
-            block = None
-            partition = None
-            fs = None
-            drive = None
-            device_path = ''
-            fs_type = ''
-            drive_path = ''
-            add_device = False
-            removable = False
-            ejectable = False
-            mount_point = ''
-            total_size = 0
-            free_size = 0
-
-            block = o.get_block()
-            if block is None:
-                continue
-
-            device_path = block.get_cached_property('Device').get_bytestring().decode('utf-8')
-            fs_type = block.get_cached_property('IdType').get_string()
-            drive_path = self.get_drive_from_device_path(device_path)
-            total_size = (block.get_cached_property('Size').get_uint64() / 1024)
-
-            if not exists(drive_path) or total_size == 0:
-                continue
-                
-            drive_name = block.get_cached_property('Drive').get_string()
-            drive_obj = manager.get_object(drive_name)
-            if drive_obj is None:
-                continue
-            drive = drive_obj.get_drive()
-            removable = drive.get_cached_property("Removable").get_boolean()
-            ejectable = drive.get_cached_property("Ejectable").get_boolean()
-
-            # Mount point
-            fs = o.get_filesystem()
-            if fs is not None:
-                mount_points = fs.get_cached_property('MountPoints').get_bytestring_array()
-                tmp_mount = False
-                if not mount_points:
-                    # Temporally mount fs
-                    if self.flash_only:
-                        if removable and ejectable:
-                            mount_point = self._mount_filesystem(fs)
-                    else:
-                        mount_point = self._mount_filesystem(fs)
-                    tmp_mount = True
-                else:
-                    mount_point = mount_points[0]
-                if exists(mount_point):
-                    total_size, free_size, used_size = self.get_mount_size(mount_point)
-                if tmp_mount:
-                    try:
-                        self._unmount_filesystem(fs)
-                    except:
-                        pass
-
-            # There are no partitions: set free size to total size
-            partition = o.get_partition()
-            if partition is None:
-                free_size = total_size
-
-            if self.flash_only:
-                # Check for flash/thumb drives
-                if removable and ejectable:
-                    add_device = True
-            else:
-                add_device = True
+        device_path = block.get_cached_property('Device').get_bytestring().decode('utf-8')
+        fs_type = block.get_cached_property('IdType').get_string()
+        total_size = (block.get_cached_property('Size').get_uint64() / 1024)
+        # Disk of the device from the sysfs topology (no file system check)
+        disk = get_topology().disk(device_path)
+        if disk is None or total_size == 0:
+            return None
+        drive_path = disk.path
 
-            if add_device:
-                if self.debug:
-                    print(('========== Device Info of: %s ==========' % device_path))
-                    print(('Drive name: %s' % drive_name))
-                    print(('FS Type: %s' % fs_type))
-                    print(('Mount point: %s' % mount_point))
-                    print(('Total size: %s' % total_size))
-                    print(('Free size: %s' % free_size))
-                    print(('Ejectable: %s' % ejectable))
-                    print(('Removable: %s' % str(removable)))
-                    print(('======================================='))
-
-                if device_path == drive_path:
-                    # Drive information
-                    self.devices[drive_path]['drive_object'] = drive
-                    self.devices[drive_path]['partition_object'] = partition
-                    self.devices[drive_path]['ejectable'] = ejectable
-                    self.devices[drive_path]['removable'] = removable
-                    self.devices[drive_path]['total_size'] = total_size
-                    self.devices[drive_path]['free_size'] = free_size
-                else:
-                    # Partition information
-                    self.devices[drive_path][device_path]['fs_object'] = fs
-                    self.devices[drive_path][device_path]['fs_type'] = fs_type
-                    self.devices[drive_path][device_path]['mount_point'] = mount_point
-                    self.devices[drive_path][device_path]['total_size'] = total_size
-                    self.devices[drive_path][device_path]['free_size'] = free_size
+        drive_name = block.get_cached_property('Drive').get_string()
+        drive_obj = self.manager.get_object(drive_name)
+        if drive_obj is None:
+            return None
+        drive = drive_obj.get_drive()
+        removable = drive.get_cached_property("Removable").get_boolean()
+        ejectable = drive.get_cached_property("Ejectable").get_boolean()
+        connection_bus = drive.get_cached_property("ConnectionBus").get_string()
+
+        # Mount point
+        # File systems are not mounted here: the free size is read when needed (get_free_size)
+        fs = o.get_filesystem()
+        if fs is not None:
+            mount_points = fs.get_cached_property('MountPoints').get_bytestring_array()
+            if mount_points:
+                mount_point = mount_points[0]
+            free_size = None
+
+        # There are no partitions: set free size to total size
+        partition = o.get_partition()
+        if partition is None:
+            free_size = total_size
+
+        if self.flash_only:
+            # Check for flash/thumb drives and disks in USB enclosures
+            # (the backend accepts the same drives, see topology.py)
+            if removable or connection_bus in DETACHABLE_BUSES:
+                add_device = True
+        else:
+            add_device = True
+
+        if add_device:
+            if self.debug:
+                print(('========== Device Info of: %s ==========' % device_path))
+                print(('Drive name: %s' % drive_name))
+                print(('FS Type: %s' % fs_type))
+                print(('Mount point: %s' % mount_point))
+                print(('Total size: %s' % total_size))
+                print(('Free size: %s' % free_size))
+                print(('Ejectable: %s' % ejectable))
+                print(('Removable: %s' % str(removable)))
+                print(('Connection bus: %s' % connection_bus))
+                print(('======================================='))
+
+            if device_path == drive_path:
+                # Drive information
+                self.devices[drive_path]['drive_object'] = drive
+                self.devices[drive_path]['partition_object'] = partition
+                self.devices[drive_path]['ejectable'] = ejectable
+                self.devices[drive_path]['removable'] = removable
+                self.devices[drive_path]['connection_bus'] = connection_bus
+                self.devices[drive_path]['total_size'] = total_size
+                self.devices[drive_path]['free_size'] = free_size
+            else:
+                # Partition information
+                self.devices[drive_path][device_path]['fs_object'] = fs
+                self.devices[drive_path][device_path]['fs_type'] = fs_type
+                self.devices[drive_path][device_path]['mount_point'] = mount_point
+                self.devices[drive_path][device_path]['total_size'] = total_size
+                self.devices[drive_path][device_path]['free_size'] = free_size
+            self._objects[o.get_object_path()] = (drive_path, device_path)
+            return drive_path
+        return None
 
     def get_drives(self):
-        drives = []
-        for d in self.devices:
-            if exists(d) and d not in drives:
-                drives.append(d)
-        return sorted(drives)
+        # The signals remove drives that are gone: no file system checks
+        # (skip empty nodes that were created by looking up a drive)
+        return sorted(d for d, info in self.devices.items() if info)
 
     def get_drive_device_paths(self, drive):
-        devices = []
-        for d in self.devices[drive]:
-            if exists(d) and d not in devices:
-                devices.append(d)
-        return sorted(devices)
+        # Partitions are the device path keys of the drive (the others are drive information)
+        return sorted(d for d in self.devices[drive] if d.startswith('/dev/'))
 
     # returns total/free/used tuple (Kb)
     def get_mount_size(self, mount_point):
@@ -161,8 +281,30 @@ class Udisks2():
         used = ((st.f_blocks - st.f_bfree) * st.f_frsize) / 1024
         return (total, free, used)
 
+    def get_free_size(self, device_path):
+        """ Return the free size (Kb) of a partition: from the mounted file system
+            or from the superblock of an unmounted ext, FAT or exFAT file system.
+            Returns None when it is unknown: the superblock can only be read by
+            root and the disk group, and the last known size is kept otherwise.
+        """
+        drive = self.get_drive_from_device_path(device_path)
+        if drive not in self.devices or device_path not in self.devices[drive]:
+            return None
+        info = self.devices[drive][device_path]
+        mount_point = info.get('mount_point', '')
+        if mount_point and exists(mount_point):
+            total, free, used = self.get_mount_size(mount_point)
+        else:
+            space = get_space(device_path, info.get('fs_type', ''))
+            if space is None:
+                return info.get('free_size')
+            free = space[1] / 1024
+        info['free_size'] = free
+        return free
+
     def get_drive_from_device_path(self, device_path):
-        return device_path.rstrip('0123456789')
+        # sysfs knows the disk of a partition (nvme0n1p1, mmcblk0p1)
+        return get_topology().disk_path(device_path)
 
     # Adapted from udisk's test harness.
     # This is why the entire backend needs to be its own thread.
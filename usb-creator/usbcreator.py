@@ -7,34 +7,48 @@ gi.require_version('Gtk', '3.0')
 
 # from gi.repository import Gtk, GdkPixbuf, GObject, Pango, Gdk, GLib
 from gi.repository import Gtk, GLib
-from os.path import join, abspath, dirname, basename, islink, \
+from os.path import join, abspath, dirname, basename, \
                     splitext, exists, expanduser, isdir, getsize
 import os
-import re
+import shlex
+import threading
+import subprocess
 from glob import glob
 from datetime import datetime
-from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
 
 # Local imports
-from .utils import ExecuteThreadedCommands, getoutput, \
-                              shell_exec, getPackageVersion, get_user_home, \
-                              get_fuzzy_ratio
+from .utils import shell_exec, get_version, get_user_home
 from .dialogs import MessageDialog, ErrorDialog, WarningDialog, \
                                    SelectFileDialog, QuestionDialog
 from .combobox import ComboBoxHandler
 from .treeview import TreeViewHandler
 from .logger import Logger
 from .udisks2 import Udisks2
+from .isocache import IsoCache
+from .backend import introspect_iso, read_iso_label
+from .isoscan import IsoDirScan, tree_size
+from .distros import DistroScorer
+from .logos import LogoResolver
+from .progress import ProgressReader, PROGRESS_FD_ENV
+from .helper import HelperClient
+from .startup import StartupProfile
 
 # i18n: http://docs.python.org/3/library/gettext.html
 import gettext
 _ = gettext.translation('usb-creator', fallback=True).gettext
 
+# Worker threads that read the labels of the ISOs on the device
+ISO_WORKERS = 4
+# Milliseconds without typing in the ISO field before a directory is scanned
+ISO_SCAN_DELAY = 300
+
 #class for the main window
 class USBCreator(object):
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, profile=None):
         self.debug = debug
+        self.profile = profile or StartupProfile(enabled=False)
 
         # Load window and widgets
         self.scriptName = basename(__file__)
@@ -42,6 +56,7 @@ class USBCreator(object):
         self.mediaDir = '/usr/share/usb-creator'
         self.builder = Gtk.Builder()
         self.builder.add_from_file(join(self.mediaDir, 'usb-creator.glade'))
+        self.profile.mark('builder')
 
         # Main window objects
         go = self.builder.get_object
@@ -94,16 +109,16 @@ class USBCreator(object):
         self.lblForceDistro.set_tooltip_text(_("Manually select the distribution name if {title} cannot\n"
                                                "determine the distribution name automatically.".format(title=self.title)))
 
-        # Log lines to show: check string, 0=pulse, 1=get percentage, show line (translatable)
+        # Status messages of the backend progress phases (translatable)
         copy_string = _("Copy ISO to USB...")
-        self.log_lines = []
-        self.log_lines.append(["copied:", 1, copy_string])
-        self.log_lines.append(["bytes (", 1, copy_string])
-        self.log_lines.append(["prepare copy", 0, _("Prepare copy of ISO...")])
-        self.log_lines.append(["verify hash", 0, _("Verify hash of ISO...")])
-        self.log_lines.append(["install grub", 0, _("Install Grub...")])
-        self.log_lines.append(["unpacking", 0, _("Unpacking ISO...")])
-        self.log_lines.append(["gather iso", 0, _("Gather ISO information...")])
+        self.phase_messages = {}
+        self.phase_messages['partition'] = _("Partition device")
+        self.phase_messages['gather'] = _("Gather ISO information...")
+        self.phase_messages['unpack'] = _("Unpacking ISO...")
+        self.phase_messages['copy'] = copy_string
+        self.phase_messages['dd'] = copy_string
+        self.phase_messages['verify'] = _("Verify hash of ISO...")
+        self.phase_messages['grub'] = _("Install Grub...")
 
         # Initiate variables
         self.device = {}
@@ -113,9 +128,12 @@ class USBCreator(object):
         self.device['available'] = 0
         self.device["new_iso"] = ''
         self.device["new_iso_required"] = 0
-        self.logos = self.get_logos()
-        self.queue = Queue(-1)
-        self.threads = {}
+        self.process = None
+        self.progress_fd = None
+        self.progress_watch = None
+        self.progress_reader = None
+        self.progress_phase = ''
+        self.progress_pulse = None
         self.htmlDir = join(self.mediaDir, "html")
         self.helpFile = join(self.get_language_dir(), "help.html")
         log_dir = join(get_user_home(), '.usb-creator')
@@ -123,24 +141,33 @@ class USBCreator(object):
             os.makedirs(log_dir)
         self.log_file = join(log_dir, 'usb-creator.log')
         self.log = Logger(self.log_file, addLogTime=False, maxSizeKB=0)
+        self.iso_cache = IsoCache(log_dir)
         self.tvUsbIsosHandler = TreeViewHandler(self.tvUsbIsos)
+        # Labels and logos of the ISOs on the device are looked up in the background
+        self.iso_pool = ThreadPoolExecutor(max_workers=ISO_WORKERS)
+        self.iso_list_generation = 0
+        # Introspection of the selected ISO (label, kernel, loopback.cfg, distribution)
+        self.iso_introspection = None
+        self.iso_introspection_cancel = threading.Event()
+        self.iso_introspection_path = ''
+        self.iso_info = None
+        # Debounced background scan of an ISO directory
+        self.iso_scan = None
+        self.iso_scan_timer = None
         self.udisks2 = Udisks2(debug=self.debug)
 
         self.lblAvailable.set_label('')
         self.lblRequired.set_label('')
         
         # Get distro names
-        distros = getoutput('usb-creator -D')
-        distros = sorted(distros[0].split())
+        self.distro_scorer = DistroScorer(join(self.mediaDir, 'distributions/families'))
+        distros = sorted(self.distro_scorer.get_distros())
+        self.logo_resolver = LogoResolver(join(self.mediaDir, 'grub/themes/usb-creator/icons'),
+                                          self.distro_scorer)
+        self.logos = self.logo_resolver.logos
         self.cmbDistrosHandler.fillComboBox(distros, 0)
         self.cmbDistros.set_sensitive(False)
-
-        # Connect builder signals and show window
-        self.builder.connect_signals(self)
-        self.window.show_all()
-
-        # Get attached devices
-        self.refresh()
+        self.profile.mark('distros and logos')
 
         # Init log
         init_log = ">>> Start USB Creator: {} <<<".format(datetime.now())
@@ -148,14 +175,35 @@ class USBCreator(object):
 
         # Version information
         self.version_text = _("Version")
-        self.pck_version = getPackageVersion('usb-creator')
+        self.pck_version = get_version('usb-creator')
         self.set_statusbar_message("{}: {}".format(self.version_text, self.pck_version))
+        self.profile.mark('version')
+
+        # Connect builder signals and show window
+        self.builder.connect_signals(self)
+        self.window.show_all()
+        self.profile.mark('show window')
+
+        # Get attached devices when the window has been drawn
+        GLib.idle_add(self.on_startup_idle)
+
+    def on_startup_idle(self):
+        # Get attached devices and follow changes
+        self.refresh()
+        self.udisks2.watch(self.on_devices_changed)
+        self.profile.mark('devices')
+        self.profile.report()
+        return False
 
     # ===============================================
     # Main window functions
     # ===============================================
 
     def on_btnExecute_clicked(self, widget):
+        if self.iso_scan is not None or self.iso_scan_timer is not None:
+            # The required space is not known yet
+            self.set_statusbar_message(_("Scanning the ISO directory..."))
+            return True
         if exists(self.device["path"]):
             iso = self.device["new_iso"]
             iso_path = self.txtIso.get_text().strip()
@@ -167,27 +215,35 @@ class USBCreator(object):
                 WarningDialog(self.btnExecute.get_label().replace('_', ''), msg.format(iso_path))
                 return True
 
-            # Check if there is enough space
+            # Check if there is enough space (unknown: the backend checks it, exit code 8)
             available = self.device["available"]
-            if (available) - self.device["new_iso_required"] < 0:
+            if available is not None and available - self.device["new_iso_required"] < 0:
                 msg = _("There is not enough space available on the pen drive.\n"
                         "Please, remove unneeded files before continuing.")
                 WarningDialog(self.btnExecute.get_label().replace('_', ''), msg)
                 return True
-                
+
+            # The backend would stop with exit code 9: let the user pick the distribution first
+            if self.iso_info is not None and not self.iso_info['distro'] and not self.iso_info['loopback'] \
+               and not self.chkForceDistro.get_active() and not self.chkWriteSingle.get_active():
+                msg = _("Unable to determine the distribution name.\n"
+                        "Select a distribution in the 'Manual' section.")
+                WarningDialog(self.btnExecute.get_label().replace('_', ''), msg)
+                return True
+
             # Check if user wants to force the distribution configuration
-            options = ''
+            options = []
             if self.chkForceDistro.get_active():
-                options = '-f {} '.format(self.cmbDistrosHandler.getValue())
+                options = ['-f', self.cmbDistrosHandler.getValue()]
             if self.chkPartition.get_active():
-                options += '-p'
+                options.append('-p')
             if self.chkWriteSingle.get_active():
-                options = '-u'
+                options = ['-u']
 
-            cmd = 'usb-creator {options} "{iso}" {device}'.format(options=options, iso=iso, device=self.device["path"])
+            args = ['usb-creator'] + options + [iso, self.device["path"]]
             self.log.clear()
-            self.log.write("Execute command: {}".format(cmd))
-            self.exec_command(cmd)
+            self.log.write("Execute command: {}".format(' '.join(shlex.quote(a) for a in args)))
+            self.exec_command(args)
 
     def on_chkPartition_toggled(self, widget):
         if widget.get_active(): self.chkWriteSingle.set_active(False)
@@ -207,8 +263,7 @@ class USBCreator(object):
                     if exists(iso_path):
                         self.log.write("Remove ISO: {}".format(iso_path))
                         shell_exec("usb-creator -r {iso} {device}".format(iso=iso_path, device=self.device["path"]))
-                        self.refresh()
-                        self.fill_treeview_usbcreator(self.device["mount"])
+                        self.refresh_selected()
 
     def on_btnBrowseIso_clicked(self, widget):
         file_filter = Gtk.FileFilter()
@@ -230,29 +285,14 @@ class USBCreator(object):
 
     def on_txtIso_changed(self, widget=None):
         iso_path = self.txtIso.get_text().strip()
+        self.cancel_iso_scan()
         if exists(iso_path):
             if isdir(iso_path):
-                isos = glob(join(iso_path, '*.iso'))
-                if isos:
-                    required = 0
-                    for iso in isos:
-                        # Check if these ISOs overwrite current USB ISOs
-                        check_usb_iso_size = 0
-                        check_usb_iso = join(self.device["mount"], basename(iso))
-                        if exists(check_usb_iso):
-                            check_usb_iso_size = self.get_iso_size(check_usb_iso)
-                        required += (self.get_iso_size(iso) - check_usb_iso_size)
-                    if required < 0:
-                        required = 0
-                    self.lblRequired.set_label("{}: {} MB".format(self.required_text, int(required / 1024)))
-                    # Save the info
-                    self.device["new_iso"] = iso_path
-                    self.device["new_iso_required"] = required
-                    self.log.write("New ISO directory: {}, {}".format(iso_path, required))
-                else:
-                    self.device["new_iso"] = ''
-                    self.device["new_iso_required"] = 0
-                    self.log.write("New ISO directory does not contain ISOs: {}".format(iso_path))
+                # Scan the directory in the background when the user stops typing
+                self.device["new_iso"] = ''
+                self.device["new_iso_required"] = 0
+                self.lblRequired.set_label('')
+                self.iso_scan_timer = GLib.timeout_add(ISO_SCAN_DELAY, self.start_iso_scan, iso_path)
             else:
                 # Check if this ISO overwrites current USB ISO
                 if self.chkWriteSingle.get_active():
@@ -268,13 +308,17 @@ class USBCreator(object):
                 self.device["new_iso"] = iso_path
                 self.device["new_iso_required"] = required
                 self.log.write("New ISO: {}, {}".format(iso_path, required))
+                self.introspect_selected_iso(iso_path)
+                return
         else:
             self.device["new_iso"] = ''
             self.device["new_iso_required"] = 0
             self.lblRequired.set_text('')
+        self.introspect_selected_iso('')
 
     def on_btnRefresh_clicked(self, widget=None):
-        self.refresh()
+        # ISOs can be copied to the device outside usb-creator
+        self.refresh_selected()
 
     def on_btnUnmount_clicked(self, widget):
         unmount_text = _("Unmount")
@@ -305,7 +349,6 @@ class USBCreator(object):
                 dp_size = drive[dp]['total_size']
                 if dp_size > size:
                     size = dp_size
-                    available = drive[dp]['free_size']
                     device = dp
             
             if device:
@@ -318,9 +361,9 @@ class USBCreator(object):
                     except Exception as e:
                         self.show_message(5)
                         self.log.write("ERROR: %s" % str(e))
-                # Save size and available space
+                # Save size and available space (only read for the selected drive)
                 size = drive[device]['total_size']
-                available = drive[device]['free_size']
+                available = self.udisks2.get_free_size(device)
             else:
                 msg = _("No partition found.\n"
                         "Please format the USB before you continue.")
@@ -330,9 +373,11 @@ class USBCreator(object):
                 available = drive['free_size']
 
             self.fill_treeview_usbcreator(mount)
-            if available == 0:
-                available = drive['free_size']
-            self.lblAvailable.set_label("{}: {} MB".format(self.available_text, int(available / 1024)))
+            if available is None:
+                # Not mounted and the file system cannot be read: not the size of the drive
+                self.lblAvailable.set_label("{}: {}".format(self.available_text, _("unknown")))
+            else:
+                self.lblAvailable.set_label("{}: {} MB".format(self.available_text, int(available / 1024)))
 
             # Save the info
             self.device['path'] = drive_path
@@ -366,6 +411,11 @@ class USBCreator(object):
 
     # Close the gui
     def on_usbcreator_destroy(self, widget):
+        # Stop the privileged helper that was kept for this session
+        HelperClient().stop()
+        self.cancel_iso_scan()
+        self.iso_introspection_cancel.set()
+        self.iso_pool.shutdown(wait=False)
         # Close the app
         Gtk.main_quit()
     
@@ -374,48 +424,66 @@ class USBCreator(object):
     # ===============================================
     
     def refresh(self):
-        self.udisks2.fill_devices()
+        # The device tree follows the UDisks signals: it is only built again when
+        # it was marked dirty and the list is only filled again when the drives changed.
+        # Returns True if the device list was filled.
+        rebuilt = self.udisks2.fill_devices()
         drives = self.udisks2.get_drives()
+        if not rebuilt and drives == [row[0] for row in self.cmbDevice.get_model() or []]:
+            return False
         force_changed = False
         if self.cmbDeviceHandler.getIndex() == 0:
             force_changed = True
         self.cmbDeviceHandler.fillComboBox(drives, 0)
         if force_changed:
             self.on_cmbDevice_changed()
-            
+        return True
+
+    def refresh_selected(self):
+        # Update the device list if it changed, otherwise only the selected device
+        # (free space and ISOs changed by a job)
+        if not self.refresh():
+            self.on_cmbDevice_changed()
+
+    def on_devices_changed(self, drive_paths):
+        # Called by Udisks2 when devices were (un)plugged, (un)mounted or changed
+        if self.process is not None:
+            # The device list is refreshed when the backend is done
+            return
+        if self.udisks2.fill_devices():
+            # A change could not be applied to the device tree
+            drive_paths = set(drive_paths) | set([self.cmbDeviceHandler.getValue()])
+        drives = self.udisks2.get_drives()
+        current_drives = [row[0] for row in self.cmbDevice.get_model() or []]
+        selected = self.cmbDeviceHandler.getValue()
+        if drives != current_drives:
+            # Keep the selected drive if it is still there
+            self.cmbDeviceHandler.fillComboBox(drives, selected or '')
+        elif selected in drive_paths:
+            self.on_cmbDevice_changed()
+
     def get_iso_logo(self, search_string):
-        search_string = search_string.lower()
-        iso_logo = ''
-        hkey = ''
-        hratio = 0
-        for key, logo in list(self.logos.items()):
-            if key not in ["iso", "linux"]:
-                ratio = get_fuzzy_ratio(key, search_string, 2)
-                if ratio > 80:
-                    if ratio > hratio or (ratio == hratio and len(key) > len(hkey)):
-                        hratio = ratio
-                        hkey = key
-                        iso_logo = logo
-        return iso_logo
+        return self.logo_resolver.resolve(search_string)
 
     def fill_treeview_usbcreator(self, mount=''):
         isos_list = []
         # columns: checkbox, image (logo), device, driver
         column_types = ['bool', 'GdkPixbuf.Pixbuf', 'str', 'str']
+        # Results of lookups for a previous list are dropped
+        self.iso_list_generation += 1
+        generation = self.iso_list_generation
+        lookups = []
 
         if exists(mount):
             isos = glob(join(mount, '*.iso'))
             for iso in isos:
                 iso_name = basename(iso)
                 iso_size = "{} MB".format(int(self.get_iso_size(iso) / 1024))
-                # Try to get the logo by ISO name
+                # Try to get the logo by ISO name (memoized)
                 iso_logo = self.get_iso_logo(iso_name)
                 if not iso_logo:
-                    # Try to get the logo by ISO label
-                    lbl = getoutput('usb-creator -l "{0}"'.format(iso))
-                    if lbl:
-                        iso_logo = self.get_iso_logo(lbl[0])
-                if not iso_logo:
+                    # The label is read from the ISO in the background
+                    lookups.append(iso)
                     iso_logo = self.logos["iso"]
                 self.log.write("ISO on {}: {}, {}, {}".format(mount, iso_name, iso_size, iso_logo))
                 isos_list.append([False, iso_logo, iso_name, iso_size])
@@ -423,44 +491,201 @@ class USBCreator(object):
         # Fill treeview
         self.tvUsbIsosHandler.fillTreeview(contentList=isos_list, columnTypesList=column_types)
 
-    def exec_command(self, command):
+        for iso in lookups:
+            future = self.iso_pool.submit(self.lookup_iso_logo, iso)
+            future.add_done_callback(
+                lambda f, iso=iso: GLib.idle_add(self.set_iso_logo, generation, basename(iso), f))
+
+    def lookup_iso_logo(self, iso):
+        # Runs in a worker thread: try to get the logo by ISO label.
+        # Only the 32 bytes of the volume label are read from the device:
+        # the ISO is not parsed and nothing is added to the ISO cache.
+        info = self.iso_cache.get(iso)
+        lbl = info['label'] if info and info['label'] else read_iso_label(iso)
+        if lbl:
+            return self.get_iso_logo(lbl)
+        return ''
+
+    def set_iso_logo(self, generation, iso_name, future):
+        # Main loop: update the row of the ISO if the list was not refilled
+        if generation == self.iso_list_generation and not future.cancelled():
+            try:
+                iso_logo = future.result()
+            except Exception as e:
+                self.log.write("ERROR: {}: {}".format(iso_name, e))
+                iso_logo = ''
+            if iso_logo:
+                names = self.tvUsbIsosHandler.getColumnValues(colNr=2)
+                if iso_name in names:
+                    self.log.write("Logo of {}: {}".format(iso_name, iso_logo))
+                    self.tvUsbIsosHandler.setImage(names.index(iso_name), 1, iso_logo)
+        return False
+
+    def start_iso_scan(self, iso_dir):
+        # Sum the ISO sizes in a thread: check if these ISOs overwrite current USB ISOs
+        self.iso_scan_timer = None
+        scan = IsoDirScan(iso_dir, self.device["mount"], self.get_iso_size,
+                          progress=lambda required, done, count:
+                              GLib.idle_add(self.on_iso_scan_progress, scan, required, done, count),
+                          finished=lambda required, count:
+                              GLib.idle_add(self.on_iso_scan_finished, scan, required, count))
+        self.iso_scan = scan
+        scan.start()
+        return False
+
+    def cancel_iso_scan(self):
+        if self.iso_scan_timer is not None:
+            GLib.source_remove(self.iso_scan_timer)
+            self.iso_scan_timer = None
+        if self.iso_scan is not None:
+            self.iso_scan.cancel()
+            self.iso_scan = None
+
+    def on_iso_scan_progress(self, scan, required, done, count):
+        # Main loop: partial total of a running scan
+        if scan is self.iso_scan:
+            self.lblRequired.set_label("{}: {} MB ({}/{})".format(self.required_text, int(required / 1024),
+                                                                  done, count))
+        return False
+
+    def on_iso_scan_finished(self, scan, required, count):
+        if scan is not self.iso_scan:
+            return False
+        self.iso_scan = None
+        if count:
+            self.lblRequired.set_label("{}: {} MB".format(self.required_text, int(required / 1024)))
+            # Save the info
+            self.device["new_iso"] = scan.iso_dir
+            self.device["new_iso_required"] = required
+            self.log.write("New ISO directory: {}, {}".format(scan.iso_dir, required))
+        else:
+            self.lblRequired.set_label('')
+            self.log.write("New ISO directory does not contain ISOs: {}".format(scan.iso_dir))
+        return False
+
+    def introspect_selected_iso(self, iso_path):
+        # Introspect the selected ISO in the background while the user picks the options:
+        # the backend finds the results in the ISO cache when Execute is pressed
+        if iso_path == self.iso_introspection_path:
+            return
+        if self.iso_introspection is not None:
+            # Drop a queued introspection, stop a running one at the next directory record
+            self.iso_introspection.cancel()
+            self.iso_introspection_cancel.set()
+            self.iso_introspection = None
+        self.iso_introspection_path = iso_path
+        self.iso_info = None
+        if not iso_path:
+            return
+        self.iso_introspection_cancel = threading.Event()
+        future = self.iso_pool.submit(introspect_iso, iso_path, self.distro_scorer,
+                                      self.iso_cache, self.iso_introspection_cancel)
+        self.iso_introspection = future
+        future.add_done_callback(lambda f: GLib.idle_add(self.on_iso_introspected, f))
+
+    def on_iso_introspected(self, future):
+        # Main loop: show the distribution if the ISO is still selected
+        if future is not self.iso_introspection or future.cancelled():
+            return False
+        self.iso_introspection = None
         try:
-            # Run the command in a separate thread
-            self.set_buttons_state(False)
-            name = 'cmd'
-            t = ExecuteThreadedCommands([command], self.queue)
-            self.threads[name] = t
-            t.daemon = True
-            t.start()
-            self.queue.join()
-            GLib.timeout_add(1000, self.check_thread, name)
+            info = future.result()
+        except Exception as e:
+            self.log.write("ERROR: {}: {}".format(self.iso_introspection_path, e))
+            return False
+        self.iso_info = info
+        self.log.write("ISO information of {}: {}".format(self.iso_introspection_path, info))
+        if info['distro']:
+            self.set_statusbar_message(_("Distribution: {}").format(info['distro']))
+            # Preselect the distribution for the 'Manual' section
+            self.cmbDistrosHandler.selectValue(info['distro'])
+        elif info['loopback']:
+            self.set_statusbar_message(_("Unknown distribution: the loopback.cfg of the ISO will be used"))
+        else:
+            self.set_statusbar_message(_("Unknown distribution: select a distribution in the 'Manual' section"))
+        return False
 
+    def exec_command(self, args):
+        # Run the backend and follow it through its progress pipe and exit status:
+        # the main loop wakes up for progress events only
+        try:
+            self.set_buttons_state(False)
+            read_fd, write_fd = os.pipe()
+            env = dict(os.environ)
+            env[PROGRESS_FD_ENV] = str(write_fd)
+            try:
+                self.process = subprocess.Popen(args, env=env, pass_fds=(write_fd,))
+            except Exception:
+                os.close(read_fd)
+                raise
+            finally:
+                os.close(write_fd)
         except Exception as detail:
+            self.set_buttons_state(True)
             ErrorDialog(self.btnExecute.get_label().replace('_', ''), detail)
-
-    def check_thread(self, name):
-        if self.threads[name].is_alive():
-            self.set_progress()
-            if not self.queue.empty():
-                ret = self.queue.get()
-                self.log.write("Queue returns: {}".format(ret), 'check_thread')
-                self.queue.task_done()
-                self.show_message(ret)
+            return
+
+        os.set_blocking(read_fd, False)
+        self.progress_fd = read_fd
+        self.progress_reader = ProgressReader()
+        self.progress_phase = ''
+        self.progress_watch = GLib.io_add_watch(read_fd, GLib.PRIORITY_DEFAULT,
+                                                GLib.IOCondition.IN | GLib.IOCondition.HUP,
+                                                self.on_progress_event)
+        GLib.child_watch_add(GLib.PRIORITY_DEFAULT, self.process.pid, self.on_process_exit)
+
+    def on_progress_event(self, fd, condition):
+        if self.read_progress():
             return True
+        # Backend closed the pipe
+        self.progress_watch = None
+        self.close_progress()
+        return False
+
+    def on_process_exit(self, pid, status):
+        if os.WIFEXITED(status):
+            ret = os.WEXITSTATUS(status)
+        else:
+            ret = -os.WTERMSIG(status)
+        # The child watch reaped the process
+        self.process.returncode = ret
+        self.process = None
+        self.log.write(">> Process is done: {}".format(ret), 'on_process_exit')
+
+        # Handle the events that are still in the pipe
+        self.read_progress()
+        self.close_progress()
 
-        # Thread is done
-        self.log.write(">> Thread is done", 'check_thread')
-        ret = 0
-        if not self.queue.empty():
-            ret = self.queue.get()
-            self.queue.task_done()
-        del self.threads[name]
         self.set_buttons_state(True)
-        self.refresh()
-        self.fill_treeview_usbcreator(self.device["mount"])
+        self.refresh_selected()
         self.set_statusbar_message("{}: {}".format(self.version_text, self.pck_version))
         self.show_message(ret)
-        return False
+
+    def read_progress(self):
+        # Returns False when the pipe was closed
+        events = []
+        is_open = True
+        while self.progress_fd is not None:
+            try:
+                data = os.read(self.progress_fd, 65536)
+            except BlockingIOError:
+                break
+            if not data:
+                is_open = False
+                break
+            events.extend(self.progress_reader.feed(data))
+        if events:
+            self.handle_progress_event(events[-1])
+        return is_open
+
+    def close_progress(self):
+        if self.progress_watch is not None:
+            GLib.source_remove(self.progress_watch)
+            self.progress_watch = None
+        if self.progress_fd is not None:
+            os.close(self.progress_fd)
+            self.progress_fd = None
+        self.stop_pulse()
 
     def set_buttons_state(self, enable):
         if not enable:
@@ -495,47 +720,35 @@ class USBCreator(object):
             self.chkPartition.set_active(False)
             self.chkWriteSingle.set_active(False)
 
-    def get_logos(self):
-        logos_dict = {}
-        logos_path = join(self.mediaDir, 'grub/themes/usb-creator/icons')
-        logos = glob(join(logos_path, '*.png'))
-        for logo in logos:
-            key = splitext(basename(logo))[0]
-            logos_dict[key] = logo
-        return logos_dict
-
-    def set_progress(self):
-        if exists(self.log_file):
-            msg = ''
-            last_line = getoutput("tail -50 {} | grep -v DEBUG | grep -v ==".format(self.log_file))
-            for line in reversed(last_line):
-                # Check for session start line: that is the last line to check
-                if ">>>>>" in line and "<<<<<" in line:
-                    break
-                for chk_line in self.log_lines:
-                    if chk_line[0].lower() in line.lower():
-                        # Message to show
-                        msg = chk_line[2]
-                        if chk_line[1] == 1:
-                            # Set progress
-                            match_obj = re.search(r'[0-9]+', line)
-                            if match_obj:
-                                if 'bytes' in line:
-                                    iso_size = float(self.device["new_iso_required"])
-                                    if iso_size > 0:
-                                        # Calculate percentage from dd output
-                                        perc = (float(match_obj.group(0)) / 1024) / iso_size
-                                        #print((" dd: {}%").format(perc))
-                                else:
-                                    perc = float(match_obj.group(0)) / 100
-                                self.pbUsbCreator.set_fraction(perc)
-                        else:
-                            # Just pulse
-                            self.pbUsbCreator.pulse()
-                        break
-                if msg:
-                    break
-            self.set_statusbar_message(msg)
+    def handle_progress_event(self, event):
+        phase = event.get('phase', '')
+        msg = self.phase_messages.get(phase)
+        if msg is None:
+            return
+        if event.get('event') == 'phase' and phase != self.progress_phase:
+            self.pbUsbCreator.set_fraction(0)
+        self.progress_phase = phase
+        total = event.get('bytes_total', 0)
+        if total > 0:
+            self.stop_pulse()
+            if event.get('event') == 'progress':
+                self.pbUsbCreator.set_fraction(min(1, event['bytes_done'] / total))
+                rate = event.get('avg_rate') or 0
+                if rate > 0:
+                    msg = "{} ({:.1f} MB/s)".format(msg, rate / (1024 * 1024))
+        elif self.progress_pulse is None:
+            # No byte counts in this phase: just pulse
+            self.progress_pulse = GLib.timeout_add(200, self.pulse_progress)
+        self.set_statusbar_message(msg)
+
+    def pulse_progress(self):
+        self.pbUsbCreator.pulse()
+        return True
+
+    def stop_pulse(self):
+        if self.progress_pulse is not None:
+            GLib.source_remove(self.progress_pulse)
+            self.progress_pulse = None
 
     def set_statusbar_message(self, message):
         if message is not None:
@@ -544,18 +757,13 @@ class USBCreator(object):
 
     def get_iso_size(self, iso):
         # Returns kilobytes
-        total_size = 0
-        if exists(iso):
+        # Unpacked ISOs: sizes are cached per directory until its modification time changes
+        try:
             if isdir(iso):
-                for dirpath, dirnames, filenames in os.walk(iso):
-                    for f in filenames:
-                        fp = join(dirpath, f)
-                        # skip if it is symbolic link
-                        if not islink(fp):
-                            total_size += getsize(fp)
-            else:
-                total_size = getsize(iso)
-        return (total_size / 1024)
+                return tree_size(iso)
+            return getsize(iso) / 1024
+        except OSError:
+            return 0
 
     def show_message(self, cmdOutput):
         try:
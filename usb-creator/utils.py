@@ -3,7 +3,7 @@
 import subprocess
 import re
 import threading
-from os.path import expanduser
+from os.path import expanduser, join, dirname, abspath, exists
 from fuzzywuzzy import fuzz
 
 def shell_exec_popen(command, kwargs={}):
@@ -117,6 +117,27 @@ def getPackageVersion(package, candidate=False):
     return version
 
 
+def get_version(package='usb-creator'):
+    """ Return the version from the package metadata or version.py
+        (source tree) without asking apt.
+    """
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+        try:
+            return version(package)
+        except PackageNotFoundError:
+            pass
+    except ImportError:
+        pass
+    version_py = join(dirname(dirname(abspath(__file__))), 'version.py')
+    if exists(version_py):
+        about = {}
+        with open(version_py) as f:
+            exec(f.read(), about)
+        return about.get('__version__', '')
+    return getPackageVersion(package)
+
+
 # Convert string to number
 def str_to_nr(stringnr, toInt=False):
     nr = 0